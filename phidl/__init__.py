@@ -1,4 +1,5 @@
 from phidl.device_layout import Device, Port, Layer, LayerSet
+from phidl.device_layout import PortTable, PolygonTable, ReferenceTable
 from phidl.device_layout import make_device
 from phidl.quickplotter import quickplot, quickplot2
 from phidl.device_layout import __version__, reset
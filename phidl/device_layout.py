@@ -29,7 +29,12 @@ from numpy import sqrt, mod, pi, sin, cos
 from numpy.linalg import norm
 import warnings
 import hashlib
+import weakref
+from functools import wraps
 from phidl.constants import _CSS3_NAMES_TO_HEX
+from phidl.gdsii import write_gds as _write_gds
+from phidl.gdsii import _pack_reference_table
+from phidl.oasis import write_oas as _write_oas
 
 # Remove this once gdspy fully deprecates current_library
 import gdspy.library
@@ -214,8 +219,9 @@ class _GeometryHelper(object):
 
     @x.setter
     def x(self, destination):
-        destination = (destination, self.center[1])
-        self.move(destination = destination, origin = self.center, axis = 'x')
+        center = self.center
+        destination = (destination, center[1])
+        self.move(destination = destination, origin = center, axis = 'x')
 
     @property
     def y(self):
@@ -223,8 +229,9 @@ class _GeometryHelper(object):
 
     @y.setter
     def y(self, destination):
-        destination = ( self.center[0], destination)
-        self.move(destination = destination, origin = self.center, axis = 'y')
+        center = self.center
+        destination = ( center[0], destination)
+        self.move(destination = destination, origin = center, axis = 'y')
 
     @property
     def xmax(self):
@@ -289,16 +296,63 @@ class _GeometryHelper(object):
 
 
 
+class _PortMidpoint(np.ndarray):
+    """ The midpoint array of a Port.  Modifying it in place (e.g.
+    ``port.midpoint[0] = 5`` or ``np.add(m, 1, out = m)``) counts as a change
+    of the Port, see Port._modified().  The results of computations with it
+    are plain numpy arrays """
+    __slots__ = ('_port',)
+
+    def __array_finalize__(self, obj):
+        self._port = None
+
+    def __array_wrap__(self, array, context = None, return_scalar = False):
+        if array is self:
+            self._modified()
+            return self
+        array = array.view(np.ndarray)
+        return array[()] if return_scalar else array
+
+    def __setitem__(self, index, value):
+        np.ndarray.__setitem__(self, index, value)
+        self._modified()
+
+    def __repr__(self):
+        return repr(self.view(np.ndarray))
+
+    def __reduce__(self):
+        return self.view(np.ndarray).__reduce__()
+
+    def _modified(self):
+        if self._port is not None:
+            self._port._modified()
+
+
+def _port_midpoint(port, midpoint):
+    midpoint = np.array(midpoint, dtype = 'float64').view(_PortMidpoint)
+    midpoint._port = port
+    return midpoint
+
+
 class Port(object):
     _next_uid = 0
 
+    # Ports are created in very large numbers (every DeviceReference has its
+    # own copies), so their attributes are slots and their info dict is only
+    # created when it is first used.  The __dict__ slot keeps custom
+    # attributes (port.my_attribute = ...) working, the dictionary itself is
+    # only allocated when one is set
+    __slots__ = ('name', 'parent', 'uid', '_midpoint', '_orientation',
+                 '_width', '_version', '_info', '__dict__')
+
     def __init__(self, name = None, midpoint = (0,0), width = 1, orientation = 0, parent = None):
+        self._version = 0
+        self.parent = parent
         self.name = name
-        self.midpoint = np.array(midpoint, dtype = 'float64')
+        self.midpoint = midpoint
         self.width = width
         self.orientation = mod(orientation,360)
-        self.parent = parent
-        self.info = {}
+        self._info = None
         self.uid = Port._next_uid
         if self.width < 0: raise ValueError('[PHIDL] Port creation error: width must be >=0')
         Port._next_uid += 1
@@ -307,6 +361,66 @@ class Port(object):
         return ('Port (name %s, midpoint %s, width %s, orientation %s)' % \
                 (self.name, self.midpoint, self.width, self.orientation))
 
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state.update({k:getattr(self, k) for k in Port.__slots__
+                      if k != '__dict__' and hasattr(self, k)})
+        return state
+
+    def __setstate__(self, state):
+        state = dict(state)
+        self._version = 0
+        if '_midpoint' in state:
+            self._midpoint = _port_midpoint(self, state.pop('_midpoint'))
+        for k, v in state.items():
+            setattr(self, k, v)
+
+    @property
+    def info(self):
+        if self._info is None:
+            self._info = {}
+        return self._info
+
+    @info.setter
+    def info(self, info):
+        self._info = info
+
+    # The geometric attributes of a Port are properties so that every change
+    # (including in-place changes of the midpoint array) calls _modified(),
+    # which lets the DeviceReferences of the parent Device know when their
+    # cached (transformed) copies of the Port are out of date
+    def _modified(self):
+        self._version += 1
+        if isinstance(self.parent, (Device, DeviceReference)):
+            self.parent._ports_version += 1
+
+    @property
+    def midpoint(self):
+        return self._midpoint
+
+    @midpoint.setter
+    def midpoint(self, midpoint):
+        self._midpoint = _port_midpoint(self, midpoint)
+        self._modified()
+
+    @property
+    def orientation(self):
+        return self._orientation
+
+    @orientation.setter
+    def orientation(self, orientation):
+        self._orientation = orientation
+        self._modified()
+
+    @property
+    def width(self):
+        return self._width
+
+    @width.setter
+    def width(self, width):
+        self._width = width
+        self._modified()
+
     @property
     def endpoints(self):
         dxdy = np.array([
@@ -343,17 +457,25 @@ class Port(object):
     def center(self):
         return self.midpoint
     
-    # Use this function instead of copy() (which will not create a new numpy array
-    # for self.midpoint) or deepcopy() (which will also deepcopy the self.parent
-    # DeviceReference recursively, causing performance issues)
+    # Use this function instead of deepcopy() (which will also deepcopy the
+    # self.parent DeviceReference recursively, causing performance issues).
+    # The info dict is only copied if it is not empty.  The midpoint array is
+    # always copied: it can be modified in place, so sharing it between the
+    # copies (copy-on-write) would let an in-place edit reach both Ports
     def _copy(self, new_uid = True):
-        new_port = Port(name = self.name, midpoint = self.midpoint,
-            width = self.width, orientation = self.orientation,
-            parent = self.parent)
-        new_port.info = deepcopy(self.info)
+        new_port = Port.__new__(Port)
+        new_port._version = 0
+        new_port.name = self.name
+        new_port._midpoint = _port_midpoint(new_port, self._midpoint)
+        new_port._width = self._width
+        new_port._orientation = self._orientation
+        new_port.parent = self.parent
+        new_port._info = deepcopy(self._info) if self._info else None
         if new_uid == False:
             new_port.uid = self.uid
-            Port._next_uid -= 1
+        else:
+            new_port.uid = Port._next_uid
+            Port._next_uid += 1
         return new_port
 
     def rotate(self, angle = 45, center = None):
@@ -364,6 +486,184 @@ class Port(object):
         return self
 
 
+class _FrozenPort(Port):
+    """ A Port of a frozen Device, whose attributes can't be modified """
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        raise _frozen_error(name, getattr(self.parent, '_internal_name', ''))
+
+    def __reduce_ex__(self, protocol):
+        return (_frozen_port, (Port.__getstate__(self),))
+
+    def rotate(self, angle = 45, center = None):
+        raise _frozen_error('rotate', getattr(self.parent, '_internal_name', ''))
+
+
+def _frozen_port(state):
+    port = Port.__new__(Port)
+    port.__setstate__(state)
+    port._midpoint.flags.writeable = False
+    port.__class__ = _FrozenPort
+    return port
+
+
+class PortTable(object):
+    """ A flat, array-backed collection of ports, such as all the ports in a
+    Device hierarchy.  Positions, orientations and widths are stored in numpy
+    arrays (``midpoints``, ``orientations``, ``widths``) so that whole tables
+    can be transformed at once.  The name, uid, parent and info of each entry
+    come from the original Port it was derived from (``source_ports``), and
+    Port objects are only created when an entry is accessed """
+
+    def __init__(self, midpoints, orientations, widths, source_ports):
+        self.midpoints = np.asarray(midpoints, dtype = np.float64).reshape(-1,2)
+        self.orientations = np.asarray(orientations, dtype = np.float64)
+        self.widths = np.asarray(widths, dtype = np.float64)
+        self.source_ports = list(source_ports)
+
+    @classmethod
+    def from_ports(cls, ports):
+        ports = list(ports)
+        return cls(midpoints = [p.midpoint for p in ports],
+                   orientations = [p.orientation for p in ports],
+                   widths = [p.width for p in ports],
+                   source_ports = ports)
+
+    @classmethod
+    def concatenate(cls, tables):
+        tables = list(tables)
+        if len(tables) == 0:
+            return cls.from_ports([])
+        return cls(midpoints = np.concatenate([t.midpoints for t in tables]),
+                   orientations = np.concatenate([t.orientations for t in tables]),
+                   widths = np.concatenate([t.widths for t in tables]),
+                   source_ports = [p for t in tables for p in t.source_ports])
+
+    def __len__(self):
+        return len(self.source_ports)
+
+    def __repr__(self):
+        return ('PortTable (%s ports)' % len(self))
+
+    @property
+    def names(self):
+        return [p.name for p in self.source_ports]
+
+    @property
+    def uids(self):
+        return np.array([p.uid for p in self.source_ports], dtype = np.int64)
+
+    def __getitem__(self, n):
+        """ Creates a Port for entry ``n`` which has the same name, uid and
+        parent as the Port it was derived from """
+        source = self.source_ports[n]
+        new_port = Port(name = source.name, midpoint = self.midpoints[n],
+                        width = self.widths[n], orientation = self.orientations[n],
+                        parent = source.parent)
+        new_port._info = deepcopy(source._info) if source._info else None
+        new_port.uid = source.uid
+        Port._next_uid -= 1
+        return new_port
+
+    def to_ports(self):
+        return [self[n] for n in range(len(self))]
+
+    def transform(self, origin = (0,0), rotation = None, x_reflection = False):
+        """ Returns a new PortTable with the GDS-type transformation (as in
+        DeviceReference._transform_port) applied to every port at once """
+        midpoints = np.array(self.midpoints)
+        orientations = np.array(self.orientations)
+        if x_reflection:
+            midpoints[:,1] = -midpoints[:,1]
+            orientations = -orientations
+        if rotation is not None and len(self) > 0:
+            midpoints = _rotate_points(midpoints, angle = rotation, center = [0, 0])
+            orientations = orientations + rotation
+        if origin is not None:
+            midpoints = midpoints + np.array(origin)
+        return PortTable(midpoints, mod(orientations, 360), self.widths, self.source_ports)
+
+
+
+def _raises_if_frozen(method):
+    """ Decorator for the methods which modify a Device or one of its
+    elements, which raise an error if that Device has been frozen (see
+    Device._freeze()).  References are checked against the Device that owns
+    them and Polygons against their parent Device """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if isinstance(self, Device):
+            device = self
+        elif hasattr(self, 'owner'):
+            device = self.owner
+        else:
+            device = self.__dict__.get('parent')
+        if device is not None and device._frozen:
+            raise _frozen_error(method.__name__, device._internal_name)
+        return method(self, *args, **kwargs)
+    return wrapper
+
+
+def _frozen_error(method_name, device_name):
+    return ValueError('[PHIDL] %s() cannot modify Device "%s" because it is '
+        'frozen, e.g. because it was returned by a device_lru_cache with '
+        'copy = False.  Add it to another Device with add_ref(), or use '
+        'geometry.deepcopy() to get a copy which can be modified' %
+        (method_name, device_name))
+
+
+def _raise_frozen(name):
+    def method(self, *args, **kwargs):
+        raise _frozen_error(name, self.__dict__.get('_device_name', ''))
+    method.__name__ = name
+    return method
+
+
+class _FrozenList(list):
+    """ The polygons, references, labels and paths lists of a frozen Device,
+    which raise an error when modified """
+    def __reduce__(self):
+        return (type(self), (list(self),), self.__dict__)
+
+
+class _FrozenDict(dict):
+    """ The ports dictionary of a frozen Device """
+    def __reduce__(self):
+        return (type(self), (dict(self),), self.__dict__)
+
+
+class _PortDict(dict):
+    """ The ports dictionary of a Device (or DeviceReference), which
+    increments the owner's _ports_version whenever a Port is added or
+    removed """
+    def __reduce__(self):
+        return (type(self), (dict(self),), self.__dict__)
+
+
+def _bumps_ports_version(method):
+    def wrapper(self, *args, **kwargs):
+        result = method(self, *args, **kwargs)
+        owner = self.__dict__.get('_owner')
+        if owner is not None:
+            owner._ports_version += 1
+        return result
+    wrapper.__name__ = method.__name__
+    return wrapper
+
+
+for _name in ['__setitem__', '__delitem__', '__ior__', 'pop', 'popitem',
+              'clear', 'update', 'setdefault']:
+    setattr(_PortDict, _name, _bumps_ports_version(getattr(dict, _name)))
+for _name in ['append', 'extend', 'insert', 'pop', 'remove', 'clear', 'sort',
+              'reverse', '__setitem__', '__delitem__', '__iadd__', '__imul__']:
+    setattr(_FrozenList, _name, _raise_frozen(_name))
+for _name in ['__setitem__', '__delitem__', 'pop', 'popitem', 'clear',
+              'update', 'setdefault']:
+    setattr(_FrozenDict, _name, _raise_frozen(_name))
+
+
+
 class Polygon(gdspy.Polygon, _GeometryHelper):
 
     def __init__(self, points, gds_layer, gds_datatype, parent):
@@ -372,16 +672,31 @@ class Polygon(gdspy.Polygon, _GeometryHelper):
             datatype=gds_datatype)
 
 
+    @classmethod
+    def _from_array(cls, points, gds_layer, gds_datatype, parent):
+        """ Creates a Polygon which holds the [N][2] array ``points`` itself,
+        skipping the conversion done in __init__ """
+        polygon = cls.__new__(cls)
+        polygon.parent = parent
+        polygon.polygons = [points]
+        polygon.layers = [gds_layer]
+        polygon.datatypes = [gds_datatype]
+        polygon.properties = {}
+        return polygon
+
+
     @property
     def bbox(self):
         return self.get_bounding_box()
 
+    @_raises_if_frozen
     def rotate(self, angle = 45, center = (0,0)):
         super(Polygon, self).rotate(angle = angle*pi/180, center = center)
         if self.parent is not None:
             self.parent._bb_valid = False
         return self
 
+    @_raises_if_frozen
     def move(self, origin = (0,0), destination = None, axis = None):
         """ Moves elements of the Device from the origin point to the destination.  Both
          origin and destination can be 1x2 array-like, Port, or a key
@@ -413,6 +728,7 @@ class Polygon(gdspy.Polygon, _GeometryHelper):
         return self
 
 
+    @_raises_if_frozen
     def mirror(self, p1 = (0,1), p2 = (0,0)):
         for n, points in enumerate(self.polygons):
             self.polygons[n] = _reflect_points(points, p1, p2)
@@ -426,6 +742,287 @@ class Polygon(gdspy.Polygon, _GeometryHelper):
 
 
 
+# Storage of the ``polygons``, ``layers`` and ``datatypes`` slots of gdspy
+# PolygonSets, which PolygonTable shadows with properties
+_polygonset_slots = (gdspy.PolygonSet.polygons, gdspy.PolygonSet.layers,
+                     gdspy.PolygonSet.datatypes)
+
+
+def _polygonset_property(slot):
+    def fget(self):
+        self._unpack()
+        return slot.__get__(self)
+    def fset(self, value):
+        self._unpack()
+        value = _PolygonTableList(value)
+        value._table = self
+        slot.__set__(self, value)
+        self._columns = None
+    return property(fget, fset)
+
+
+class _PolygonTableList(list):
+    """ The ``polygons``, ``layers`` or ``datatypes`` list of a PolygonTable,
+    which marks the columns of the table as out of date when it is modified
+    (modifying the polygons in place needs no such mark, since they are
+    views into the ``points`` column) """
+    def __reduce__(self):
+        return (list, (list(self),))
+
+
+def _invalidates_columns(method):
+    def wrapper(self, *args, **kwargs):
+        table = self.__dict__.get('_table')
+        if table is not None:
+            if (table.parent is not None) and table.parent._frozen:
+                raise _frozen_error(method.__name__, table.parent._internal_name)
+            table._columns = None
+        return method(self, *args, **kwargs)
+    wrapper.__name__ = method.__name__
+    return wrapper
+
+
+for _name in ['append', 'extend', 'insert', 'pop', 'remove', 'clear', 'sort',
+              'reverse', '__setitem__', '__delitem__', '__iadd__', '__imul__']:
+    setattr(_PolygonTableList, _name, _invalidates_columns(getattr(list, _name)))
+
+
+class PolygonTable(gdspy.PolygonSet, _GeometryHelper):
+    """ Columnar store of many polygons, e.g. all the polygons on one layer
+    of a Device (see Device.compact_polygons()).  The vertices of all the
+    polygons are kept in the single [N][2] array ``points``, polygon i being
+    ``points[offsets[i]:offsets[i+1]]``, and their layers and datatypes in
+    the integer arrays ``gds_layers`` and ``gds_datatypes``.
+
+    A PolygonTable is a gdspy PolygonSet.  Its ``polygons``, ``layers`` and
+    ``datatypes`` lists are only created when they are accessed (the
+    polygons as views into ``points``), and the columns are only rebuilt
+    from them if one of the lists has been modified.  move(), rotate(),
+    mirror(), get_bounding_box() and get_polygons() work on the whole
+    ``points`` array at once, and table[i] returns polygon i as a Polygon
+    whose points are a view """
+
+    polygons = _polygonset_property(_polygonset_slots[0])
+    layers = _polygonset_property(_polygonset_slots[1])
+    datatypes = _polygonset_property(_polygonset_slots[2])
+
+    def __init__(self, polygons, gds_layer, gds_datatype, parent = None):
+        self.parent = parent
+        self.properties = {}
+        self._lists = False
+        self._columns = _polygon_columns(polygons, [gds_layer]*len(polygons),
+                                         [gds_datatype]*len(polygons))
+
+
+    def __getstate__(self):
+        self._pack()
+        state = dict(self.__dict__)
+        state.pop('_lists', None)
+        state['properties'] = self.properties
+        return state
+
+    def __setstate__(self, state):
+        state = dict(state)
+        self.properties = state.pop('properties')
+        self.__dict__.update(state)
+
+    def __len__(self):
+        if self._columns is None:
+            return len(_polygonset_slots[0].__get__(self))
+        return len(self._columns[1]) - 1
+
+    def get_polygons(self, by_spec = False):
+        """ Returns copies of the polygons, as gdspy.Cell.get_polygons() does
+        for the polygons of a cell: a list, a dictionary keyed by (layer,
+        datatype) if ``by_spec`` is True, or only the polygons on layer
+        ``by_spec``.  They are slices of a single copy of ``points`` """
+        points, offsets, gds_layers, gds_datatypes = self._pack()
+        if by_spec is True:
+            keys = np.stack([gds_layers, gds_datatypes], axis = -1)
+            unique_keys, inverse = np.unique(keys, axis = 0, return_inverse = True)
+            inverse = inverse.reshape(-1)
+            return {(int(layer), int(datatype)):self._slices(np.nonzero(inverse == n)[0])
+                    for n, (layer, datatype) in enumerate(unique_keys)}
+        if by_spec is False:
+            return self._slices(np.arange(len(offsets) - 1))
+        layer, datatype = by_spec
+        return self._slices(np.nonzero((gds_layers == layer) & (gds_datatypes == datatype))[0])
+
+    def _slices(self, indices):
+        """ Returns copies of polygons ``indices``, as slices of one array """
+        points, offsets = self._pack()[:2]
+        sizes = offsets[indices + 1] - offsets[indices]
+        points = points[np.repeat(offsets[indices] - np.cumsum(sizes) + sizes, sizes) +
+                        np.arange(np.sum(sizes))]
+        bounds = np.concatenate([[0], np.cumsum(sizes)]).tolist()
+        return [points[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+    def __getitem__(self, index):
+        points, offsets, gds_layers, gds_datatypes = self._pack()
+        n = range(len(offsets) - 1)[index]
+        return Polygon._from_array(points[offsets[n]:offsets[n+1]],
+                                   int(gds_layers[n]), int(gds_datatypes[n]),
+                                   self.parent)
+
+    def _unpack(self):
+        """ Creates the ``polygons``, ``layers`` and ``datatypes`` lists from
+        the columns, which remain valid until one of the lists is modified """
+        if self.__dict__.get('_lists'):
+            return
+        points, offsets, gds_layers, gds_datatypes = self._columns
+        bounds = offsets.tolist()
+        values = ([points[start:end] for start, end in zip(bounds[:-1], bounds[1:])],
+                  gds_layers.tolist(), gds_datatypes.tolist())
+        for slot, value in zip(_polygonset_slots, values):
+            value = _PolygonTableList(value)
+            value._table = self
+            slot.__set__(self, value)
+        self._lists = True
+
+    def _pack(self):
+        if self._columns is None:
+            lists = [slot.__get__(self) for slot in _polygonset_slots]
+            if not (len(lists[0]) == len(lists[1]) == len(lists[2])):
+                raise ValueError('[PHIDL] PolygonTable: the polygons, layers and '
+                                 'datatypes lists must have the same length')
+            self._columns = _polygon_columns(*lists)
+            # The polygons of the old lists are not views into the new
+            # columns, the lists are created again when next accessed
+            for slot, value in zip(_polygonset_slots, lists):
+                value._table = None
+                slot.__delete__(self)
+            self._lists = False
+        return self._columns
+
+    def _set_frozen(self, frozen):
+        """ Makes the columns read-only (or writeable again).  The lists are
+        dropped, so that they are created again as read-only views """
+        columns = self._pack()
+        if self.__dict__.get('_lists'):
+            for slot in _polygonset_slots:
+                slot.__get__(self)._table = None
+                slot.__delete__(self)
+            self._lists = False
+        if frozen:
+            for array in columns:
+                array.flags.writeable = False
+        else:
+            self._columns = tuple(_writeable(array) for array in columns)
+
+    @property
+    def points(self):
+        return self._pack()[0]
+
+    @property
+    def offsets(self):
+        return self._pack()[1]
+
+    @property
+    def gds_layers(self):
+        return self._pack()[2]
+
+    @property
+    def gds_datatypes(self):
+        return self._pack()[3]
+
+    @property
+    def bbox(self):
+        return self.get_bounding_box()
+
+    def get_bounding_box(self):
+        points = self.points
+        if len(points) == 0:
+            return None
+        return np.array([np.min(points, axis = 0), np.max(points, axis = 0)])
+
+    @_raises_if_frozen
+    def translate(self, dx, dy):
+        points = self.points
+        points += np.array((dx, dy), dtype = np.float64)
+        return self
+
+    @_raises_if_frozen
+    def rotate(self, angle = 45, center = (0,0)):
+        points = self.points
+        ca, sa = cos(angle*pi/180), sin(angle*pi/180)
+        c0 = np.array(center, dtype = np.float64)
+        p = points - c0
+        points[:,0] = p[:,0]*ca - p[:,1]*sa + c0[0]
+        points[:,1] = p[:,0]*sa + p[:,1]*ca + c0[1]
+        if self.parent is not None:
+            self.parent._bb_valid = False
+        return self
+
+    @_raises_if_frozen
+    def move(self, origin = (0,0), destination = None, axis = None):
+        if destination is None:
+            destination = origin
+            origin = [0,0]
+        o = _parse_coordinate(origin)
+        d = _parse_coordinate(destination)
+        if axis == 'x': d = (d[0], o[1])
+        if axis == 'y': d = (o[0], d[1])
+        dx, dy = np.array(d) - o
+        self.translate(dx, dy)
+        if self.parent is not None:
+            self.parent._bb_valid = False
+        return self
+
+    @_raises_if_frozen
+    def mirror(self, p1 = (0,1), p2 = (0,0)):
+        points = self.points
+        p1 = np.array(p1, dtype = np.float64);  p2 = np.array(p2, dtype = np.float64)
+        direction = p2 - p1
+        projection = np.outer(np.dot(points - p1, direction)/norm(direction)**2, direction)
+        points[...] = 2*(p1 + projection) - points
+        if self.parent is not None:
+            self.parent._bb_valid = False
+        return self
+
+
+
+def _writeable(array):
+    """ Makes the read-only ``array`` writeable again, or returns a copy of
+    it if it is a view into an array which is still read-only """
+    try:
+        array.flags.writeable = True
+        return array
+    except ValueError:
+        return np.array(array)
+
+
+def _set_polygonset_frozen(polygonset, device_name, frozen):
+    """ Makes the arrays and lists of a PolygonSet of a frozen Device
+    read-only (or modifiable again) """
+    if isinstance(polygonset, PolygonTable):
+        polygonset._set_frozen(frozen)
+    elif frozen:
+        for points in polygonset.polygons:
+            points.flags.writeable = False
+        for name in ['polygons', 'layers', 'datatypes']:
+            setattr(polygonset, name, _FrozenList(getattr(polygonset, name)))
+            getattr(polygonset, name)._device_name = device_name
+    else:
+        polygonset.polygons = [_writeable(points) for points in polygonset.polygons]
+        polygonset.layers = list(polygonset.layers)
+        polygonset.datatypes = list(polygonset.datatypes)
+
+
+def _polygon_columns(polygons, gds_layers, gds_datatypes):
+    """ Packs lists of polygons, layers and datatypes into the columns of a
+    PolygonTable: (points, offsets, gds_layers, gds_datatypes) """
+    sizes = np.array([len(p) for p in polygons], dtype = np.int64)
+    offsets = np.zeros(len(polygons) + 1, dtype = np.int64)
+    np.cumsum(sizes, out = offsets[1:])
+    if len(polygons) > 0:
+        points = np.concatenate(polygons).astype(np.float64, copy = False)
+    else:
+        points = np.zeros((0,2), dtype = np.float64)
+    return (points, offsets, np.array(gds_layers, dtype = np.int32).reshape(-1),
+            np.array(gds_datatypes, dtype = np.int32).reshape(-1))
+
+
+
 def make_device(fun, config = None, **kwargs):
     config_dict = {}
     if type(config) is dict:
@@ -446,9 +1043,133 @@ def make_device(fun, config = None, **kwargs):
 
 
 
+# Bounding box cache of Devices.  When a Device computes its bounding box from
+# the cached bounding boxes of the Devices it references, it registers itself
+# here as a "referrer" of each of them, so that any later change to one of
+# those Devices can mark the cached bounding boxes of all its referrers (and
+# their referrers, etc) as invalid
+_bbox_referrers = weakref.WeakKeyDictionary()
+# The Device._bb_valid property wraps the gdspy.Cell._bb_valid slot (and
+# Device relies on the other Cell/PolygonSet slots of gdspy 1.6, such as
+# PolygonSet.properties), hence the gdspy>=1.6 requirement in setup.py
+_cell_bb_valid = gdspy.Cell._bb_valid
+
+
+def _cached_reference_bbox(ref, compute_bbox):
+    """ Returns the bounding box of a DeviceReference or CellArray ``ref``,
+    reusing the previously computed value as long as neither the reference's
+    rotation/reflection/magnification nor the geometry of its parent Device
+    has changed.  The cached value is stored relative to the reference's
+    origin, so moving the reference does not require recomputing it.  On a
+    cache miss the bounding box is computed by calling ``compute_bbox()`` """
+    cell = ref.ref_cell
+    if not isinstance(cell, Device):
+        return compute_bbox()
+    cell.get_bounding_box() # Make sure cell._bb_version is up to date
+    key = (id(cell), cell._bb_version, ref.rotation, ref.magnification, ref.x_reflection)
+    if isinstance(ref, gdspy.CellArray):
+        key += (ref.columns, ref.rows, tuple(ref.spacing))
+    origin = np.zeros(2) if ref.origin is None else np.array(ref.origin, dtype = np.float64)
+    cache = ref.__dict__.get('_bb_cache')
+    if (cache is None) or (cache[0] != key):
+        bbox = compute_bbox()
+        if bbox is not None:
+            bbox = np.array(bbox) - origin
+        cache = (key, bbox)
+        ref._bb_cache = cache
+    if cache[1] is None:
+        return None
+    return cache[1] + origin
+
+
+# A random offset which fixes common rounding errors intrinsic
+# to floating point math. Example: with a precision of 0.1, the
+# floating points 7.049999 and 7.050001 round to different values
+# (7.0 and 7.1), but offset values (7.220485 and 7.220487) don't
+_HASH_MAGIC_OFFSET = .17048614
+
+
+def _quantize(points, precision):
+    return ((points/precision) + _HASH_MAGIC_OFFSET).astype(np.int64)
+
+
+def _sorted_polygon_hashes(polygons, precision):
+    """ Returns the sorted SHA1 digests of the quantized ``polygons``.  All
+    the vertices are quantized in a single pass, and each polygon is then
+    hashed as a view into the quantized array """
+    sizes = np.array([len(p) for p in polygons], dtype = np.int64)
+    points = _quantize(np.concatenate(polygons), precision)
+    ends = np.cumsum(sizes)
+    return np.sort([hashlib.sha1(points[start:end]).digest()
+                    for start, end in zip(ends - sizes, ends)])
+
+
+def _update_layer_hashes(final_hash, polygons_by_spec, precision):
+    """ Feeds the (sorted) layers and polygon hashes of ``polygons_by_spec``
+    to ``final_hash`` as described in Device.hash_geometry() """
+    if len(polygons_by_spec) == 0:
+        return
+    layers = np.array(list(polygons_by_spec.keys()))
+    sorted_layers = layers[np.lexsort((layers[:,0], layers[:,1]))]
+    for layer in sorted_layers:
+        layer_hash = hashlib.sha1(layer.astype(np.int64)).digest()
+        polygon_hashes = _sorted_polygon_hashes(polygons_by_spec[tuple(layer)], precision)
+        final_hash.update(layer_hash)
+        for ph in polygon_hashes:
+            final_hash.update(ph)
+
+
+def _port_hash_record(port, precision):
+    x, y = port.midpoint
+    return b''.join([str(port.name).encode(), b'\0',
+                     _quantize(np.array([x, y, port.width], dtype = np.float64), precision).tobytes(),
+                     np.float64(np.round(port.orientation % 360, 6)).tobytes()])
+
+
+def _label_hash_record(label, precision):
+    values = [label.layer, label.texttype, label.anchor, label.rotation or 0,
+              label.magnification or 1, bool(label.x_reflection)]
+    return b''.join([label.text.encode(), b'\0',
+                     _quantize(np.array(label.position, dtype = np.float64), precision).tobytes(),
+                     np.array(values, dtype = np.float64).tobytes()])
+
+
+def _reference_hash_record(ref, child_hash, precision):
+    """ Bytes identifying the placement of the cell with hash ``child_hash``
+    by the reference ``ref`` """
+    transform = [np.round((ref.rotation or 0) % 360, 6), ref.magnification or 1,
+                 bool(ref.x_reflection)]
+    origin = np.zeros(2) if ref.origin is None else np.array(ref.origin, dtype = np.float64)
+    record = [child_hash, np.array(transform, dtype = np.float64).tobytes(),
+              _quantize(origin, precision).tobytes()]
+    if isinstance(ref, gdspy.CellArray):
+        record += [np.array([ref.columns, ref.rows], dtype = np.int64).tobytes(),
+                   _quantize(np.array(ref.spacing, dtype = np.float64), precision).tobytes()]
+    return b''.join(record)
+
+
+def _reference_hash_records(ref, child_hash, precision):
+    """ Returns the list of _reference_hash_record() of every reference in
+    ``ref``, which is either a single reference or a ReferenceTable, whose
+    records are computed from its arrays at once """
+    if not isinstance(ref, ReferenceTable):
+        return [_reference_hash_record(ref, child_hash, precision)]
+    transforms = np.column_stack([np.round(np.mod(ref.rotations, 360), 6),
+                                  np.nan_to_num(ref.magnifications, nan = 1),
+                                  ref.x_reflections]).astype(np.float64)
+    origins = _quantize(ref.origins, precision)
+    rows = np.hstack([transforms.view(np.uint8).reshape(len(ref), -1),
+                      origins.view(np.uint8).reshape(len(ref), -1)])
+    return [child_hash + row.tobytes() for row in rows]
+
+
 class Device(gdspy.Cell, _GeometryHelper):
 
     _next_uid = 0
+    _bb_version = 0
+    _content_version = 0
+    _ports_version = 0
+    _frozen = False
 
     def __init__(self, *args, **kwargs):
         if len(args) > 0:
@@ -496,6 +1217,7 @@ class Device(gdspy.Cell, _GeometryHelper):
     def __lshift__(self, element):
         return self.add_ref(element)
 
+    @_raises_if_frozen
     def __setitem__(self, key, element):
         """ Allow adding polygons and cell references like D['arc3'] = pg.arc() """
         if isinstance(element, (DeviceReference,Polygon,CellArray)):
@@ -524,6 +1246,141 @@ class Device(gdspy.Cell, _GeometryHelper):
         if bbox is None:  bbox = ((0,0),(0,0))
         return np.array(bbox)
 
+    # Adding, removing or modifying a Port of the Device (or replacing the
+    # whole dictionary) increments self._ports_version, which is what the
+    # DeviceReferences of the Device check to know whether their cached
+    # (transformed) copies of the ports are out of date
+    @property
+    def ports(self):
+        return self._ports
+
+    @ports.setter
+    def ports(self, ports):
+        if type(ports) is dict:
+            ports = _PortDict(ports)
+        if isinstance(ports, _PortDict):
+            ports._owner = self
+        self._ports = ports
+        self._ports_version += 1
+
+    @property
+    def _bb_valid(self):
+        try:
+            return _cell_bb_valid.__get__(self, Device)
+        except AttributeError:
+            return False
+
+    @_bb_valid.setter
+    def _bb_valid(self, valid):
+        # The cached bounding box can only be marked valid by
+        # get_bounding_box(), this also means freshly copied or unpickled
+        # Devices always start out with an invalid bounding box
+        if valid: return
+        was_valid = self._bb_valid
+        _cell_bb_valid.__set__(self, False)
+        # Once a Device is invalid, all of its referrers are already invalid
+        if was_valid:
+            for D in list(_bbox_referrers.get(self, ())):
+                D._bb_valid = False
+
+    def get_bounding_box(self):
+        """ Returns the bounding box of the Device, or None if the Device
+        is empty.  The bounding box is cached, and is computed from the
+        Device's own polygons plus the cached bounding boxes of the Devices
+        it references """
+        if not self._bb_valid:
+            bboxes = []
+            polygons = []
+            for polygonset in self.polygons:
+                if isinstance(polygonset, PolygonTable):
+                    # Use the vertex buffer directly instead of its polygons
+                    if len(polygonset) > 0: polygons.append(polygonset.points)
+                else:
+                    polygons += polygonset.polygons
+            polygons += [p for path in self.paths for p in path.to_polygonset().polygons]
+            if len(polygons) > 0:
+                points = np.concatenate(polygons)
+                bboxes.append([np.min(points, axis = 0), np.max(points, axis = 0)])
+            for r in self.references:
+                if isinstance(r.ref_cell, Device):
+                    if r.ref_cell not in _bbox_referrers:
+                        _bbox_referrers[r.ref_cell] = weakref.WeakSet()
+                    _bbox_referrers[r.ref_cell].add(self)
+                    r.ref_cell.get_bounding_box()
+                ref_bbox = r.get_bounding_box()
+                if ref_bbox is not None:
+                    bboxes.append(ref_bbox)
+            if len(bboxes) > 0:
+                bboxes = np.array(bboxes)
+                self._bounding_box = np.array([np.min(bboxes[:,0], axis = 0),
+                                               np.max(bboxes[:,1], axis = 0)])
+            else:
+                self._bounding_box = None
+            self._bb_version += 1
+            _cell_bb_valid.__set__(self, True)
+
+        if self._bounding_box is None:
+            return None
+        return np.array(self._bounding_box)
+
+    def get_polygons(self, by_spec = False, depth = None):
+        """ Returns the polygons of the Device, as gdspy.Cell.get_polygons().
+        The polygons of PolygonTables are sliced from their vertex buffer,
+        without creating their ``polygons`` lists """
+        if ((depth is not None and depth < 0) or
+                not any(isinstance(p, PolygonTable) for p in self.polygons)):
+            return super(Device, self).get_polygons(by_spec, depth)
+        next_depth = None if depth is None else depth - 1
+        if by_spec is True:
+            polygons = {}
+            def add(new_polygons):
+                for key, p in new_polygons.items():
+                    polygons.setdefault(key, []).extend(p)
+        else:
+            polygons = []
+            add = polygons.extend
+        for polygonset in self.polygons:
+            if isinstance(polygonset, PolygonTable):
+                add(polygonset.get_polygons(by_spec))
+            elif by_spec is True:
+                for points, layer, datatype in zip(polygonset.polygons,
+                        polygonset.layers, polygonset.datatypes):
+                    polygons.setdefault((layer, datatype), []).append(np.array(points))
+            else:
+                add([np.array(points) for points, layer, datatype
+                     in zip(polygonset.polygons, polygonset.layers, polygonset.datatypes)
+                     if (by_spec is False) or ((layer, datatype) == tuple(by_spec))])
+        for path in self.paths:
+            if by_spec is False:
+                add(path.get_polygons())
+            else:
+                path_polygons = path.get_polygons(True)
+                add(path_polygons if by_spec is True else path_polygons.get(tuple(by_spec), []))
+        for reference in self.references:
+            add(reference.get_polygons(by_spec, next_depth))
+        return polygons
+
+    @_raises_if_frozen
+    def add(self, element):
+        if isinstance(element, ReferenceTable):
+            self.references.append(element)
+            self._bb_valid = False
+            return self
+        return super(Device, self).add(element)
+
+    @_raises_if_frozen
+    def remove_polygons(self, test):
+        return super(Device, self).remove_polygons(test)
+
+    @_raises_if_frozen
+    def remove_paths(self, test):
+        return super(Device, self).remove_paths(test)
+
+    @_raises_if_frozen
+    def remove_labels(self, test):
+        return super(Device, self).remove_labels(test)
+
+    @_raises_if_frozen
     def add_ref(self, device, alias = None):
         """ Takes a Device and adds it as a DeviceReference to the current
         Device.  """
@@ -541,6 +1398,43 @@ class Device(gdspy.Cell, _GeometryHelper):
         return d                # Return the DeviceReference (CellReference)
 
 
+    @_raises_if_frozen
+    def add_refs(self, device, origins = (0,0), rotations = 0, x_reflections = False,
+                 magnifications = None):
+        """ Adds many references to the same Device at once, e.g. for building
+        large arrays or meanders.  ``origins`` is an array-like of shape
+        [N][2], while ``rotations`` (in degrees), ``x_reflections`` and
+        ``magnifications`` can each be either a single value or an array of
+        length N.  The references are stored as a single ReferenceTable, which
+        keeps their transformations in numpy arrays and only creates a
+        DeviceReference for a reference when it is indexed (table[i]).
+        Returns the ReferenceTable """
+        if not isinstance(device, Device):
+            raise TypeError("""[PHIDL] add_refs() was passed something that
+            was not a Device object. """)
+        origins = np.array(origins, dtype = np.float64).reshape(-1, 2)
+        if magnifications is None:
+            magnifications = np.nan
+        num_refs = max(len(origins), np.size(rotations), np.size(x_reflections),
+                       np.size(magnifications))
+        if len(origins) == 0:
+            num_refs = 0
+        try:
+            table = ReferenceTable(device,
+                origins = np.broadcast_to(origins, (num_refs, 2)),
+                rotations = np.broadcast_to(np.asarray(rotations, dtype = np.float64), (num_refs,)),
+                x_reflections = np.broadcast_to(np.asarray(x_reflections, dtype = bool), (num_refs,)),
+                magnifications = np.broadcast_to(np.asarray(magnifications, dtype = np.float64), (num_refs,)))
+        except ValueError:
+            raise ValueError('[PHIDL] add_refs() The arguments `origins`, `rotations`, '
+                '`x_reflections` and `magnifications` must all have the same length')
+        if num_refs > 0:
+            table.owner = self
+            self.add(table)
+        return table
+
+
+    @_raises_if_frozen
     def add_polygon(self, points, layer = None):
         # Check if input a list of polygons by seeing if it's 3 levels deep
         try:
@@ -580,6 +1474,58 @@ class Device(gdspy.Cell, _GeometryHelper):
         return polygon
 
 
+    @_raises_if_frozen
+    def _add_polygons(self, polygons, layer = None):
+        """ Adds a list of [N][2] arrays as Polygons on a single layer.
+        Unlike add_polygon(), the points are not checked or converted, so
+        the Polygons hold the arrays themselves (which may be views) """
+        gds_layer, gds_datatype = _parse_layer(layer)
+        new_polygons = [Polygon._from_array(points, gds_layer, gds_datatype, self)
+                        for points in polygons]
+        self.polygons += new_polygons
+        self._bb_valid = False
+        return new_polygons
+
+
+    @_raises_if_frozen
+    def _adopt_polygonsets(self, polygonsets):
+        """ Adds the polygons of gdspy PolygonSets as Polygons (one per
+        polygon, as add_polygon() would) which reuse the existing point
+        arrays, e.g. when converting the cells of an imported library """
+        new_polygons = [Polygon._from_array(points, layer, datatype, self)
+                        for ps in polygonsets
+                        for points, layer, datatype
+                        in zip(ps.polygons, ps.layers, ps.datatypes)]
+        self.polygons += new_polygons
+        self._bb_valid = False
+        return new_polygons
+
+
+    @_raises_if_frozen
+    def compact_polygons(self):
+        """ Replaces the polygons of the Device by one PolygonTable per
+        (layer, datatype), which stores all their vertices in a single array.
+        This greatly reduces the memory used by Devices made of many small
+        polygons, e.g. fill patterns or text.  Polygons with properties or
+        which have an alias are left as they are """
+        aliased = set(id(e) for e in self.aliases.values())
+        polygonsets = []
+        polygons_by_spec = {}
+        for polygonset in self.polygons:
+            if (len(polygonset.properties) > 0) or (id(polygonset) in aliased):
+                polygonsets.append(polygonset)
+                continue
+            for points, layer, datatype in zip(polygonset.polygons,
+                    polygonset.layers, polygonset.datatypes):
+                polygons_by_spec.setdefault((layer, datatype), []).append(points)
+        for (layer, datatype), polygons in polygons_by_spec.items():
+            polygonsets.append(PolygonTable(polygons, layer, datatype, parent = self))
+        self.polygons = polygonsets
+        self._bb_valid = False
+        return self
+
+
+    @_raises_if_frozen
     def add_array(self, device, columns = 2, rows = 2, spacing = (100,100), alias = None):
         if not isinstance(device, Device):
             raise TypeError("""[PHIDL] add_array() was passed something that
@@ -592,6 +1538,7 @@ class Device(gdspy.Cell, _GeometryHelper):
         return a                # Return the CellArray
 
 
+    @_raises_if_frozen
     def add_port(self, name = None, midpoint = (0,0), width = 1, orientation = 45, port = None):
         """ Can be called to copy an existing port like add_port(port = existing_port) or
         to create a new port add_port(myname, mymidpoint, mywidth, myorientation).
@@ -612,9 +1559,11 @@ class Device(gdspy.Cell, _GeometryHelper):
         if p.name in self.ports:
             raise ValueError('[DEVICE] add_port() error: Port name "%s" already exists in this Device (name "%s", uid %s)' % (p.name, self._internal_name, self.uid))
         self.ports[p.name] = p
+        self._content_version += 1
         return p
 
 
+    @_raises_if_frozen
     def add_label(self, text = 'hello', position = (0,0), magnification = None, rotation = None, anchor = 'o', layer = 255):
         if len(text) >= 1023:
             raise ValueError('[DEVICE] label() error: Text too long (limit 1024 chars)')
@@ -624,6 +1573,7 @@ class Device(gdspy.Cell, _GeometryHelper):
         l = Label(text = text, position = position, anchor = anchor, magnification = magnification, rotation = rotation,
                                  layer = gds_layer, texttype = gds_datatype)
         self.add(l)
+        self._content_version += 1
         return l
 
 
@@ -634,41 +1584,70 @@ class Device(gdspy.Cell, _GeometryHelper):
 
     def write_gds(self, filename, unit = 1e-6, precision = 1e-9,
                   auto_rename = True, max_cellname_length = 28,
-                  cellname = 'toplevel'):
-        if filename[-4:] != '.gds':  filename += '.gds'
-        referenced_cells = list(self.get_dependencies(recursive=True))
-        all_cells = [self] + referenced_cells
+                  cellname = 'toplevel', compression = None,
+                  deduplicate = False):
+        """ Writes the Device and all the Devices it references to a GDS file.
+        Filenames ending in .gds.gz or .gds.zst (or passing ``compression`` =
+        "gzip" or "zstd") produce a compressed file.  With ``deduplicate`` =
+        True, Devices with identical contents (e.g. from repeated calls to the
+        same geometry function) are written as a single cell """
+        if not filename.endswith(('.gds', '.gds.gz', '.gds.zst')):
+            filename += '.gds'
+        names = self._get_gds_names(auto_rename, max_cellname_length, cellname)
+        # Write the gds, streaming the cells in dependency order
+        _write_gds(filename, cells = [self], names = names, libname = 'library',
+                   unit = unit, precision = precision, compression = compression,
+                   deduplicate = deduplicate)
+        return filename
 
-        # Autofix names so there are no duplicates
-        if auto_rename == True:
-            all_cells_sorted = sorted(all_cells, key=lambda x: x.uid)
-            # all_cells_names = [c._internal_name for c in all_cells_sorted]
-            all_cells_original_names = [c.name for c in all_cells_sorted]
-            used_names = {cellname}
-            n = 1
-            for c in all_cells_sorted:
-                if max_cellname_length is not None:
-                    new_name = c._internal_name[:max_cellname_length]
-                else:
-                    new_name = c._internal_name
-                temp_name = new_name
-                while temp_name in used_names:
-                    n += 1
-                    temp_name = new_name + ('%0.3i' % n)
-                new_name = temp_name
-                used_names.add(new_name)
-                c.name = new_name
-            self.name = cellname
-        # Write the gds
-        gdspy.write_gds(filename, cells=all_cells, name='library',
-                        unit=unit, precision=precision)
-        # Return cells to their original names if they were auto-renamed
-        if auto_rename == True:
-            for n,c in enumerate(all_cells_sorted):
-                c.name = all_cells_original_names[n]
+
+    def write_oas(self, filename, unit = 1e-6, precision = 1e-9,
+                  auto_rename = True, max_cellname_length = 28,
+                  cellname = 'toplevel', compression_level = 6, port_layer = None):
+        """ Writes the Device and all the Devices it references to an OASIS
+        file (requires gdstk).  CellArrays are stored as repetitions.  If
+        ``port_layer`` is specified, the Ports of every Device are written as
+        labels on that layer and can be recovered with import_oas() """
+        if filename[-4:] != '.oas':  filename += '.oas'
+        names = self._get_gds_names(auto_rename, max_cellname_length, cellname)
+        if port_layer is not None:
+            port_layer = _parse_layer(port_layer)
+        _write_oas(filename, cells = [self], names = names, libname = 'library',
+                   unit = unit, precision = precision,
+                   compression_level = compression_level, port_layer = port_layer)
         return filename
 
 
+    def _get_gds_names(self, auto_rename = True, max_cellname_length = 28,
+                       cellname = 'toplevel'):
+        """ Returns a dictionary of the names each cell in the hierarchy will be
+        written with.  The names of the cells themselves are left untouched """
+        if auto_rename == False:
+            return {}
+        referenced_cells = list(self.get_dependencies(recursive=True))
+        all_cells = [self] + referenced_cells
+        # Autofix names so there are no duplicates
+        all_cells_sorted = sorted(all_cells, key=lambda x: x.uid)
+        names = {}
+        used_names = {cellname}
+        n = 1
+        for c in all_cells_sorted:
+            if max_cellname_length is not None:
+                new_name = c._internal_name[:max_cellname_length]
+            else:
+                new_name = c._internal_name
+            temp_name = new_name
+            while temp_name in used_names:
+                n += 1
+                temp_name = new_name + ('%0.3i' % n)
+            new_name = temp_name
+            used_names.add(new_name)
+            names[c] = new_name
+        names[self] = cellname
+        return names
+
+
+    @_raises_if_frozen
     def remap_layers(self, layermap = {}, include_labels = True):
         layermap = {_parse_layer(k):_parse_layer(v) for k,v in layermap.items()}
 
@@ -691,8 +1670,11 @@ class Device(gdspy.Cell, _GeometryHelper):
                         new_layer = layermap[original_layer]
                         l.layer = new_layer[0]
                         l.texttype = new_layer[1]
+            D._bb_valid = False
+            D._content_version += 1
         return self
 
+    @_raises_if_frozen
     def remove_layers(self, layers = (), include_labels = True, invert_selection = False):
         layers = [_parse_layer(l) for l in layers]
         all_D = list(self.get_dependencies(True))
@@ -705,6 +1687,7 @@ class Device(gdspy.Cell, _GeometryHelper):
                 polygonset.polygons =  [p for p,keep in zip(polygonset.polygons,  polygons_to_keep) if keep]
                 polygonset.layers =    [p for p,keep in zip(polygonset.layers,    polygons_to_keep) if keep]
                 polygonset.datatypes = [p for p,keep in zip(polygonset.datatypes, polygons_to_keep) if keep]
+            D._bb_valid = False
 
             if include_labels == True:
                 new_labels = []
@@ -716,9 +1699,11 @@ class Device(gdspy.Cell, _GeometryHelper):
                     if keep_layer:
                         new_labels += [l]
                 D.labels = new_labels
+                D._content_version += 1
         return self
 
 
+    @_raises_if_frozen
     def distribute(self, elements = 'all', direction = 'x', spacing = 100, separation = True, edge = 'center'):
         if direction not in ({'x','y'}):
             raise ValueError("[PHIDL] distribute(): 'direction' argument must be either 'x' or'y'")
@@ -755,6 +1740,7 @@ class Device(gdspy.Cell, _GeometryHelper):
         return self
 
 
+    @_raises_if_frozen
     def align(self, elements = 'all', alignment = 'ymax'):
         if elements == 'all': elements = (self.polygons + self.references)
         if alignment not in (['x','y','xmin', 'xmax', 'ymin','ymax']):
@@ -767,6 +1753,7 @@ class Device(gdspy.Cell, _GeometryHelper):
         return self
 
 
+    @_raises_if_frozen
     def flatten(self,  single_layer = None):
         if single_layer is None:
             super(Device, self).flatten(single_layer=None, single_datatype=None, single_texttype=None)
@@ -781,6 +1768,7 @@ class Device(gdspy.Cell, _GeometryHelper):
         return self
 
 
+    @_raises_if_frozen
     def absorb(self, reference):
         """ Flattens and absorbs polygons from an underlying
         DeviceReference into the Device, destroying the reference
@@ -802,28 +1790,45 @@ class Device(gdspy.Cell, _GeometryHelper):
         The Ports returned are copies of the originals, but each copy
         has the same ``uid'' as the original so that they can be
         traced back to the original if needed"""
-        port_list = [p._copy(new_uid = False) for p in self.ports.values()]
+        return self.get_port_table(depth = depth).to_ports()
 
-        if depth is None or depth > 0:
-            for r in self.references:
-                if depth is None: new_depth = None
-                else:             new_depth = depth - 1
-                ref_ports = r.parent.get_ports(depth=new_depth)
 
-                # Transform ports that came from a reference
-                ref_ports_transformed = []
-                for rp in ref_ports:
-                    new_port = rp._copy(new_uid = False)
-                    new_midpoint, new_orientation = r._transform_port(rp.midpoint, \
-                    rp.orientation, r.origin, r.rotation, r.x_reflection)
-                    new_port.midpoint = new_midpoint
-                    new_port.new_orientation = new_orientation
-                    ref_ports_transformed.append(new_port)
-                port_list += ref_ports_transformed
+    def get_port_table(self, depth = None):
+        """ Like get_ports(), but returns a PortTable holding the positions,
+        orientations and widths of all the ports as numpy arrays instead
+        of creating a Port object for each of them.  Each Device in the
+        hierarchy is only visited once, and the ports of a referenced Device
+        are transformed as a whole for every reference to it """
+        return self._get_port_table(depth, memo = {})
 
-        return port_list
 
+    def _get_port_table(self, depth, memo):
+        if (self, depth) in memo:
+            return memo[(self, depth)]
+        tables = [PortTable.from_ports(self.ports.values())]
+        if depth is None or depth > 0:
+            new_depth = None if depth is None else depth - 1
+            for r in self.references:
+                ref_table = r.parent._get_port_table(new_depth, memo)
+                if len(ref_table) == 0: continue
+                if isinstance(r, ReferenceTable):
+                    tables.append(r._transform_port_table(ref_table))
+                elif isinstance(r, gdspy.CellArray):
+                    # Each element of the array is offset by the spacing
+                    # before the reference transformation is applied
+                    for i in range(r.columns):
+                        for j in range(r.rows):
+                            offset = (r.spacing[0]*i, r.spacing[1]*j)
+                            element_table = ref_table.transform(origin = offset)
+                            tables.append(element_table.transform(r.origin, r.rotation, r.x_reflection))
+                else:
+                    tables.append(ref_table.transform(r.origin, r.rotation, r.x_reflection))
+        table = PortTable.concatenate(tables)
+        memo[(self, depth)] = table
+        return table
 
+
+    @_raises_if_frozen
     def remove(self, items):
         if not _is_iterable(items):  items = [items]
         for item in items:
@@ -837,7 +1842,7 @@ class Device(gdspy.Cell, _GeometryHelper):
                 try:
                     if isinstance(item, gdspy.PolygonSet):
                         self.polygons.remove(item)
-                    if isinstance(item, gdspy.CellReference):
+                    if isinstance(item, (gdspy.CellReference, ReferenceTable)):
                         self.references.remove(item)
                     if isinstance(item, gdspy.Label):
                         self.labels.remove(item)
@@ -847,9 +1852,11 @@ class Device(gdspy.Cell, _GeometryHelper):
                                      it was asked to remove in the Device: "%s".""" % (item))
 
         self._bb_valid = False
+        self._content_version += 1
         return self
 
 
+    @_raises_if_frozen
     def rotate(self, angle = 45, center = (0,0)):
         if angle == 0: return self
         for e in self.polygons:
@@ -865,6 +1872,7 @@ class Device(gdspy.Cell, _GeometryHelper):
         return self
 
 
+    @_raises_if_frozen
     def move(self, origin = (0,0), destination = None, axis = None):
         """ Moves elements of the Device from the origin point to the destination.  Both
          origin and destination can be 1x2 array-like, Port, or a key
@@ -903,6 +1911,7 @@ class Device(gdspy.Cell, _GeometryHelper):
         self._bb_valid = False
         return self
 
+    @_raises_if_frozen
     def mirror(self, p1 = (0,1), p2 = (0,0)):
         for e in (self.polygons+self.references+self.labels):
             e.mirror(p1, p2)
@@ -918,7 +1927,64 @@ class Device(gdspy.Cell, _GeometryHelper):
         return self.mirror(p1, p2)
 
 
-    def hash_geometry(self, precision = 1e-4):
+    def _freeze(self):
+        """ Makes the Device and all the Devices it references immutable,
+        so that any method which would modify them (or their polygons,
+        references, labels and ports) raises an error, and their arrays are
+        read-only.  Used for Devices which are shared, e.g. returned by a
+        device_lru_cache with copy = False, which only freezes Devices it
+        owns (see geometry._cache_owned_copy()) """
+        for D in [self] + list(self.get_dependencies(recursive = True)):
+            if D._frozen: continue
+            for polygonset in D.polygons:
+                _set_polygonset_frozen(polygonset, D._internal_name, frozen = True)
+            for label in D.labels:
+                label.position = np.array(label.position)
+                label.position.flags.writeable = False
+                if isinstance(label, Label):
+                    label.owner = D
+            for ref in D.references:
+                if isinstance(ref, ReferenceTable):
+                    for name in _reference_table_arrays:
+                        getattr(ref, name).flags.writeable = False
+            for name in ['polygons', 'references', 'labels', 'paths']:
+                setattr(D, name, _FrozenList(getattr(D, name)))
+                getattr(D, name)._device_name = D._internal_name
+            for p in D.ports.values():
+                p._midpoint.flags.writeable = False
+                p.__class__ = _FrozenPort
+            D.ports = _FrozenDict(D.ports)
+            D.ports._device_name = D._internal_name
+            D._frozen = True
+        return self
+
+
+    def _unfreeze(self):
+        """ Makes a (copy of a) frozen Device and all the Devices it
+        references modifiable again """
+        for D in [self] + list(self.get_dependencies(recursive = True)):
+            if not D._frozen: continue
+            D._frozen = False
+            for name in ['polygons', 'references', 'labels', 'paths']:
+                setattr(D, name, list(getattr(D, name)))
+            for polygonset in D.polygons:
+                _set_polygonset_frozen(polygonset, D._internal_name, frozen = False)
+            for label in D.labels:
+                label.position = _writeable(label.position)
+                if isinstance(label, Label):
+                    label.__dict__.pop('owner', None)
+            for ref in D.references:
+                if isinstance(ref, ReferenceTable):
+                    for name in _reference_table_arrays:
+                        setattr(ref, name, _writeable(getattr(ref, name)))
+            for p in D.ports.values():
+                object.__setattr__(p, '__class__', Port)
+                p._midpoint = _port_midpoint(p, p._midpoint)
+            D.ports = dict(D.ports)
+        return self
+
+
+    def hash_geometry(self, precision = 1e-4, hierarchical = False, hasher = None):
         """
         Algorithm:
         hash(
@@ -935,32 +2001,118 @@ class Device(gdspy.Cell, _GeometryHelper):
               the polygon hashes are sorted, to ensure the hash stays constant
               regardless of the ordering the polygons.  Similarly, the layers
               are sorted by (layer, datatype)
+
+        With ``hierarchical`` = True the geometry is not flattened: each
+        Device is hashed once from its own polygons and the (sorted) hashes
+        and transformations of the Devices it references, and each Device is
+        only hashed once however many times it is referenced.  This is much
+        faster for large hierarchies, but the result depends on the hierarchy and not
+        only on the final geometry, and is different from the flattened hash.
+
+        If ``hasher`` (e.g. a hashlib.sha1() object) is given, the hash data
+        is fed to it instead of to a new SHA1 object, so several Devices can
+        be hashed into a single digest.  The digest of ``hasher`` is returned
         """
-        polygons_by_spec = self.get_polygons(by_spec = True)
-        layers = np.array(list(polygons_by_spec.keys()))
-        sorted_layers = layers[np.lexsort((layers[:,0], layers[:,1]))]
-
-        # A random offset which fixes common rounding errors intrinsic
-        # to floating point math. Example: with a precision of 0.1, the
-        # floating points 7.049999 and 7.050001 round to different values
-        # (7.0 and 7.1), but offset values (7.220485 and 7.220487) don't
-        magic_offset = .17048614
-
-        final_hash = hashlib.sha1()
-        for layer in sorted_layers:
-            layer_hash = hashlib.sha1(layer.astype(np.int64)).digest()
-            polygons = polygons_by_spec[tuple(layer)]
-            polygons = [((p/precision) + magic_offset).astype(np.int64) for p in polygons]
-            polygon_hashes = np.sort([hashlib.sha1(p).digest() for p in polygons])
-            final_hash.update(layer_hash)
-            for ph in polygon_hashes:
-                final_hash.update(ph)
+        final_hash = hashlib.sha1() if hasher is None else hasher
+        if hierarchical:
+            final_hash.update(self._hash_hierarchy(precision, memo = {}))
+            return final_hash.hexdigest()
 
+        polygons_by_spec = self.get_polygons(by_spec = True)
+        _update_layer_hashes(final_hash, polygons_by_spec, precision)
         return final_hash.hexdigest()
 
 
+    def _hash_hierarchy(self, precision, memo):
+        """ Returns the hierarchical hash of the Device (see hash_geometry()).
+        The hashes are only memoized in ``memo`` for the duration of one
+        call, since polygons and layers can be modified in place without
+        the Device knowing """
+        if self in memo:
+            return memo[self]
+        cell_hash = hashlib.sha1()
+        _update_layer_hashes(cell_hash, self._get_own_polygons_by_spec(), precision)
+        records = []
+        for ref in self.references:
+            child = ref.ref_cell
+            if isinstance(child, Device):
+                child_hash = child._hash_hierarchy(precision, memo)
+            else:
+                child_hash = str(getattr(child, 'name', child)).encode()
+            records += _reference_hash_records(ref, child_hash, precision)
+        for record in sorted(records):
+            cell_hash.update(record)
+        digest = cell_hash.digest()
+        memo[self] = digest
+        return digest
+
+
+    def _get_own_polygons_by_spec(self):
+        """ Returns the polygons (including paths) of the Device itself, not
+        of the Devices it references, grouped by (layer, datatype) """
+        polygons_by_spec = {}
+        polygonsets = self.polygons + [path.to_polygonset() for path in self.paths]
+        for polygonset in polygonsets:
+            for points, layer, datatype in zip(polygonset.polygons,
+                    polygonset.layers, polygonset.datatypes):
+                polygons_by_spec.setdefault((layer, datatype), []).append(points)
+        return polygons_by_spec
+
+
+    def hash_structure(self, precision = 1e-4):
+        """ Returns a hash of the structure of the Device: its polygons,
+        ports and labels and the references (with their transformations) to
+        the structure hashes of the Devices it references.  Unlike
+        hash_geometry(), the hierarchy is never flattened, so two Devices have
+        the same structure hash when they are built the same way from
+        identical Devices, regardless of the names or uids of the Devices.
+        Each Device is only hashed once however many times it is referenced,
+        so hashing a large hierarchy costs O(number of unique Devices) """
+        return self._hash_structure(precision, memo = {}).hex()
+
+
+    def _hash_structure(self, precision, memo):
+        # The hashes are only memoized in ``memo`` for the duration of one
+        # call, since polygons, layers and labels can be modified in place
+        # without the Device knowing
+        if self in memo:
+            return memo[self]
+        own_hash = hashlib.sha1()
+        _update_layer_hashes(own_hash, self._get_own_polygons_by_spec(), precision)
+        port_records = [_port_hash_record(p, precision) for p in self.ports.values()]
+        for record in sorted(port_records):
+            own_hash.update(record)
+        label_records = [_label_hash_record(l, precision) for l in self.labels]
+        records = [b'labels'] + sorted(label_records) + [b'references']
+        reference_records = []
+        for ref in self.references:
+            child = ref.ref_cell
+            if isinstance(child, Device):
+                child_hash = child._hash_structure(precision, memo)
+            else:
+                child_hash = str(getattr(child, 'name', child)).encode()
+            reference_records += _reference_hash_records(ref, child_hash, precision)
+        records += sorted(reference_records)
+        digest = hashlib.sha1(own_hash.digest() + b''.join(records)).digest()
+        memo[self] = digest
+        return digest
+
+
+    def structure_equals(self, other, precision = 1e-4):
+        """ Returns True if ``other`` is a Device with the same structure
+        hash (see hash_structure()) as this Device """
+        if not isinstance(other, Device):
+            return False
+        if other is self:
+            return True
+        return self.hash_structure(precision) == other.hash_structure(precision)
+
+
 
 class DeviceReference(gdspy.CellReference, _GeometryHelper):
+
+    _ports_version = 0
+
     def __init__(self, device, origin=(0, 0), rotation=0, magnification=None, x_reflection=False):
         super(DeviceReference, self).__init__(
                  ref_cell = device,
@@ -973,8 +2125,10 @@ class DeviceReference(gdspy.CellReference, _GeometryHelper):
         self.owner = None
         # The ports of a DeviceReference have their own unique id (uid),
         # since two DeviceReferences of the same parent Device can be
-        # in different locations and thus do not represent the same port
-        self._local_ports = {name:port._copy(new_uid = True) for name, port in device.ports.items()}
+        # in different locations and thus do not represent the same port.
+        # They are created the first time self.ports is accessed
+        self._local_ports = _PortDict()
+        self._local_ports._owner = self
 
 
     def __repr__(self):
@@ -1009,22 +2163,38 @@ class DeviceReference(gdspy.CellReference, _GeometryHelper):
     @property
     def ports(self):
         """ This property allows you to access myref.ports, and receive a copy
-        of the ports dict which is correctly rotated and translated"""
+        of the ports dict which is correctly rotated and translated.  The
+        transformed ports are cached, and are only recomputed if this
+        reference has been moved/rotated/reflected or if the ports of the
+        parent Device have changed """
+        if self.__dict__.get('_ports_cache_key') != self._get_ports_cache_key():
+            self._update_local_ports()
+            self._ports_cache_key = self._get_ports_cache_key()
+        return self._local_ports
+
+    def _get_ports_cache_key(self):
+        # Modifying one of the ports of this reference increments its own
+        # _ports_version, so that the next access recomputes them
+        origin = None if self.origin is None else (float(self.origin[0]), float(self.origin[1]))
+        return (origin, self.rotation, self.x_reflection, id(self.parent),
+                self.parent._ports_version, self._ports_version)
+
+    def _update_local_ports(self):
         for name, port in self.parent.ports.items():
             port = self.parent.ports[name]
             new_midpoint, new_orientation = self._transform_port(port.midpoint, \
                 port.orientation, self.origin, self.rotation, self.x_reflection)
             if name not in self._local_ports:
                 self._local_ports[name] = port._copy(new_uid = True)
+            self._local_ports[name].parent = self
             self._local_ports[name].midpoint = new_midpoint
             self._local_ports[name].orientation = mod(new_orientation,360)
-            self._local_ports[name].parent = self
+            self._local_ports[name].width = port.width
         # Remove any ports that no longer exist in the reference's parent
         parent_names = self.parent.ports.keys()
         local_names = list(self._local_ports.keys())
         for name in local_names:
             if name not in parent_names: self._local_ports.pop(name)
-        return self._local_ports
 
     @property
     def info(self):
@@ -1036,6 +2206,9 @@ class DeviceReference(gdspy.CellReference, _GeometryHelper):
         if bbox is None:  bbox = ((0,0),(0,0))
         return np.array(bbox)
 
+    def get_bounding_box(self):
+        return _cached_reference_bbox(self, super(DeviceReference, self).get_bounding_box)
+
 
 
     def _transform_port(self, point, orientation, origin=(0, 0), rotation=None, x_reflection=False):
@@ -1055,6 +2228,7 @@ class DeviceReference(gdspy.CellReference, _GeometryHelper):
 
         return new_point, new_orientation
 
+    @_raises_if_frozen
     def move(self, origin = (0,0), destination = None, axis = None):
         """ Moves the DeviceReference from the origin point to the destination.  Both
          origin and destination can be 1x2 array-like, Port, or a key
@@ -1088,6 +2262,7 @@ class DeviceReference(gdspy.CellReference, _GeometryHelper):
         return self
 
 
+    @_raises_if_frozen
     def rotate(self, angle = 45, center = (0,0)):
         if angle == 0: return self
         if type(center) is Port:  center = center.midpoint
@@ -1099,6 +2274,7 @@ class DeviceReference(gdspy.CellReference, _GeometryHelper):
         return self
 
 
+    @_raises_if_frozen
     def mirror(self, p1 = (0,1), p2 = (0,0)):
         if type(p1) is Port:  p1 = p1.midpoint
         if type(p2) is Port:  p2 = p2.midpoint
@@ -1170,7 +2346,11 @@ class CellArray(gdspy.CellArray, _GeometryHelper):
         if bbox is None:  bbox = ((0,0),(0,0))
         return np.array(bbox)
 
+    def get_bounding_box(self):
+        return _cached_reference_bbox(self, super(CellArray, self).get_bounding_box)
+
 
+    @_raises_if_frozen
     def move(self, origin = (0,0), destination = None, axis = None):
         """ Moves the CellArray from the origin point to the destination.  Both
          origin and destination can be 1x2 array-like, Port, or a key
@@ -1204,6 +2384,7 @@ class CellArray(gdspy.CellArray, _GeometryHelper):
         return self
 
 
+    @_raises_if_frozen
     def rotate(self, angle = 45, center = (0,0)):
         if angle == 0: return self
         if type(center) is Port:  center = center.midpoint
@@ -1214,6 +2395,7 @@ class CellArray(gdspy.CellArray, _GeometryHelper):
         return self
 
 
+    @_raises_if_frozen
     def mirror(self, p1 = (0,1), p2 = (0,0)):
         if type(p1) is Port:  p1 = p1.midpoint
         if type(p2) is Port:  p2 = p2.midpoint
@@ -1246,6 +2428,303 @@ class CellArray(gdspy.CellArray, _GeometryHelper):
 
 
 
+def _convex_hull(points):
+    """ Returns the vertices of the convex hull of the [N][2] array
+    ``points``, using Andrew's monotone chain algorithm """
+    points = np.unique(points, axis = 0)
+    if len(points) <= 2:
+        return points
+    def half_hull(points):
+        hull = []
+        for x, y in points:
+            while len(hull) >= 2 and ((hull[-1][0] - hull[-2][0])*(y - hull[-2][1]) -
+                    (hull[-1][1] - hull[-2][1])*(x - hull[-2][0])) <= 0:
+                hull.pop()
+            hull.append((x, y))
+        return hull
+    points = points.tolist()
+    return np.array(half_hull(points)[:-1] + half_hull(points[::-1])[:-1])
+
+
+def _transform_reference_points(points, rotations, x_reflections, magnifications = None):
+    """ Applies the reflection, magnification and rotation (but not the
+    origin) of each of N references to the [K][2] array ``points``, in the
+    same order as gdspy.CellReference does.  Returns a [N][K][2] array.
+    ``magnifications`` are NaN for the references without magnification """
+    x = points[:,0][None,:]
+    y = points[:,1][None,:]*np.where(x_reflections, -1.0, 1.0)[:,None]
+    if magnifications is not None:
+        mag = np.where(np.isnan(magnifications), 1.0, magnifications)[:,None]
+        x = x*mag
+        y = y*mag
+    angle = np.asarray(rotations, dtype = np.float64)*pi/180
+    ca = cos(angle)[:,None]
+    sa = sin(angle)[:,None]
+    return np.stack([x*ca - y*sa, y*ca + x*sa], axis = -1)
+
+
+_reference_table_arrays = ['origins', 'rotations', 'x_reflections', 'magnifications']
+
+
+class ReferenceTable(_GeometryHelper):
+    """ Many references to the same Device, such as the elements of a large
+    array or meander (see Device.add_refs()).  Rather than being separate
+    DeviceReferences, their transformations are stored in the numpy arrays
+    ``origins`` ([N][2]), ``rotations`` (in degrees), ``x_reflections`` and
+    ``magnifications`` (NaN for the references without magnification), and
+    the whole table is a single entry of Device.references.
+
+    get_bounding_box(), get_polygons(), get_port_table(), the hashes and the
+    GDS/OASIS writers read the arrays directly, and move(), rotate() and
+    mirror() transform all the references at once.  table[i] returns
+    reference i as a DeviceReference whose transformation is read from (and
+    written to) the arrays, so it can be used like any other reference,
+    e.g. with connect().  These views are only created when accessed """
+
+    def __init__(self, device, origins, rotations, x_reflections, magnifications):
+        self.ref_cell = device
+        self.parent = device
+        self.owner = None
+        self.origins = np.array(origins, dtype = np.float64).reshape(-1,2)
+        self.rotations = np.array(rotations, dtype = np.float64).reshape(-1)
+        self.x_reflections = np.array(x_reflections, dtype = bool).reshape(-1)
+        self.magnifications = np.array(magnifications, dtype = np.float64).reshape(-1)
+        self._views = weakref.WeakValueDictionary()
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state.pop('_views')
+        state.pop('_bb_cache', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._views = weakref.WeakValueDictionary()
+
+    def __copy__(self):
+        table = ReferenceTable(self.parent, self.origins, self.rotations,
+                               self.x_reflections, self.magnifications)
+        table.owner = self.owner
+        return table
+
+    def __repr__(self):
+        return ('ReferenceTable (parent Device "%s", %s references)' % \
+                (self.parent.name, len(self)))
+
+    def __len__(self):
+        return len(self.origins)
+
+    def __getitem__(self, index):
+        """ Returns reference ``index`` as a DeviceReference which reads and
+        writes its transformation from the arrays of the table """
+        if isinstance(index, slice):
+            return [self[n] for n in range(len(self))[index]]
+        n = range(len(self))[index]
+        view = self._views.get(n)
+        if view is None:
+            view = _ReferenceView(self, n)
+            self._views[n] = view
+        return view
+
+    def __iter__(self):
+        for n in range(len(self)):
+            yield self[n]
+
+    def _cell_references(self):
+        """ Yields the references as (temporary) gdspy CellReferences, for
+        the operations which are not vectorized """
+        for n in range(len(self)):
+            magnification = self.magnifications[n]
+            yield gdspy.CellReference(self.ref_cell, origin = tuple(self.origins[n]),
+                rotation = float(self.rotations[n]), x_reflection = bool(self.x_reflections[n]),
+                magnification = None if np.isnan(magnification) else float(magnification))
+
+    @property
+    def bbox(self):
+        bbox = self.get_bounding_box()
+        if bbox is None:  bbox = ((0,0),(0,0))
+        return np.array(bbox)
+
+    def get_bounding_box(self):
+        """ Returns the bounding box of all the references.  The convex hull
+        of the parent Device (cached until its geometry changes) is
+        transformed once per distinct (rotation, reflection, magnification),
+        for all of them at once """
+        cell = self.ref_cell
+        if (not isinstance(cell, Device)) or (len(self) == 0):
+            return None
+        if cell.get_bounding_box() is None:
+            return None
+        cache_key = (id(cell), cell._bb_version)
+        cache = self.__dict__.get('_bb_cache')
+        if (cache is None) or (cache[0] != cache_key):
+            cache = (cache_key, _convex_hull(np.concatenate(cell.get_polygons())))
+            self._bb_cache = cache
+        keys = np.column_stack([np.mod(self.rotations, 360), self.x_reflections,
+                                np.nan_to_num(self.magnifications, nan = 1)])
+        transforms, inverse = np.unique(keys, axis = 0, return_inverse = True)
+        hull = _transform_reference_points(cache[1], transforms[:,0],
+                                           transforms[:,1] > 0, transforms[:,2])
+        inverse = inverse.reshape(-1)
+        return np.array([np.min(np.min(hull, axis = 1)[inverse] + self.origins, axis = 0),
+                         np.max(np.max(hull, axis = 1)[inverse] + self.origins, axis = 0)])
+
+    def get_polygons(self, by_spec = False, depth = None):
+        """ Returns the polygons of all the references, as for
+        gdspy.CellReference.get_polygons().  The polygons of the parent Device
+        are only retrieved once and are then transformed for all the
+        references at once """
+        if not isinstance(self.ref_cell, gdspy.Cell):
+            return dict() if by_spec else []
+        polygons = self.ref_cell.get_polygons(by_spec, depth)
+        if isinstance(polygons, dict):
+            return {key:self._transform_polygons(p) for key, p in polygons.items()}
+        return self._transform_polygons(polygons)
+
+    def _transform_polygons(self, polygons):
+        if (len(polygons) == 0) or (len(self) == 0):
+            return []
+        bounds = np.cumsum([0] + [len(p) for p in polygons]).tolist()
+        points = _transform_reference_points(np.concatenate(polygons), self.rotations,
+                        self.x_reflections, self.magnifications) + self.origins[:,None,:]
+        return [points[n, start:end] for n in range(len(self))
+                for start, end in zip(bounds[:-1], bounds[1:])]
+
+    def get_polygonsets(self, depth = None):
+        return [ps for r in self._cell_references() for ps in r.get_polygonsets(depth)]
+
+    def get_paths(self, depth = None):
+        return [p for r in self._cell_references() for p in r.get_paths(depth)]
+
+    def get_labels(self, depth = None, set_transform = False):
+        return [l for r in self._cell_references()
+                for l in r.get_labels(depth, set_transform)]
+
+    def area(self, by_spec = False):
+        if not isinstance(self.ref_cell, gdspy.Cell):
+            return dict() if by_spec else 0
+        factor = np.sum(np.where(np.isnan(self.magnifications), 1.0, self.magnifications)**2)
+        cell_area = self.ref_cell.area(by_spec)
+        if by_spec:
+            return {key:area*factor for key, area in cell_area.items()}
+        return cell_area*factor
+
+    def to_gds(self, outfile, multiplier):
+        outfile.write(_pack_reference_table(self, self.ref_cell.name, multiplier))
+
+    def to_svg(self, outfile, scaling, precision):
+        for r in self._cell_references():
+            r.to_svg(outfile, scaling, precision)
+
+    def _transform_port_table(self, port_table):
+        """ Returns the PortTable of the ports of ``port_table`` (of the
+        parent Device) for every reference, in the order of the references """
+        num_refs, num_ports = len(self), len(port_table)
+        midpoints = _transform_reference_points(port_table.midpoints, self.rotations,
+                        self.x_reflections) + self.origins[:,None,:]
+        orientations = np.where(self.x_reflections[:,None], -port_table.orientations[None,:],
+                                port_table.orientations[None,:]) + self.rotations[:,None]
+        return PortTable(midpoints.reshape(-1,2), mod(orientations, 360).reshape(-1),
+                         np.tile(port_table.widths, num_refs),
+                         port_table.source_ports*num_refs)
+
+    @_raises_if_frozen
+    def translate(self, dx, dy):
+        self.origins += np.array((dx, dy), dtype = np.float64)
+        return self
+
+    @_raises_if_frozen
+    def move(self, origin = (0,0), destination = None, axis = None):
+        """ Moves all the references from the origin point to the
+        destination, both of which can be 1x2 array-like or a Port """
+        if destination is None:
+            destination = origin
+            origin = [0,0]
+        o = _parse_coordinate(origin)
+        d = _parse_coordinate(destination)
+        if axis == 'x': d = (d[0], o[1])
+        if axis == 'y': d = (o[0], d[1])
+        dx, dy = np.array(d) - o
+        self.translate(dx, dy)
+        if self.owner is not None:
+            self.owner._bb_valid = False
+        return self
+
+    @_raises_if_frozen
+    def rotate(self, angle = 45, center = (0,0)):
+        if angle == 0: return self
+        if type(center) is Port:  center = center.midpoint
+        self.rotations += angle
+        self.origins[...] = _rotate_points(self.origins, angle, center)
+        if self.owner is not None:
+            self.owner._bb_valid = False
+        return self
+
+    @_raises_if_frozen
+    def mirror(self, p1 = (0,1), p2 = (0,0)):
+        if type(p1) is Port:  p1 = p1.midpoint
+        if type(p2) is Port:  p2 = p2.midpoint
+        p1 = np.array(p1, dtype = np.float64);  p2 = np.array(p2, dtype = np.float64)
+        direction = p2 - p1
+        angle = np.arctan2(direction[1], direction[0])*180/pi
+        projection = np.outer(np.dot(self.origins - p1, direction)/norm(direction)**2, direction)
+        self.origins[...] = 2*(p1 + projection) - self.origins
+        self.rotations[...] = 2*angle - self.rotations
+        self.x_reflections[...] = ~self.x_reflections
+        if self.owner is not None:
+            self.owner._bb_valid = False
+        return self
+
+    def reflect(self, p1 = (0,1), p2 = (0,0)):
+        warnings.warn('[PHIDL] Warning: reflect() will be deprecated in May 2021, please replace with mirror()')
+        return self.mirror(p1, p2)
+
+
+
+def _reference_view_property(name, fget, fset):
+    def getter(self):
+        return fget(getattr(self._table, name)[self._index])
+    def setter(self, value):
+        getattr(self._table, name)[self._index] = fset(value)
+    setter.__name__ = name
+    return property(getter, _raises_if_frozen(setter))
+
+
+class _ReferenceView(DeviceReference):
+    """ Reference ``index`` of a ReferenceTable (see ReferenceTable.__getitem__),
+    whose origin, rotation, x_reflection and magnification are properties
+    which read and write the arrays of the table """
+
+    origin = _reference_view_property('origins', lambda o: o, lambda o: o)
+    rotation = _reference_view_property('rotations', float,
+                                        lambda r: 0 if r is None else r)
+    x_reflection = _reference_view_property('x_reflections', bool, bool)
+    magnification = _reference_view_property('magnifications',
+        lambda m: None if np.isnan(m) else float(m),
+        lambda m: np.nan if m is None else m)
+
+    def __init__(self, table, index):
+        self._table = table
+        self._index = index
+        self.ref_cell = table.ref_cell
+        self.properties = {}
+        self.parent = table.parent
+        self._local_ports = _PortDict()
+        self._local_ports._owner = self
+
+    @property
+    def owner(self):
+        return self._table.owner
+
+    def __reduce__(self):
+        return (_reference_view, (self._table, self._index))
+
+
+def _reference_view(table, index):
+    return table[index]
+
+
+
 class Label(gdspy.Label, _GeometryHelper):
 
     def __init__(self, *args, **kwargs):
@@ -1256,10 +2735,12 @@ class Label(gdspy.Label, _GeometryHelper):
     def bbox(self):
         return np.array([[self.position[0], self.position[1]],[self.position[0], self.position[1]]])
 
+    @_raises_if_frozen
     def rotate(self, angle = 45, center = (0,0)):
         self.position = _rotate_points(self.position, angle = angle, center = center)
         return self
 
+    @_raises_if_frozen
     def move(self, origin = (0,0), destination = None, axis = None):
         if destination is None:
             destination = origin
@@ -1274,10 +2755,21 @@ class Label(gdspy.Label, _GeometryHelper):
         self.position += np.array(d) - o
         return self
 
+    @_raises_if_frozen
     def mirror(self, p1 = (0,1), p2 = (0,0)):
         self.position = _reflect_points(self.position, p1, p2)
         return self
 
     def reflect(self, p1 = (0,1), p2 = (0,0)):
         warnings.warn('[PHIDL] Warning: reflect() will be deprecated in May 2021, please replace with mirror()')
-        return self.mirror(p1, p2)
\ No newline at end of file
+        return self.mirror(p1, p2)
+
+
+
+# The mutators inherited from gdspy also refuse to modify frozen Devices
+for _cls, _names in [(Polygon, ['translate', 'scale', 'fillet', 'fracture']),
+                     (PolygonTable, ['scale', 'fillet', 'fracture']),
+                     (DeviceReference, ['translate']), (CellArray, ['translate']),
+                     (Label, ['translate'])]:
+    for _name in _names:
+        setattr(_cls, _name, _raises_if_frozen(getattr(_cls, _name)))
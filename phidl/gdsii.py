@@ -0,0 +1,881 @@
+# -*- coding: utf-8 -*-
+from __future__ import division, print_function, absolute_import
+import io
+import gzip
+import hashlib
+import mmap
+import re
+import zlib
+import queue
+import struct
+import datetime
+import threading
+import warnings
+import numpy as np
+
+import gdspy
+from gdspy.gdsiiformat import _eight_byte_real, _eight_byte_real_to_float
+
+try:
+    import zstandard
+    zstandard_imported = True
+except:
+    zstandard_imported = False
+
+
+#==============================================================================
+#
+# Compressed files
+#
+#==============================================================================
+
+_COMPRESSION_EXTENSIONS = {'.gz' : 'gzip', '.zst' : 'zstd'}
+_COMPRESSION_MAGIC = {b'\x1f\x8b' : 'gzip', b'\x28\xb5\x2f\xfd' : 'zstd'}
+
+
+def _compression_from_filename(filename):
+    for extension, compression in _COMPRESSION_EXTENSIONS.items():
+        if str(filename).endswith(extension):
+            return compression
+    return None
+
+
+def _check_compression(compression):
+    if compression not in (None, 'gzip', 'zstd'):
+        raise ValueError('[PHIDL] Unknown compression "%s", must be one of '
+                         'None, "gzip" or "zstd"' % compression)
+    if compression == 'zstd' and zstandard_imported == False:
+        raise ImportError('PHIDL tried to import zstandard but it failed. '
+                          'Install it (pip install zstandard) to read and write '
+                          'zstd-compressed GDS files')
+
+
+class _CompressedWriter(object):
+    """ Write-only file object which compresses the data written to it and
+    writes it to ``filename``.  Writes are gathered into chunks which are
+    compressed and written to disk in a background thread, so the caller can
+    keep producing data in the meantime (zlib and zstandard both release the
+    GIL while compressing) """
+
+    def __init__(self, filename, compression = 'gzip', level = None,
+                 chunk_size = 2**22):
+        _check_compression(compression)
+        if compression == 'gzip':
+            level = 6 if level is None else level
+            # wbits = 31 writes a gzip header and trailer
+            self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        else:
+            level = 3 if level is None else level
+            self._compressor = zstandard.ZstdCompressor(level = level).compressobj()
+        self._file = io.open(filename, 'wb')
+        self._chunk_size = chunk_size
+        self._buffer = []
+        self._buffered = 0
+        self._error = None
+        self._queue = queue.Queue(maxsize = 4)
+        self._thread = threading.Thread(target = self._compress_chunks)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _compress_chunks(self):
+        while True:
+            chunk = self._queue.get()
+            if chunk is None: break
+            if self._error is not None: continue
+            try:
+                self._file.write(self._compressor.compress(chunk))
+            except Exception as e:
+                self._error = e
+        if self._error is None:
+            try:
+                self._file.write(self._compressor.flush())
+            except Exception as e:
+                self._error = e
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def write(self, data):
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if self._buffered >= self._chunk_size:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        self._raise_error()
+        if self._buffered > 0:
+            self._queue.put(b''.join(self._buffer))
+            self._buffer = []
+            self._buffered = 0
+
+    def close(self):
+        if self._thread.is_alive():
+            try:
+                self.flush()
+            finally:
+                self._queue.put(None)
+                self._thread.join()
+                self._file.close()
+        self._raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def gds_compression(filename):
+    """ Returns the compression ("gzip" or "zstd") of a GDS file, determined
+    from its first bytes, or None if it is not compressed """
+    with io.open(filename, 'rb') as f:
+        magic = f.read(4)
+    return _COMPRESSION_MAGIC.get(magic[:2], _COMPRESSION_MAGIC.get(magic))
+
+
+def open_gds(filename, compression = None):
+    """ Opens a (possibly compressed) GDS file for reading.  If ``compression``
+    is None it is determined from the first bytes of the file """
+    if compression is None:
+        compression = gds_compression(filename)
+    _check_compression(compression)
+    if compression == 'gzip':
+        return gzip.open(filename, 'rb')
+    elif compression == 'zstd':
+        return zstandard.ZstdDecompressor().stream_reader(io.open(filename, 'rb'),
+                                                          closefd = True)
+    return io.open(filename, 'rb')
+
+
+#==============================================================================
+#
+# GDSII writer
+#
+#==============================================================================
+
+# Words (16-bit) in the header of a BOUNDARY element: BOUNDARY, LAYER,
+# DATATYPE and the XY record header
+_BOUNDARY_HEADER = np.array([4, 0x0800, 6, 0x0D02, 0, 6, 0x0E02, 0, 0, 0x1003],
+                            dtype = '>u2')
+_MAX_GDS_POINTS = 8190
+
+
+def _cells_in_dependency_order(cells):
+    """ Returns all the cells referenced (recursively) by ``cells`` such that
+    every cell comes after all the cells it references """
+    ordered = []
+    visited = set()
+    for top in cells:
+        if top in visited: continue
+        visited.add(top)
+        stack = [(top, iter(top.references))]
+        while stack:
+            cell, children = stack[-1]
+            for ref in children:
+                child = ref.ref_cell
+                if isinstance(child, gdspy.Cell) and child not in visited:
+                    visited.add(child)
+                    stack.append((child, iter(child.references)))
+                    break
+            else:
+                stack.pop()
+                ordered.append(cell)
+    return ordered
+
+
+def _pack_string(record, string):
+    if len(string) % 2 != 0:
+        string = string + '\0'
+    return struct.pack('>2H', 4 + len(string), record) + string.encode('ascii')
+
+
+def _pack_properties(properties):
+    data = b''
+    if properties is not None and len(properties) > 0:
+        size = 0
+        for attr, value in properties.items():
+            data += struct.pack('>3H', 6, 0x2B02, attr) + _pack_string(0x2C06, value)
+            size += len(value) + 2
+        if size > 128:
+            warnings.warn('[PHIDL] write_gds(): Properties with size larger than '
+                          '128 bytes are not officially supported by the GDSII '
+                          'specification')
+    return data
+
+
+def _pack_polygons(polygons, layers, datatypes, multiplier):
+    """ Packs a list of polygons into the bytes of GDSII BOUNDARY elements.
+    Rather than writing each record separately, the records of all the
+    polygons are assembled in a single big-endian array of 16-bit words """
+    if len(polygons) == 0:
+        return b''
+    sizes = np.array([len(p) for p in polygons], dtype = np.int64)
+    return _pack_polygon_buffer(np.concatenate(polygons), sizes, layers,
+                                datatypes, multiplier)
+
+
+def _pack_polygon_buffer(points, sizes, layers, datatypes, multiplier):
+    """ Same as _pack_polygons(), for polygons given as a single [N][2]
+    array of ``points`` and the number of vertices of each polygon """
+    num_polygons = len(sizes)
+    if num_polygons == 0:
+        return b''
+    closed_sizes = sizes + 1
+    starts = np.cumsum(sizes) - sizes
+    closed_starts = np.cumsum(closed_sizes) - closed_sizes
+
+    # Indices of the points of each polygon followed by its first point
+    local_index = np.arange(closed_sizes.sum()) - np.repeat(closed_starts, closed_sizes)
+    local_index[closed_starts + sizes] = 0
+    points = points[np.repeat(starts, closed_sizes) + local_index]
+    xy_words = np.round(points*multiplier).astype('>i4').view('>u2').ravel()
+
+    # Each element: header words, 4 words per point and 2 words of ENDEL
+    record_words = len(_BOUNDARY_HEADER) + 4*closed_sizes + 2
+    record_starts = np.cumsum(record_words) - record_words
+    words = np.empty(record_words.sum(), dtype = '>u2')
+    header = np.tile(_BOUNDARY_HEADER, (num_polygons, 1))
+    header[:,4] = np.asarray(layers).astype('>i2').view('>u2')
+    header[:,7] = np.asarray(datatypes).astype('>i2').view('>u2')
+    header[:,8] = 4 + 8*closed_sizes
+    words[record_starts[:,None] + np.arange(len(_BOUNDARY_HEADER))] = header
+    xy_offset = record_starts + len(_BOUNDARY_HEADER) - 4*closed_starts
+    words[np.arange(len(xy_words)) + np.repeat(xy_offset, 4*closed_sizes)] = xy_words
+    words[record_starts + record_words - 2] = 4
+    words[record_starts + record_words - 1] = 0x1100
+    return words.tobytes()
+
+
+def _pack_strans(element):
+    if (element.rotation is None) and (element.magnification is None) \
+            and not element.x_reflection:
+        return b''
+    word = 0x8000 if element.x_reflection else 0
+    values = b''
+    if element.magnification is not None:
+        values += struct.pack('>2H', 12, 0x1B05) + _eight_byte_real(element.magnification)
+    if element.rotation is not None:
+        values += struct.pack('>2H', 12, 0x1C05) + _eight_byte_real(element.rotation)
+    return struct.pack('>3H', 6, 0x1A01, word) + values
+
+
+def _eight_byte_reals(values):
+    """ Vectorized version of gdspy's _eight_byte_real(): returns the GDSII
+    8-byte reals of ``values`` as a [N][8] uint8 array """
+    values = np.asarray(values, dtype = np.float64)
+    result = np.zeros(len(values), dtype = '>u8')
+    nonzero = values != 0
+    value = np.abs(values[nonzero])
+    fexp = np.log2(value)/4
+    exponent = np.ceil(fexp)
+    exponent[fexp == exponent] += 1
+    mantissa = (value*16.0**(14 - exponent)).astype(np.uint64)
+    byte1 = np.where(values[nonzero] < 0, 0x80, 0) + exponent.astype(np.int64) + 64
+    result[nonzero] = (byte1.astype(np.uint64) << np.uint64(56)) | mantissa
+    return result.view(np.uint8).reshape(-1, 8)
+
+
+def _pack_reference(ref, name, multiplier):
+    """ Packs a CellReference or CellArray into the bytes of a GDSII SREF or
+    AREF element which references the cell by ``name`` """
+    ox, oy = ref.origin[0], ref.origin[1]
+    if isinstance(ref, gdspy.CellArray):
+        data = struct.pack('>2H', 4, 0x0B00) + _pack_string(0x1206, name)
+        x2, y2 = ox + ref.columns*ref.spacing[0], oy
+        x3, y3 = ox, oy + ref.rows*ref.spacing[1]
+        if ref.x_reflection:
+            y3 = 2*oy - y3
+        if ref.rotation is not None:
+            sa = np.sin(ref.rotation*np.pi/180)
+            ca = np.cos(ref.rotation*np.pi/180)
+            x2, y2 = (x2-ox)*ca - (y2-oy)*sa + ox, (x2-ox)*sa + (y2-oy)*ca + oy
+            x3, y3 = (x3-ox)*ca - (y3-oy)*sa + ox, (x3-ox)*sa + (y3-oy)*ca + oy
+        data += _pack_strans(ref)
+        data += struct.pack('>2H2h2H6l', 8, 0x1302, ref.columns, ref.rows,
+                            28, 0x1003, *[int(round(v*multiplier)) for v in
+                                          (ox, oy, x2, y2, x3, y3)])
+    else:
+        data = struct.pack('>2H', 4, 0x0A00) + _pack_string(0x1206, name)
+        data += _pack_strans(ref)
+        data += struct.pack('>2H2l', 12, 0x1003, int(round(ox*multiplier)),
+                            int(round(oy*multiplier)))
+    data += _pack_properties(ref.properties)
+    data += struct.pack('>2H', 4, 0x1100)
+    return data
+
+
+def _pack_reference_table(table, name, multiplier):
+    """ Packs the references of a ReferenceTable into the bytes of GDSII
+    SREF elements which reference the cell by ``name``.  The elements only
+    differ by their STRANS word, MAG, ANGLE and XY values, so all the
+    elements with (or without) a MAG record are assembled at once as the
+    rows of a single byte array """
+    origins = np.asarray(table.origins, dtype = np.float64)
+    if len(origins) == 0:
+        return b''
+    magnifications = np.asarray(table.magnifications, dtype = np.float64)
+    has_magnification = ~np.isnan(magnifications)
+    words = np.where(table.x_reflections, 0x8000, 0).astype('>u2').view(np.uint8).reshape(-1, 2)
+    mags = _eight_byte_reals(np.where(has_magnification, magnifications, 1))
+    angles = _eight_byte_reals(table.rotations)
+    xy = np.round(origins*multiplier).astype('>i4').view(np.uint8).reshape(-1, 8)
+    def constant(data):
+        return np.frombuffer(data, dtype = np.uint8)[None,:]
+    data = []
+    for with_magnification in (False, True):
+        rows = np.nonzero(has_magnification == with_magnification)[0]
+        if len(rows) == 0:
+            continue
+        columns = [constant(struct.pack('>2H', 4, 0x0A00) + _pack_string(0x1206, name) +
+                            struct.pack('>2H', 6, 0x1A01)), words[rows]]
+        if with_magnification:
+            columns += [constant(struct.pack('>2H', 12, 0x1B05)), mags[rows]]
+        columns += [constant(struct.pack('>2H', 12, 0x1C05)), angles[rows],
+                    constant(struct.pack('>2H', 12, 0x1003)), xy[rows],
+                    constant(struct.pack('>2H', 4, 0x1100))]
+        data.append(np.hstack([np.broadcast_to(c, (len(rows), c.shape[1]))
+                               for c in columns]).tobytes())
+    return b''.join(data)
+
+
+def _pack_timestamp(record, timestamp):
+    t = timestamp
+    return struct.pack('>2H12h', 28, record, t.year, t.month, t.day, t.hour,
+                       t.minute, t.second, t.year, t.month, t.day, t.hour,
+                       t.minute, t.second)
+
+
+def _write_cell(outfile, cell, names, multiplier, timestamp):
+    outfile.write(_pack_timestamp(0x0502, timestamp) + _pack_string(0x0606, names[cell]))
+    for polygonset in cell.polygons:
+        offsets = getattr(polygonset, 'offsets', None)
+        if offsets is not None and len(polygonset.properties) == 0 \
+                and not np.any(np.diff(offsets) > _MAX_GDS_POINTS):
+            # Columnar PolygonTable, packed straight from its vertex buffer
+            outfile.write(_pack_polygon_buffer(polygonset.points, np.diff(offsets),
+                                               polygonset.gds_layers,
+                                               polygonset.gds_datatypes, multiplier))
+        elif (polygonset.properties is not None and len(polygonset.properties) > 0) \
+                or any(len(p) > _MAX_GDS_POINTS for p in polygonset.polygons):
+            polygonset.to_gds(outfile, multiplier)
+        else:
+            outfile.write(_pack_polygons(polygonset.polygons, polygonset.layers,
+                                         polygonset.datatypes, multiplier))
+    for path in cell.paths:
+        path.to_gds(outfile, multiplier)
+    for label in cell.labels:
+        label.to_gds(outfile, multiplier)
+    for ref in cell.references:
+        ref_cell = ref.ref_cell
+        name = names.get(ref_cell, ref_cell.name) if isinstance(ref_cell, gdspy.Cell) \
+               else ref_cell
+        if getattr(ref, 'origins', None) is not None:
+            # ReferenceTable, packed straight from its transformation arrays
+            outfile.write(_pack_reference_table(ref, name, multiplier))
+        else:
+            outfile.write(_pack_reference(ref, name, multiplier))
+    outfile.write(struct.pack('>2H', 4, 0x0700))
+
+
+def _cell_digests(all_cells, multiplier):
+    """ Returns a dictionary of the SHA1 digest of the contents of each cell,
+    as they would be written to a GDSII file with the given ``multiplier``.
+    ``all_cells`` must be in dependency order.  References are hashed by the
+    digest of the referenced cell, so two cells have the same digest when
+    they produce identical GDSII elements and reference identical cells """
+    digests = {}
+    for cell in all_cells:
+        h = hashlib.sha1()
+        for polygonset in cell.polygons:
+            h.update(b'P' + np.array([len(p) for p in polygonset.polygons],
+                                     dtype = '>i8').tobytes())
+            h.update(np.asarray(polygonset.layers, dtype = '>i8').tobytes())
+            h.update(np.asarray(polygonset.datatypes, dtype = '>i8').tobytes())
+            if len(polygonset.polygons) > 0:
+                points = np.concatenate(polygonset.polygons)
+                h.update(np.round(points*multiplier).astype('>i8').tobytes())
+            h.update(_pack_properties(polygonset.properties))
+        if len(cell.paths) + len(cell.labels) > 0:
+            elements = io.BytesIO()
+            for path in cell.paths:
+                path.to_gds(elements, multiplier)
+            for label in cell.labels:
+                label.to_gds(elements, multiplier)
+            h.update(b'E' + elements.getvalue())
+        for ref in cell.references:
+            ref_cell = ref.ref_cell
+            name = digests[ref_cell] if isinstance(ref_cell, gdspy.Cell) \
+                   else ref_cell
+            if getattr(ref, 'origins', None) is not None:
+                h.update(b'T' + _pack_reference_table(ref, name, multiplier))
+            else:
+                h.update(b'R' + _pack_reference(ref, name, multiplier))
+        digests[cell] = h.hexdigest()
+    return digests
+
+
+def _deduplicate_cells(all_cells, names, multiplier):
+    """ Finds the cells of ``all_cells`` (in dependency order) which are
+    identical to an earlier cell.  Returns the list of cells to write and a
+    copy of ``names`` in which every duplicate cell has the name of the
+    first cell identical to it, so references to it are rewired """
+    digests = _cell_digests(all_cells, multiplier)
+    first_cells = {}
+    unique_cells = []
+    names = dict(names)
+    for cell in all_cells:
+        first = first_cells.setdefault(digests[cell], cell)
+        if first is cell:
+            unique_cells.append(cell)
+        else:
+            names[cell] = names[first]
+    return unique_cells, names
+
+
+def write_gds(outfile, cells, names = None, libname = 'library', unit = 1e-6,
+              precision = 1e-9, timestamp = None, buffer_size = 2**22,
+              compression = None, compression_level = None,
+              deduplicate = False):
+    """ Writes ``cells`` and all the cells they reference to a GDSII file.
+
+    Cells are streamed to the file one at a time, in dependency order, with
+    the names given by the dictionary ``names`` (cells not in ``names`` are
+    written with their own name).  The cells themselves are never modified.
+    ``outfile`` can be a filename or a file object opened in binary mode.
+    When writing to a filename, the file is compressed with ``compression``
+    ("gzip" or "zstd"), which by default is determined from the extension
+    (.gz or .zst).  If ``deduplicate`` is True, cells whose contents are
+    identical (after rounding to ``precision``) are written only once and
+    all the references to them point to that single cell """
+    if names is None: names = {}
+    all_cells = _cells_in_dependency_order(cells)
+    names = {c:names.get(c, c.name) for c in all_cells}
+    if deduplicate:
+        all_cells, names = _deduplicate_cells(all_cells, names, unit/precision)
+    if timestamp is None: timestamp = datetime.datetime.today()
+    multiplier = unit/precision
+
+    close = isinstance(outfile, str)
+    if close:
+        if compression is None:
+            compression = _compression_from_filename(outfile)
+        _check_compression(compression)
+        if compression is None:
+            outfile = io.open(outfile, 'wb', buffering = buffer_size)
+        else:
+            outfile = _CompressedWriter(outfile, compression = compression,
+                                        level = compression_level,
+                                        chunk_size = buffer_size)
+    try:
+        outfile.write(struct.pack('>3H', 6, 0x0002, 0x0258) +
+                      _pack_timestamp(0x0102, timestamp) +
+                      _pack_string(0x0206, libname) +
+                      struct.pack('>2H', 20, 0x0305) +
+                      _eight_byte_real(precision/unit) +
+                      _eight_byte_real(precision))
+        for cell in all_cells:
+            _write_cell(outfile, cell, names, multiplier, timestamp)
+        outfile.write(struct.pack('>2H', 4, 0x0400))
+    finally:
+        if close: outfile.close()
+
+
+#==============================================================================
+#
+# GDSII reader
+#
+#==============================================================================
+
+_BGNSTR_HEADER = struct.pack('>2H', 28, 0x0502)
+_ENDSTR_RECORD = struct.pack('>2H', 4, 0x0700)
+_ENDEL_RECORD = struct.pack('>2H', 4, 0x1100)
+_BOUNDARY_ELEMENT = 0x100
+# An SREF or AREF record, optional ELFLAGS and PLEX records, and the header
+# of the SNAME record (whose size is captured)
+_REFERENCE_PATTERN = re.compile(rb'\x00\x04[\x0a\x0b]\x00(?:\x00\x06\x26\x01..)?'
+                                rb'(?:\x00\x08\x2f\x03....)?(..)\x12\x06', re.DOTALL)
+_ELEMENT_RECORDS = {0x08 : 'polygon', 0x2D : 'polygon', 0x09 : 'path',
+                    0x0A : 'reference', 0x0B : 'array', 0x0C : 'label'}
+
+
+def _decode_string(data):
+    if data[-1:] == b'\0':
+        data = data[:-1]
+    return data.decode('ascii')
+
+
+class GdsCellData(object):
+    """ The contents of one GDSII structure as read by GdsReader: polygons
+    grouped by (layer, datatype), paths (as gdspy FlexPaths), labels and
+    references (as dictionaries of keyword arguments).  The polygons of
+    each layer are views into a single [N][2] array of coordinates """
+
+    def __init__(self, name):
+        self.name = name
+        self.polygons = {}
+        self.paths = []
+        self.labels = []
+        self.references = []
+
+    def __getstate__(self):
+        # Pickle the polygons of each layer as one array of coordinates
+        state = dict(self.__dict__)
+        state['polygons'] = {layer:(np.concatenate(p), [len(q) for q in p])
+                             for layer, p in self.polygons.items()}
+        return state
+
+    def __setstate__(self, state):
+        polygons = state.pop('polygons')
+        self.__dict__.update(state)
+        self.polygons = {}
+        for layer, (coordinates, sizes) in polygons.items():
+            ends = np.cumsum(sizes)
+            self.polygons[layer] = [coordinates[e-n:e] for e, n in zip(ends.tolist(), sizes)]
+
+    def __repr__(self):
+        return ('GdsCellData (name "%s", %s polygons, %s references)' %
+                (self.name, sum(len(p) for p in self.polygons.values()),
+                 len(self.references)))
+
+
+class GdsReader(object):
+    """ Lazy reader for uncompressed GDSII files.  The file is memory-mapped
+    and, on creation, only the library header is parsed and the offset of
+    every structure (cell) is indexed, together with the names of the cells
+    it references, so the hierarchy is known without walking the elements of
+    any cell.  Cells are only parsed when requested
+    through read_cell(), which can also skip the elements on layers that are
+    not needed """
+
+    def __init__(self, filename):
+        compression = gds_compression(filename)
+        if compression is not None:
+            raise ValueError('[PHIDL] GdsReader cannot memory-map the %s-compressed '
+                             'file %s, decompress it first or read it with '
+                             'open_gds()' % (compression, filename))
+        self.filename = filename
+        self._open()
+        self.libname = None
+        self.units = (1.0, 1e-9)
+        self._cells = {}
+        self._references = {}
+        self._parse_header()
+        self._index_cells()
+
+    def _open(self):
+        self._file = io.open(self.filename, 'rb')
+        try:
+            self._buffer = mmap.mmap(self._file.fileno(), 0, access = mmap.ACCESS_READ)
+        except:
+            self._file.close()
+            raise
+
+    def close(self):
+        self._buffer.close()
+        self._file.close()
+
+    def __getstate__(self):
+        # A pickled reader (e.g. sent to a worker process) keeps the index
+        # of the cells and maps the file again when unpickled
+        return dict(filename = self.filename, libname = self.libname,
+                    units = self.units, _first_cell = self._first_cell,
+                    _cells = self._cells, _references = self._references)
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._open()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __repr__(self):
+        return ('GdsReader ("%s", %s cells)' % (self.filename, len(self._cells)))
+
+    @property
+    def cell_names(self):
+        return list(self._cells.keys())
+
+    def _records(self, start, end):
+        """ Yields the (record type, data offset, data size) of the records
+        between ``start`` and ``end``.  The records of simple polygons
+        (BOUNDARY, LAYER, DATATYPE, a single XY and ENDEL), by far the most
+        common element, are yielded together as one _BOUNDARY_ELEMENT with
+        the offset and size of its XY data """
+        buf = self._buffer
+        unpack_from = struct.unpack_from
+        pos = start
+        while pos < end:
+            size, record = unpack_from('>2H', buf, pos)
+            if record == 0x0800 and size == 4:
+                header = unpack_from('>2Hh2Hh2H', buf, pos + 4)
+                if header[1] == 0x0D02 and header[4] == 0x0E02 and header[7] == 0x1003:
+                    xy_end = pos + 16 + header[6]
+                    if buf[xy_end:xy_end+4] == _ENDEL_RECORD:
+                        yield _BOUNDARY_ELEMENT, pos + 20, header[6] - 4
+                        pos = xy_end + 4
+                        continue
+            if size < 4:
+                raise ValueError('[PHIDL] GdsReader: Invalid record at byte %s '
+                                 'of %s' % (pos, self.filename))
+            yield record >> 8, pos + 4, size - 4
+            pos += size
+
+    def _parse_header(self):
+        buf = self._buffer
+        self._first_cell = len(buf)
+        for record, pos, size in self._records(0, len(buf)):
+            if record == 0x02:
+                self.libname = _decode_string(buf[pos:pos+size])
+            elif record == 0x03:
+                self.units = (_eight_byte_real_to_float(buf[pos:pos+8]),
+                              _eight_byte_real_to_float(buf[pos+8:pos+16]))
+            elif record == 0x05 or record == 0x04:
+                self._first_cell = pos - 4
+                break
+
+    def _index_cells(self):
+        """ Finds the offset of every BGNSTR record.  Candidates found by
+        searching for the BGNSTR header are validated by the ENDSTR record
+        preceding them and the STRNAME record following them, so the
+        elements of the cells never have to be walked """
+        buf = self._buffer
+        starts = []
+        pos = self._first_cell
+        while True:
+            i = buf.find(_BGNSTR_HEADER, pos)
+            if i < 0: break
+            pos = i + 1
+            if i != self._first_cell and buf[i-4:i] != _ENDSTR_RECORD:
+                continue
+            size, record = struct.unpack_from('>2H', buf, i + 28)
+            if record != 0x0606:
+                continue
+            name = _decode_string(buf[i+32:i+28+size])
+            if name in self._cells:
+                raise ValueError('[PHIDL] GdsReader: Multiple cells with name '
+                                 '%s in file %s' % (name, self.filename))
+            self._cells[name] = None
+            starts.append(i)
+            pos = i + 28 + size
+        for name, start, end in zip(self._cells, starts, starts[1:] + [len(buf)]):
+            self._cells[name] = (start, end)
+            self._references[name] = []
+        self._index_references()
+
+    def _index_references(self):
+        """ Finds the SNAME of every SREF and AREF element in a single search
+        through the file.  Records are 2-byte aligned and only names of
+        cells in the file are accepted, which rules out matches inside the
+        data of other records """
+        buf = self._buffer
+        names = list(self._cells.keys())
+        starts = [self._cells[name][0] for name in names]
+        n = -1
+        next_start = starts[0] if starts else len(buf)
+        for match in _REFERENCE_PATTERN.finditer(buf, self._first_cell):
+            pos = match.start()
+            if pos % 2 != 0:
+                continue
+            while pos >= next_start:
+                n += 1
+                next_start = starts[n + 1] if n + 1 < len(starts) else len(buf)
+            size = struct.unpack('>H', match.group(1))[0]
+            try:
+                ref_name = _decode_string(buf[match.end():match.end() + size - 4])
+            except UnicodeDecodeError:
+                continue
+            if ref_name in self._cells:
+                self._references[names[n]].append(ref_name)
+
+    def _check_cell(self, name):
+        if name not in self._cells:
+            raise ValueError('[PHIDL] GdsReader: The requested cell (named %s) '
+                             'is not present in file %s' % (name, self.filename))
+
+    def get_references(self, name):
+        """ Returns the names of the cells referenced directly by cell
+        ``name`` (from the index, without parsing the cell) """
+        self._check_cell(name)
+        return list(self._references[name])
+
+    def get_dependencies(self, name):
+        """ Returns the names of all the cells referenced (recursively) by
+        cell ``name`` """
+        self._check_cell(name)
+        dependencies = set()
+        to_visit = [name]
+        while to_visit:
+            for ref_name in self._references[to_visit.pop()]:
+                if ref_name not in dependencies:
+                    dependencies.add(ref_name)
+                    to_visit.append(ref_name)
+        return dependencies
+
+    def top_level(self):
+        """ Returns the names of the cells not referenced by any other cell """
+        referenced = set()
+        for ref_names in self._references.values():
+            referenced.update(ref_names)
+        return [name for name in self._cells if name not in referenced]
+
+    def read_cell(self, name, layers = None):
+        """ Parses cell ``name`` into a GdsCellData.  If ``layers`` (a set of
+        (layer, datatype) tuples) is given, polygons, paths and labels on any
+        other layer are skipped without converting their coordinates """
+        self._check_cell(name)
+        start, end = self._cells[name]
+        buf = self._buffer
+        factor = self.units[0]
+        cell = GdsCellData(name)
+        element = None
+        kwargs = {}
+        raw_polygons = {}
+        for record, pos, size in self._records(start, end):
+            if record == _BOUNDARY_ELEMENT:
+                layer = struct.unpack_from('>h4xh', buf, pos - 12)
+                if layers is None or layer in layers:
+                    xy = np.frombuffer(buf, dtype = '>i4', count = size//4, offset = pos)
+                    raw_polygons.setdefault(layer, []).append(xy)
+            # XY
+            elif record == 0x10:
+                if element is None: continue
+                if layers is not None and element in ('polygon', 'path', 'label'):
+                    datatype = kwargs.get('texttype' if element == 'label' else 'datatype', 0)
+                    if (kwargs.get('layer', 0), datatype) not in layers:
+                        element = 'skip'
+                        continue
+                xy = np.frombuffer(buf, dtype = '>i4', count = size//4, offset = pos)
+                kwargs.setdefault('xy', []).append(xy)
+            # LAYER
+            elif record == 0x0D:
+                kwargs['layer'] = struct.unpack_from('>h', buf, pos)[0]
+            # DATATYPE or BOXTYPE
+            elif record == 0x0E or record == 0x2E:
+                kwargs['datatype'] = struct.unpack_from('>h', buf, pos)[0]
+            # TEXTTYPE
+            elif record == 0x16:
+                kwargs['texttype'] = struct.unpack_from('>h', buf, pos)[0]
+            # ENDEL
+            elif record == 0x11:
+                if element == 'polygon':
+                    # Polygons are kept as big-endian views into the file
+                    # until the whole cell has been read
+                    xy = kwargs['xy']
+                    xy = xy[0] if len(xy) == 1 else np.concatenate(xy)
+                    layer = (kwargs.get('layer', 0), kwargs.get('datatype', 0))
+                    raw_polygons.setdefault(layer, []).append(xy)
+                elif element is not None and element != 'skip':
+                    self._add_element(cell, element, kwargs, factor)
+                element = None
+                kwargs = {}
+            # BOUNDARY, BOX, PATH, SREF, AREF or TEXT
+            elif record in _ELEMENT_RECORDS:
+                element = _ELEMENT_RECORDS[record]
+            # SNAME
+            elif record == 0x12:
+                kwargs['ref_cell'] = _decode_string(buf[pos:pos+size])
+            # STRING
+            elif record == 0x19:
+                kwargs['text'] = _decode_string(buf[pos:pos+size])
+            # WIDTH
+            elif record == 0x0F:
+                width = struct.unpack_from('>l', buf, pos)[0]
+                kwargs['width'] = factor*abs(width)
+                if width < 0: kwargs['width_transform'] = False
+            # COLROW
+            elif record == 0x13:
+                kwargs['columns'], kwargs['rows'] = struct.unpack_from('>2h', buf, pos)
+            # STRANS
+            elif record == 0x1A:
+                kwargs['x_reflection'] = (struct.unpack_from('>H', buf, pos)[0] & 0x8000) > 0
+            # MAG
+            elif record == 0x1B:
+                kwargs['magnification'] = _eight_byte_real_to_float(buf[pos:pos+8])
+            # ANGLE
+            elif record == 0x1C:
+                kwargs['rotation'] = _eight_byte_real_to_float(buf[pos:pos+8])
+            # PRESENTATION
+            elif record == 0x17:
+                presentation = struct.unpack_from('>H', buf, pos)[0]
+                kwargs['anchor'] = gdspy.GdsLibrary._import_anchors[presentation & 0x000F]
+            # PATHTYPE
+            elif record == 0x21:
+                pathtype = struct.unpack_from('>h', buf, pos)[0]
+                kwargs['ends'] = gdspy.GdsLibrary._pathtype_dict.get(pathtype, 'extended')
+            # BGNEXTN
+            elif record == 0x30:
+                kwargs['bgnextn'] = factor*struct.unpack_from('>l', buf, pos)[0]
+            # ENDEXTN
+            elif record == 0x31:
+                kwargs['endextn'] = factor*struct.unpack_from('>l', buf, pos)[0]
+            # ENDSTR
+            elif record == 0x07:
+                break
+        for layer, raw in raw_polygons.items():
+            cell.polygons[layer] = self._convert_polygons(raw, factor)
+        return cell
+
+    @staticmethod
+    def _convert_polygons(raw, factor):
+        """ Converts a list of (closed) big-endian int32 XY arrays into
+        polygons.  All the coordinates are converted to float in a single
+        operation, and the polygons returned are views into that array """
+        sizes = np.array([len(xy) for xy in raw], dtype = np.int64)//2
+        coordinates = np.concatenate(raw).astype(np.float64)
+        coordinates *= factor
+        coordinates = coordinates.reshape(-1, 2)
+        ends = np.cumsum(sizes)
+        # Drop the last point of each polygon, which repeats the first one
+        return [coordinates[s:e] for s, e in zip((ends - sizes).tolist(), (ends - 1).tolist())]
+
+    @staticmethod
+    def _add_element(cell, element, kwargs, factor):
+        xy = kwargs.pop('xy', [])
+        xy = xy[0] if len(xy) == 1 else np.concatenate(xy)
+        xy = (xy*factor).reshape(-1, 2)
+        if element == 'path':
+            if 'bgnextn' in kwargs or 'endextn' in kwargs:
+                kwargs['ends'] = (kwargs.pop('bgnextn', 0), kwargs.pop('endextn', 0))
+            kwargs.pop('width_transform', None)
+            cell.paths.append(gdspy.FlexPath(points = xy, gdsii_path = True, **kwargs))
+        elif element == 'label':
+            cell.labels.append(dict(text = kwargs.get('text', ''), position = xy[0],
+                                    anchor = kwargs.get('anchor', 'o'),
+                                    rotation = kwargs.get('rotation'),
+                                    magnification = kwargs.get('magnification'),
+                                    x_reflection = kwargs.get('x_reflection', False),
+                                    layer = kwargs.get('layer', 0),
+                                    texttype = kwargs.get('texttype', 0)))
+        elif element == 'reference':
+            cell.references.append(dict(ref_cell = kwargs['ref_cell'], origin = xy[0],
+                                        rotation = kwargs.get('rotation'),
+                                        magnification = kwargs.get('magnification'),
+                                        x_reflection = kwargs.get('x_reflection', False)))
+        elif element == 'array':
+            # Same conversion of the AREF lattice points as gdspy
+            columns, rows = kwargs['columns'], kwargs['rows']
+            xy = xy.ravel()
+            rotation = kwargs.get('rotation')
+            if 'x_reflection' in kwargs:
+                if rotation is not None:
+                    sa = -np.sin(rotation*np.pi/180)
+                    ca = np.cos(rotation*np.pi/180)
+                    x2 = (xy[2] - xy[0])*ca - (xy[3] - xy[1])*sa + xy[0]
+                    y3 = (xy[4] - xy[0])*sa + (xy[5] - xy[1])*ca + xy[1]
+                else:
+                    x2, y3 = xy[2], xy[5]
+                if kwargs['x_reflection']:
+                    y3 = 2*xy[1] - y3
+            else:
+                x2, y3 = xy[2], xy[5]
+            cell.references.append(dict(ref_cell = kwargs['ref_cell'], origin = xy[0:2],
+                                        rotation = rotation,
+                                        magnification = kwargs.get('magnification'),
+                                        x_reflection = kwargs.get('x_reflection', False),
+                                        columns = columns, rows = rows,
+                                        spacing = ((x2 - xy[0])/columns, (y3 - xy[1])/rows)))
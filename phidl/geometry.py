@@ -7,15 +7,23 @@ from numpy import sqrt, pi, cos, sin, log, exp, sinh
 
 import gdspy
 from gdspy import clipper
-from phidl.device_layout import Device, Port, Polygon, CellArray
-from phidl.device_layout import _parse_layer, DeviceReference
+from phidl.device_layout import Device, Port, Polygon, CellArray, Label
+from phidl.device_layout import _parse_layer, DeviceReference, _rotate_points
+from phidl.device_layout import ReferenceTable
+from phidl.device_layout import __version__ as _phidl_version
 import copy as python_copy
-from collections import OrderedDict
+from collections import OrderedDict, namedtuple
 import pickle
 import json
+import os
+import hashlib
+import tempfile
 import warnings
+import multiprocessing
 from functools import update_wrapper
 from phidl.constants import _glyph,_width,_indent
+from phidl.gdsii import open_gds, gds_compression, GdsReader
+from phidl.oasis import read_oas, _array_spacing
 
 
 ##### Categories:
@@ -362,8 +370,25 @@ def C(width = 1, size = (10,20) , layer = 0):
 
 def offset(elements, distance = 0.1, join_first = True, precision = 1e-4, 
         num_divisions = [1,1],  join='miter', tolerance=2,
-        max_points = 4000, layer = 0):
+        max_points = 4000, num_workers = 1, hierarchical = False,
+        merge_seams = False, layer = 0):
+    """ Shrinks or expands the polygons in `elements` by `distance`.  If
+    ``num_divisions`` is larger than [1,1], the offset is computed tile-by-tile
+    across ``num_workers`` processes (``None`` uses all available cores).
+    Polygons are then split along the tile borders, unless ``merge_seams`` is
+    True, in which case the pieces are unioned back together.
+
+    If ``hierarchical`` is True, references which do not come within
+    2*`distance` of any other geometry are not flattened.  Instead each
+    referenced Device is offset once and the result is placed with the same
+    transformation as the original reference """
     if type(elements) is not list: elements = [elements]
+    if hierarchical == True:
+        kwargs = dict(distance = distance, join_first = join_first,
+            precision = precision, num_divisions = num_divisions, join = join,
+            tolerance = tolerance, max_points = max_points,
+            num_workers = num_workers, merge_seams = merge_seams, layer = layer)
+        return _offset_hierarchical(elements, kwargs, cache = {})
     polygons_to_offset = []
     for e in elements:
         if isinstance(e, (Device, DeviceReference)): polygons_to_offset += e.get_polygons(by_spec = False)
@@ -385,6 +410,8 @@ def offset(elements, distance = 0.1, join_first = True, precision = 1e-4,
             precision = precision,
             join = join,
             tolerance = tolerance,
+            num_workers = num_workers,
+            merge_seams = merge_seams,
             )
 
     D = Device('offset')
@@ -394,7 +421,8 @@ def offset(elements, distance = 0.1, join_first = True, precision = 1e-4,
 
 
 def boolean(A, B, operation, precision = 1e-4, num_divisions = [1,1],
-            max_points=4000, layer = 0):
+            max_points=4000, num_workers = 1, hierarchical = False,
+            merge_seams = True, layer = 0):
     """
     Performs boolean operations between 2 Device/DeviceReference objects,
     or lists of Devices/DeviceReferences.
@@ -402,7 +430,23 @@ def boolean(A, B, operation, precision = 1e-4, num_divisions = [1,1],
     ``operation`` should be one of {'not', 'and', 'or', 'xor', 'A-B', 'B-A', 'A+B'}.  
     Note that 'A+B' is equivalent to 'or', 'A-B' is equivalent to 'not', and
     'B-A' is equivalent to 'not' with the operands switched
+
+    If ``num_divisions`` is larger than [1,1], the plane is split into tiles
+    which are processed separately and (if ``merge_seams`` is True) stitched
+    back together afterwards.  The tiles are spread across ``num_workers``
+    processes (``None`` uses all available cores)
+
+    If ``hierarchical`` is True, references which do not touch any other
+    geometry in A or B are not flattened.  Their result only depends on the
+    referenced Device, so it is computed once per Device and placed with the
+    same transformation as the original reference
     """
+    if hierarchical == True:
+        kwargs = dict(precision = precision, num_divisions = num_divisions,
+            max_points = max_points, num_workers = num_workers,
+            merge_seams = merge_seams, layer = layer)
+        return _boolean_hierarchical(A, B, operation, kwargs, cache = {})
+
     D = Device('boolean')
 
     A_polys = []
@@ -448,7 +492,8 @@ def boolean(A, B, operation, precision = 1e-4, num_divisions = [1,1],
         else:
             p = _boolean_polygons_parallel(polygons_A = A_polys, polygons_B = B_polys,
                        num_divisions = num_divisions, operation = operation,
-                       precision = precision)
+                       precision = precision, num_workers = num_workers,
+                       merge_seams = merge_seams)
 
     if p is not None:
         polygons = D.add_polygon(p, layer = layer)
@@ -457,7 +502,8 @@ def boolean(A, B, operation, precision = 1e-4, num_divisions = [1,1],
 
 
 def outline(elements, distance = 1, precision = 1e-4, num_divisions = [1,1],
-    join = 'miter', tolerance = 2, join_first = True, max_points = 4000, layer = 0):
+    join = 'miter', tolerance = 2, join_first = True, max_points = 4000,
+    num_workers = 1, merge_seams = False, layer = 0):
     """ Creates an outline around all the polygons passed in the `elements`
     argument.  `elements` may be a Device, Polygon, or list of Devices
     """
@@ -470,9 +516,11 @@ def outline(elements, distance = 1, precision = 1e-4, num_divisions = [1,1],
 
     D_bloated = offset(D, distance = distance, join_first = join_first,
         num_divisions = num_divisions, precision = precision, max_points = max_points,
-        join = join, tolerance = tolerance, layer = layer)
+        join = join, tolerance = tolerance, num_workers = num_workers,
+        merge_seams = merge_seams, layer = layer)
     Outline = boolean(A = D_bloated, B = D, operation = 'A-B', num_divisions = num_divisions,
-         max_points = max_points, precision = precision, layer = layer)
+         max_points = max_points, precision = precision, num_workers = num_workers,
+         merge_seams = merge_seams, layer = layer)
     return Outline
 
 
@@ -480,7 +528,8 @@ def inset(elements, distance = 0.1, join_first = True, precision = 1e-4, layer =
     raise ValueError('[PHIDL] pg.inset() is deprecated, please use pg.offset()')
 
 
-def invert(elements, border = 10, precision = 1e-4, num_divisions = [1,1], max_points = 4000, layer = 0):
+def invert(elements, border = 10, precision = 1e-4, num_divisions = [1,1],
+           max_points = 4000, num_workers = 1, merge_seams = False, layer = 0):
     """ Creates an inverted version of the input shapes with an additional
     border around the edges """
     Temp = Device()
@@ -495,13 +544,16 @@ def invert(elements, border = 10, precision = 1e-4, num_divisions = [1,1], max_p
     R.center = Temp.center
 
     D = boolean(A = R, B = Temp, operation = 'A-B', precision = precision,
-                num_divisions = num_divisions, max_points = max_points, layer = layer)
+                num_divisions = num_divisions, max_points = max_points,
+                num_workers = num_workers, merge_seams = merge_seams, layer = layer)
     return D
 
-def xor_diff(A,B, precision = 1e-4):
+def xor_diff(A,B, precision = 1e-4, num_workers = 1):
     """ Given two Devices A and B, performs the layer-by-layer XOR
     difference between A and B, and returns polygons representing
-    the differences between A and B.
+    the differences between A and B.  Layers present in both Devices
+    are processed independently across ``num_workers`` processes
+    (``None`` uses all available cores)
     """
     D = Device()
     A_polys = A.get_polygons(by_spec = True)
@@ -511,11 +563,18 @@ def xor_diff(A,B, precision = 1e-4):
     all_layers = set()
     all_layers.update(A_layers )
     all_layers.update(B_layers)
+    all_layers = sorted(all_layers)
+
+    shared_layers = [layer for layer in all_layers if (layer in A_layers) and (layer in B_layers)]
+    tasks = [(_polygons_to_ragged(A_polys[layer]), _polygons_to_ragged(B_polys[layer]))
+             for layer in shared_layers]
+    xor_polygons = _parallel_map(_xor_layer_task, tasks, dict(precision = precision),
+                                 num_workers = num_workers)
+    xor_polygons = dict(zip(shared_layers, xor_polygons))
+
     for layer in all_layers:
         if (layer in A_layers) and (layer in B_layers):
-            p = gdspy.boolean(operand1 = A_polys[layer], operand2 = B_polys[layer],
-                                   operation = 'xor', precision=precision,
-                                   max_points=4000, layer=layer[0], datatype=layer[1])
+            p = xor_polygons[layer]
         elif (layer in A_layers):
             p = A_polys[layer]
         elif (layer in B_layers):
@@ -525,20 +584,227 @@ def xor_diff(A,B, precision = 1e-4):
     return D
 
 
-def union(D, by_layer = False, precision = 1e-4, join_first = True, max_points = 4000, layer = 0):
+def _xor_layer_task(context, task):
+    """ Worker function for xor_diff(), XORs the polygons of a single layer """
+    (points_A, offsets_A), (points_B, offsets_B) = task
+    p = gdspy.boolean(operand1 = _ragged_to_polygons(points_A, offsets_A),
+                      operand2 = _ragged_to_polygons(points_B, offsets_B),
+                      operation = 'xor', precision = context['precision'],
+                      max_points = 4000)
+    if p is None: return None
+    return p.polygons
+
+
+def union(D, by_layer = False, precision = 1e-4, join_first = True,
+          max_points = 4000, num_workers = 1, hierarchical = False, layer = 0):
+    """ Merges all the polygons of the Device `D` into a single layer, or
+    layer-by-layer if ``by_layer`` is True.  When merging by layer, the
+    layers are processed independently across ``num_workers`` processes
+    (``None`` uses all available cores).  If ``hierarchical`` is True,
+    references which do not touch any other geometry are not flattened,
+    and each referenced Device is only unioned once """
+    if hierarchical == True:
+        kwargs = dict(by_layer = by_layer, precision = precision,
+            join_first = join_first, max_points = max_points,
+            num_workers = num_workers, layer = layer)
+        return _union_hierarchical(D, kwargs, cache = {})
+
     U = Device()
 
     if by_layer == True:
         all_polygons = D.get_polygons(by_spec = True)
-        for layer, polygons in all_polygons.items():
-            unioned_polygons = _union_polygons(polygons, precision = precision, max_points=max_points)
+        layers = sorted(all_polygons.keys())
+        tasks = [_polygons_to_ragged(all_polygons[layer]) for layer in layers]
+        context = dict(precision = precision, max_points = max_points)
+        all_unioned_polygons = _parallel_map(_union_layer_task, tasks, context,
+                                             num_workers = num_workers)
+        for layer, unioned_polygons in zip(layers, all_unioned_polygons):
             U.add_polygon(unioned_polygons, layer = layer)
     else:
         all_polygons = D.get_polygons(by_spec = False)
-        unioned_polygons = _union_polygons(all_polygons, precision = precision, max_points=max_points)
-        U.add_polygon(unioned_polygons, layer = layer)
+        if len(all_polygons) > 0:
+            unioned_polygons = _union_polygons(all_polygons, precision = precision, max_points=max_points)
+            U.add_polygon(unioned_polygons, layer = layer)
+    return U
+
+def _offset_hierarchical(elements, kwargs, cache):
+    [(references, others)] = _split_isolated_references([elements],
+                                margin = 2*abs(kwargs['distance']))
+    D = offset(_device_from_elements(others), hierarchical = False, **kwargs)
+    _add_transformed_references(D, references,
+        fun = lambda device: _offset_hierarchical([device], kwargs, cache),
+        cache = cache)
+    return D
+
+
+def _boolean_hierarchical(A, B, operation, kwargs, cache):
+    if type(A) is not list: A = [A]
+    if type(B) is not list: B = [B]
+    [(references_A, others_A), (references_B, others_B)] = \
+        _split_isolated_references([A, B], margin = 0)
+    D = boolean(A = _device_from_elements(others_A), B = _device_from_elements(others_B),
+                operation = operation, hierarchical = False, **kwargs)
+
+    # An isolated reference contributes its own geometry to the result
+    # (e.g. A-B for a reference in A) or nothing at all (e.g. A-B for a
+    # reference in B, or any reference when the operation is 'and')
+    operation = operation.lower().replace(' ','')
+    keep_references = []
+    if operation in ('not', 'a-b', 'or', 'a+b', 'xor'): keep_references += references_A
+    if operation in ('b-a', 'or', 'a+b', 'xor'):        keep_references += references_B
+    union_kwargs = dict(by_layer = False, precision = kwargs['precision'],
+        join_first = True, max_points = kwargs['max_points'], layer = kwargs['layer'])
+    _add_transformed_references(D, keep_references,
+        fun = lambda device: _union_hierarchical(device, union_kwargs, cache),
+        cache = cache)
+    return D
+
+
+def _union_hierarchical(D, kwargs, cache):
+    [(references, others)] = _split_isolated_references([[D]], margin = 0)
+    U = union(_device_from_elements(others), hierarchical = False, **kwargs)
+    _add_transformed_references(U, references,
+        fun = lambda device: _union_hierarchical(device, kwargs, cache),
+        cache = cache)
     return U
 
+
+def _device_from_elements(elements):
+    """ Creates a temporary Device containing the (already-owned) polygons
+    and references in `elements` without altering them """
+    D = Device()
+    D.add(elements)
+    return D
+
+
+def _add_transformed_references(D, references, fun, cache):
+    """ For each reference in `references`, adds a reference to fun(ref.parent)
+    to the Device `D` with the same transformation as the original.  The
+    results of fun() are stored in `cache` so that each referenced Device is
+    only processed once """
+    for r in references:
+        if r.parent not in cache:
+            cache[r.parent] = fun(r.parent)
+        new_device = cache[r.parent]
+        if isinstance(r, CellArray):
+            new_ref = CellArray(device = new_device, columns = r.columns,
+                rows = r.rows, spacing = r.spacing, origin = r.origin,
+                rotation = r.rotation, magnification = r.magnification,
+                x_reflection = r.x_reflection)
+        else:
+            new_ref = DeviceReference(device = new_device, origin = r.origin,
+                rotation = r.rotation, magnification = r.magnification,
+                x_reflection = r.x_reflection)
+        new_ref.owner = D
+        D.add(new_ref)
+    return D
+
+
+def _split_isolated_references(operands, margin = 0):
+    """ Given a list of operands (each a list of Devices, DeviceReferences,
+    CellArrays and Polygons), finds the references which do not come within
+    `margin` of any other geometry in any of the operands.  Devices are
+    expanded into their own polygons, paths (as PolygonSets) and references.
+    Returns a list with one (isolated_references, other_elements) tuple per
+    operand """
+    items = []
+    for n, elements in enumerate(operands):
+        for e in elements:
+            if isinstance(e, Device):
+                items += [(n, p) for p in e.polygons]
+                items += [(n, path.to_polygonset()) for path in e.paths]
+                for r in e.references:
+                    if isinstance(r, ReferenceTable): items += [(n, view) for view in r]
+                    else:                             items.append((n, r))
+            elif isinstance(e, (gdspy.PolygonSet, gdspy.CellReference, gdspy.CellArray)):
+                items.append((n, e))
+
+    bboxes = np.zeros([len(items),4])
+    is_candidate = np.zeros(len(items), dtype = bool)
+    for i, (n, e) in enumerate(items):
+        if isinstance(e, gdspy.PolygonSet):
+            bbox = e.get_bounding_box()
+        else:
+            bbox, is_candidate[i] = _reference_bbox_for_isolation(e, margin)
+        if bbox is not None:
+            bboxes[i] = np.ravel(bbox)
+
+    is_isolated = is_candidate & ~_find_interacting_bboxes(bboxes, is_candidate, margin)
+    result = [([], []) for elements in operands]
+    for i, (n, e) in enumerate(items):
+        result[n][0 if is_isolated[i] else 1].append(e)
+    return result
+
+
+def _reference_bbox_for_isolation(ref, margin = 0):
+    """ Returns the bounding box of a DeviceReference or CellArray computed from
+    the bounding box of its parent Device, along with whether the reference
+    can be processed on its own (no magnification, non-empty, and for
+    CellArrays no interaction between the elements of the array) """
+    parent_bbox = ref.parent.get_bounding_box()
+    if parent_bbox is None:
+        return None, False
+    (x0, y0), (x1, y1) = parent_bbox
+    can_isolate = (ref.magnification is None) or (ref.magnification == 1)
+    if isinstance(ref, gdspy.CellArray):
+        dx = ref.spacing[0]*(ref.columns - 1)
+        dy = ref.spacing[1]*(ref.rows - 1)
+        x0, x1 = x0 + min(dx, 0), x1 + max(dx, 0)
+        y0, y1 = y0 + min(dy, 0), y1 + max(dy, 0)
+        if (ref.columns > 1) and (abs(ref.spacing[0]) <= parent_bbox[1][0] - parent_bbox[0][0] + margin):
+            can_isolate = False
+        if (ref.rows > 1) and (abs(ref.spacing[1]) <= parent_bbox[1][1] - parent_bbox[0][1] + margin):
+            can_isolate = False
+    corners = np.array([[x0, y0], [x1, y0], [x1, y1], [x0, y1]], dtype = np.float64)
+    if ref.x_reflection:
+        corners[:,1] = -corners[:,1]
+    if ref.magnification is not None:
+        corners = corners*ref.magnification
+    if ref.rotation is not None:
+        corners = _rotate_points(corners, angle = ref.rotation)
+    if ref.origin is not None:
+        corners = corners + np.array(ref.origin)
+    bbox = np.concatenate([np.min(corners, axis = 0), np.max(corners, axis = 0)])
+    return bbox, can_isolate
+
+
+def _find_interacting_bboxes(bboxes, check, margin = 0):
+    """ For every [left, bottom, right, top] bounding box in `bboxes` where
+    `check` is True, determines whether it comes within `margin` of any other
+    bounding box.  Nearby bounding boxes are found by bucketing them into a
+    grid with _bboxes_to_tiles() """
+    interacting = np.zeros(len(bboxes), dtype = bool)
+    if (len(bboxes) < 2) or (not np.any(check)):
+        return interacting
+    num_divisions = int(np.clip(np.sqrt(len(bboxes)), 1, 1000))
+    xmin, ymin = np.min(bboxes[:,0:2], axis = 0)
+    xmax, ymax = np.max(bboxes[:,2:4], axis = 0)
+    xedges, yedges, tiles = _tile_rectangles(xmin, ymin, xmax, ymax,
+                                             [num_divisions, num_divisions])
+    # Two bboxes within `margin` of each other must both overlap some tile
+    # which has been enlarged by margin/2
+    for idx in _bboxes_to_tiles(bboxes, xedges, yedges, margin = margin/2):
+        if len(idx) < 2: continue
+        c = idx[check[idx]]
+        if len(c) == 0: continue
+        bc = bboxes[c][:,None,:]
+        bo = bboxes[idx][None,:,:]
+        overlap = (bc[:,:,0] <= bo[:,:,2] + margin) & (bo[:,:,0] <= bc[:,:,2] + margin) & \
+                  (bc[:,:,1] <= bo[:,:,3] + margin) & (bo[:,:,1] <= bc[:,:,3] + margin) & \
+                  (c[:,None] != idx[None,:])
+        interacting[c[np.any(overlap, axis = 1)]] = True
+    return interacting
+
+
+def _union_layer_task(context, task):
+    """ Worker function for union(), unions the polygons of a single layer """
+    points, offsets = task
+    unioned = _union_polygons(_ragged_to_polygons(points, offsets),
+                              precision = context['precision'],
+                              max_points = context['max_points'])
+    return unioned.polygons
+
+
 def _union_polygons(polygons, precision = 1e-4, max_points = 4000):
     polygons = _merge_floating_point_errors(polygons, tol = precision/1000)
     unioned = gdspy.boolean(polygons, [], operation = 'or',
@@ -547,16 +813,11 @@ def _union_polygons(polygons, precision = 1e-4, max_points = 4000):
 
 
 def _merge_floating_point_errors(polygons, tol = 1e-10):
-    stacked_polygons = np.vstack(polygons)
-    x = stacked_polygons[:,0]
-    y = stacked_polygons[:,1]
-    polygon_indices = np.cumsum([len(p) for p in polygons])
-
-    xfixed = _merge_nearby_floating_points(x, tol = tol)
-    yfixed = _merge_nearby_floating_points(y, tol = tol)
-    stacked_polygons_fixed = np.vstack([xfixed, yfixed]).T
-    polygons_fixed = np.vsplit(stacked_polygons_fixed, polygon_indices[:-1])
-    return polygons_fixed
+    points, offsets = _polygons_to_ragged(polygons)
+    xfixed = _merge_nearby_floating_points(points[:,0], tol = tol)
+    yfixed = _merge_nearby_floating_points(points[:,1], tol = tol)
+    points_fixed = np.vstack([xfixed, yfixed]).T
+    return _ragged_to_polygons(points_fixed, offsets)
 
 
 def _merge_nearby_floating_points(x, tol = 1e-10):
@@ -592,17 +853,25 @@ def _crop_region(polygons, left, bottom, right, top, precision):
 
 
 
-def _crop_edge_polygons(all_polygons, bboxes, left, bottom, right, top, precision):
+def _crop_edge_polygons(all_polygons, bboxes, left, bottom, right, top, precision,
+                        candidates = None):
     """ Parses out which polygons are along the edge of the rectangle and need 
      to be  cropped and which are deep inside the rectangle region and can be
-      left alone, then crops only those polygons along the edge """
+      left alone, then crops only those polygons along the edge.  If given,
+      only the polygons indexed by ``candidates`` are considered.
+      ``all_polygons`` is a ragged (points, offsets) pair as produced by
+      _polygons_to_ragged() """
+    if candidates is None:
+        candidates = np.arange(len(bboxes))
+    bboxes = bboxes[candidates]
     polygons_in_rect_i = _find_bboxes_in_rect(bboxes, left, bottom, right, top)
     polygons_edge_i = _find_bboxes_on_rect_edge(bboxes, left, bottom, right, top)
     polygons_in_rect_no_edge_i = polygons_in_rect_i & (~polygons_edge_i)
     
     # Crop polygons along the edge and recombine them with polygons inside the rectangle
-    polygons_edge = all_polygons[polygons_edge_i]
-    polygons_in_rect_no_edge = all_polygons[polygons_in_rect_no_edge_i].tolist()
+    points, offsets = all_polygons
+    polygons_edge = _ragged_to_polygons(points, offsets, candidates[polygons_edge_i])
+    polygons_in_rect_no_edge = _ragged_to_polygons(points, offsets, candidates[polygons_in_rect_no_edge_i])
     polygons_edge_cropped = _crop_region(polygons_edge, left, bottom, right, top, precision = precision)
     polygons_to_process = polygons_in_rect_no_edge + polygons_edge_cropped
     
@@ -629,12 +898,46 @@ def _find_bboxes_on_rect_edge(bboxes, left, bottom, right, top):
     return result
 
 
+def _bboxes_to_tiles(bboxes, xedges, yedges, margin = 0):
+    """ Spatial index for the tiled boolean/offset functions.  Given the grid
+    defined by ``xedges`` and ``yedges`` (as produced by _tile_rectangles()),
+    buckets each bounding box into every tile it overlaps, with the tiles
+    enlarged by ``margin`` on every side.  Returns a list (in the same order
+    as the tiles from _tile_rectangles()) of arrays containing the indices of
+    the bounding boxes overlapping each tile.  Runs in O(N + tiles) for
+    bounding boxes which are small compared to the tiles """
+    nx, ny = len(xedges) - 1, len(yedges) - 1
+    # Range of tiles spanned by each bbox in x and y (inclusive)
+    ix0 = np.clip(np.searchsorted(xedges[1:], bboxes[:,0] - margin, 'left'), 0, nx-1)
+    ix1 = np.clip(np.searchsorted(xedges[:-1], bboxes[:,2] + margin, 'right') - 1, 0, nx-1)
+    iy0 = np.clip(np.searchsorted(yedges[1:], bboxes[:,1] - margin, 'left'), 0, ny-1)
+    iy1 = np.clip(np.searchsorted(yedges[:-1], bboxes[:,3] + margin, 'right') - 1, 0, ny-1)
+    xspan = np.maximum(ix1 - ix0 + 1, 0)
+    yspan = np.maximum(iy1 - iy0 + 1, 0)
+    num_tiles_per_bbox = xspan*yspan
+
+    # Expand each bbox into one entry per (bbox, tile) pair
+    bbox_index = np.repeat(np.arange(len(bboxes)), num_tiles_per_bbox)
+    k = np.arange(len(bbox_index)) - np.repeat(np.cumsum(num_tiles_per_bbox) - num_tiles_per_bbox,
+                                               num_tiles_per_bbox)
+    xspan = xspan[bbox_index]
+    ix = ix0[bbox_index] + k % xspan
+    iy = iy0[bbox_index] + k // xspan
+    tile_index = ix*ny + iy
+
+    # Group the bbox indices by tile
+    order = np.argsort(tile_index, kind = 'stable')
+    splits = np.searchsorted(tile_index[order], np.arange(1, nx*ny))
+    return np.split(bbox_index[order], splits)
+
+
 def _offset_region(all_polygons, bboxes, left, bottom, right, top,
                 distance = 5,
                 join_first = True,
                 precision = 1e-4,
                 join = 'miter',
                 tolerance = 2,
+                candidates = None,
                 ):
     """ Taking a region of e.g. size (x,y) which needs to be offset by distance d,
     this function crops out a region (x+2*d, y+2*d) large, offsets that region,
@@ -644,7 +947,8 @@ def _offset_region(all_polygons, bboxes, left, bottom, right, top,
     # FIXME: Necessary?
     d = distance*1.01
     
-    polygons_to_offset = _crop_edge_polygons(all_polygons, bboxes, left-d, bottom-d, right+d, top+d, precision = precision)
+    polygons_to_offset = _crop_edge_polygons(all_polygons, bboxes, left-d, bottom-d, right+d, top+d,
+                                             precision = precision, candidates = candidates)
     
     # Offset the resulting cropped polygons and recrop to final desired size
     polygons_offset = clipper.offset(polygons_to_offset, distance, join, tolerance, 1/precision, int(join_first))
@@ -653,19 +957,61 @@ def _offset_region(all_polygons, bboxes, left, bottom, right, top,
     return polygons_offset_cropped
 
 
-def _polygons_to_bboxes(polygons):
-#    Build bounding boxes
-    bboxes = np.empty([len(polygons),4])
-    for n,p in enumerate(polygons):
-        try:
-            left,bottom = np.min(p,axis = 0)
-        except:
-            import pdb
-            pdb.set_trace()
-        right,top = np.max(p,axis = 0)
-        bboxes[n] = [left, bottom, right, top]
+def _polygons_to_ragged(polygons):
+    """ Converts a list of polygons into a ragged array: a single (N,2) float64
+    array ``points`` containing the vertices of every polygon back-to-back,
+    and an array ``offsets`` of length len(polygons)+1 such that polygon n is
+    points[offsets[n]:offsets[n+1]] """
+    lengths = [len(p) for p in polygons]
+    offsets = np.zeros(len(polygons) + 1, dtype = np.int64)
+    np.cumsum(lengths, out = offsets[1:])
+    if len(polygons) == 0:
+        points = np.empty([0,2])
+    else:
+        points = np.concatenate(polygons).astype(np.float64, copy = False).reshape(-1,2)
+    return points, offsets
+
+
+def _ragged_to_polygons(points, offsets, indices = None):
+    """ Converts a ragged array (see _polygons_to_ragged) back into a list of
+    polygons, optionally only those selected by ``indices``.  The polygons
+    returned are views into ``points`` """
+    if indices is None:
+        return np.split(points, offsets[1:-1])
+    return [points[offsets[i]:offsets[i+1]] for i in indices]
+
+
+def _ragged_to_bboxes(points, offsets):
+    """ Computes the [left, bottom, right, top] bounding box of every polygon
+    in a ragged array (see _polygons_to_ragged) in a single pass """
+    if len(offsets) <= 1:
+        return np.empty([0,4])
+    starts = offsets[:-1]
+    bboxes = np.empty([len(starts),4])
+    bboxes[:,0:2] = np.minimum.reduceat(points, starts, axis = 0)
+    bboxes[:,2:4] = np.maximum.reduceat(points, starts, axis = 0)
     return bboxes
 
+
+def _polygons_to_bboxes(polygons):
+    """ Computes the [left, bottom, right, top] bounding box of every polygon """
+    return _ragged_to_bboxes(*_polygons_to_ragged(polygons))
+
+def _offset_region_task(context, task):
+    """ Worker function for _offset_polygons_parallel(), offsets a single
+    tile using the polygons and bounding boxes stored in ``context`` """
+    (left, bottom, right, top), candidates = task
+    return _offset_region(context['polygons'], context['bboxes'],
+                          left, bottom, right, top,
+                          distance = context['distance'],
+                          join_first = context['join_first'],
+                          precision = context['precision'],
+                          join = context['join'],
+                          tolerance = context['tolerance'],
+                          candidates = candidates,
+                          )
+
+
 def _offset_polygons_parallel(
     polygons,
     distance = 5,
@@ -674,39 +1020,37 @@ def _offset_polygons_parallel(
     precision = 1e-4,
     join = 'miter',
     tolerance = 2,
+    num_workers = 1,
+    merge_seams = False,
     ):
     
 #    Build bounding boxes
-    polygons = np.asarray(polygons)
-    bboxes = _polygons_to_bboxes(polygons)
+    polygons = _polygons_to_ragged(polygons)
+    bboxes = _ragged_to_bboxes(*polygons)
     
     xmin,ymin = np.min(bboxes[:,0:2], axis = 0) - distance
     xmax,ymax = np.max(bboxes[:,2:4], axis = 0) + distance
-    
-    xsize = xmax - xmin
-    ysize = ymax - ymin
-    xdelta = xsize/num_divisions[0]
-    ydelta = ysize/num_divisions[1]
-    xcorners = xmin + np.arange(num_divisions[0])*xdelta
-    ycorners = ymin + np.arange(num_divisions[1])*ydelta
-
-    offset_polygons = []
-    for n,xc in enumerate(xcorners):
-        for m,yc in enumerate(ycorners):
-            left = xc
-            right = xc+xdelta
-            bottom = yc
-            top = yc+ydelta
-            _offset_region_polygons = _offset_region(polygons, bboxes,
-                                            left, bottom, right, top,
-                                            distance = distance,
-                                            join_first = join_first,
-                                            precision = precision,
-                                            join = join,
-                                            tolerance = tolerance,
-                                            )
-            offset_polygons += _offset_region_polygons
-            
+
+    xedges, yedges, tiles = _tile_rectangles(xmin, ymin, xmax, ymax, num_divisions)
+    # Same margin as the enlarged region cropped out in _offset_region()
+    tile_candidates = _bboxes_to_tiles(bboxes, xedges, yedges, margin = abs(distance)*1.01)
+
+    context = dict(
+        polygons = polygons,
+        bboxes = bboxes,
+        distance = distance,
+        join_first = join_first,
+        precision = precision,
+        join = join,
+        tolerance = tolerance,
+        )
+    tile_results = _parallel_map(_offset_region_task, zip(tiles, tile_candidates), context,
+                                 num_workers = num_workers)
+    offset_polygons = list(itertools.chain.from_iterable(tile_results))
+
+    if merge_seams:
+        offset_polygons = _merge_seam_polygons(offset_polygons, xedges, yedges,
+                                               precision = precision)
     return offset_polygons
 
 
@@ -715,58 +1059,149 @@ def _boolean_region(all_polygons_A, all_polygons_B,
                     left, bottom, right, top,
                 operation = 'and',
                 precision = 1e-4,
+                candidates_A = None,
+                candidates_B = None,
                 ):
     """ Taking a region of e.g. size (x,y) which needs to be booleaned,
     this function crops out a region (x, y) large from each set of polygons
     (A and B), booleans that cropped region and returns the result"""
         
-    polygons_to_boolean_A = _crop_edge_polygons(all_polygons_A, bboxes_A, left, bottom, right, top, precision)
-    polygons_to_boolean_B = _crop_edge_polygons(all_polygons_B, bboxes_B, left, bottom, right, top, precision)
+    polygons_to_boolean_A = _crop_edge_polygons(all_polygons_A, bboxes_A, left, bottom, right, top,
+                                                precision, candidates = candidates_A)
+    polygons_to_boolean_B = _crop_edge_polygons(all_polygons_B, bboxes_B, left, bottom, right, top,
+                                                precision, candidates = candidates_B)
     polygons_boolean = clipper.clip(polygons_to_boolean_A, polygons_to_boolean_B,
                                          operation, 1/precision)
     return polygons_boolean
 
 
 
+def _boolean_region_task(context, task):
+    """ Worker function for _boolean_polygons_parallel(), booleans a single
+    tile using the polygons and bounding boxes stored in ``context`` """
+    (left, bottom, right, top), candidates_A, candidates_B = task
+    return _boolean_region(context['polygons_A'], context['polygons_B'],
+                           context['bboxes_A'], context['bboxes_B'],
+                           left, bottom, right, top,
+                           operation = context['operation'],
+                           precision = context['precision'],
+                           candidates_A = candidates_A,
+                           candidates_B = candidates_B,
+                           )
+
+
 def _boolean_polygons_parallel(
         polygons_A, polygons_B,
         num_divisions = [10,10],
         operation = 'and',
         precision = 1e-4,
+        num_workers = 1,
+        merge_seams = True,
         ):
     
     #    Build bounding boxes
-    polygons_A = np.asarray(polygons_A)
-    polygons_B = np.asarray(polygons_B)
-    bboxes_A = _polygons_to_bboxes(polygons_A)
-    bboxes_B = _polygons_to_bboxes(polygons_B)
+    polygons_A = _polygons_to_ragged(polygons_A)
+    polygons_B = _polygons_to_ragged(polygons_B)
+    bboxes_A = _ragged_to_bboxes(*polygons_A)
+    bboxes_B = _ragged_to_bboxes(*polygons_B)
     
     xmin,ymin = np.min([np.min(bboxes_A[:,0:2], axis = 0), np.min(bboxes_B[:,0:2], axis = 0)], axis = 0)
     xmax,ymax = np.max([np.max(bboxes_A[:,2:4], axis = 0), np.max(bboxes_B[:,2:4], axis = 0)], axis = 0)
     
-    xsize = xmax - xmin
-    ysize = ymax - ymin
-    xdelta = xsize/num_divisions[0]
-    ydelta = ysize/num_divisions[1]
-    xcorners = xmin + np.arange(num_divisions[0])*xdelta
-    ycorners = ymin + np.arange(num_divisions[1])*ydelta
-    
-    boolean_polygons = []
-    for n,xc in enumerate(xcorners):
-        for m,yc in enumerate(ycorners):
-            left = xc
-            right = xc+xdelta
-            bottom = yc
-            top = yc+ydelta
-            _boolean_region_polygons = _boolean_region(polygons_A, polygons_B, bboxes_A, bboxes_B,
-                                            left, bottom, right, top,
-                                            operation = operation,
-                                            precision = precision,
-                                            )
-            boolean_polygons += _boolean_region_polygons
-        
+    xedges, yedges, tiles = _tile_rectangles(xmin, ymin, xmax, ymax, num_divisions)
+    tile_candidates_A = _bboxes_to_tiles(bboxes_A, xedges, yedges)
+    tile_candidates_B = _bboxes_to_tiles(bboxes_B, xedges, yedges)
+
+    context = dict(
+        polygons_A = polygons_A,
+        polygons_B = polygons_B,
+        bboxes_A = bboxes_A,
+        bboxes_B = bboxes_B,
+        operation = operation,
+        precision = precision,
+        )
+    tasks = zip(tiles, tile_candidates_A, tile_candidates_B)
+    tile_results = _parallel_map(_boolean_region_task, tasks, context,
+                                 num_workers = num_workers)
+    boolean_polygons = list(itertools.chain.from_iterable(tile_results))
+
+    if merge_seams:
+        boolean_polygons = _merge_seam_polygons(boolean_polygons, xedges, yedges,
+                                                precision = precision)
     return boolean_polygons
 
+
+def _tile_rectangles(xmin, ymin, xmax, ymax, num_divisions):
+    """ Splits the rectangle xmin/ymin/xmax/ymax into a num_divisions[0] by
+    num_divisions[1] grid.  Returns the x and y tile edges along with a list of
+    tiles as (left, bottom, right, top) tuples, ordered column by column """
+    xedges = np.linspace(xmin, xmax, num_divisions[0] + 1)
+    yedges = np.linspace(ymin, ymax, num_divisions[1] + 1)
+    tiles = [(xedges[n], yedges[m], xedges[n+1], yedges[m+1])
+             for n in range(num_divisions[0]) for m in range(num_divisions[1])]
+    return xedges, yedges, tiles
+
+
+def _merge_seam_polygons(polygons, xedges, yedges, precision = 1e-4):
+    """ Polygons which were produced tile-by-tile are split wherever they
+    crossed a tile boundary.  This finds the polygons touching the interior
+    tile edges ``xedges`` and ``yedges`` and unions them back together """
+    if len(polygons) == 0:
+        return polygons
+    bboxes = _polygons_to_bboxes(polygons)
+    tol = precision*2
+    on_seam = np.zeros(len(polygons), dtype = bool)
+    for x in xedges[1:-1]:
+        on_seam |= (np.abs(bboxes[:,0] - x) < tol) | (np.abs(bboxes[:,2] - x) < tol)
+    for y in yedges[1:-1]:
+        on_seam |= (np.abs(bboxes[:,1] - y) < tol) | (np.abs(bboxes[:,3] - y) < tol)
+    if not np.any(on_seam):
+        return polygons
+
+    seam_polygons = [polygons[i] for i in np.nonzero(on_seam)[0]]
+    other_polygons = [polygons[i] for i in np.nonzero(~on_seam)[0]]
+    merged_polygons = clipper.clip(seam_polygons, [], 'or', 1/precision)
+    return other_polygons + list(merged_polygons)
+
+
+# Pool workers read their (large, read-only) inputs from here rather than
+# having them pickled and sent along with every task
+_worker_context = {}
+
+def _init_worker_context(context):
+    _worker_context.clear()
+    _worker_context.update(context)
+
+def _call_with_worker_context(args):
+    fun, task = args
+    return fun(_worker_context, task)
+
+def _parallel_map(fun, tasks, context, num_workers = 1):
+    """ Evaluates ``fun(context, task)`` for every task in ``tasks`` and returns
+    the results in order.  When ``num_workers`` > 1 (or is None, which uses all
+    cores) the tasks are distributed across a pool of processes.  ``context``
+    is sent to each worker once when the pool starts, and tasks are handed out
+    in chunks so that each worker receives several neighboring tasks at a
+    time.  ``fun`` must be a module-level function so it can be pickled """
+    tasks = list(tasks)
+    if num_workers is None:
+        num_workers = multiprocessing.cpu_count()
+    num_workers = int(min(num_workers, len(tasks)))
+    if num_workers <= 1:
+        return [fun(context, t) for t in tasks]
+
+    chunksize = int(np.ceil(len(tasks)/(4*num_workers)))
+    pool = multiprocessing.Pool(processes = num_workers,
+                                initializer = _init_worker_context,
+                                initargs = (context,))
+    try:
+        results = pool.map(_call_with_worker_context, [(fun, t) for t in tasks],
+                           chunksize = chunksize)
+    finally:
+        pool.close()
+        pool.join()
+    return results
+
 #==============================================================================
 #
 # Lithography test structures
@@ -871,6 +1306,11 @@ def copy(D):
     D_copy = Device(name = D._internal_name)
     D_copy.info = python_copy.deepcopy(D.info)
     for ref in D.references:
+        if isinstance(ref, ReferenceTable):
+            new_table = python_copy.copy(ref)
+            new_table.owner = D_copy
+            D_copy.add(new_table)
+            continue
         new_ref = DeviceReference(device = ref.parent,
                                 origin = ref.origin,
                                 rotation = ref.rotation,
@@ -896,7 +1336,9 @@ def deepcopy(D):
     D_copy._internal_name = D._internal_name
     D_copy.name = '%s%06d' % (D_copy._internal_name[:20], D_copy.uid) # Write name e.g. 'Unnamed000005'
     # Make sure _bb_valid is set to false for these new objects so new
-    # bounding boxes are created in the cache
+    # bounding boxes are created in the cache.  Copies of frozen Devices
+    # can be modified
+    D_copy._unfreeze()
     for D in D_copy.get_dependencies(True):
         D._bb_valid = False
     D_copy._bb_valid = False
@@ -910,9 +1352,34 @@ def copy_layer(D, layer = 1, new_layer = 2):
     return D_copied_layer
 
 
-def import_gds(filename, cellname = None, flatten = False):
+def import_gds(filename, cellname = None, flatten = False, layers = None,
+               lazy = False, num_workers = 1):
+    """ Imports a GDS file as a Device.  Compressed files (.gds.gz or
+    .gds.zst) are decompressed transparently.  If ``layers`` is specified,
+    only the polygons and labels on those layers are imported.
+
+    If ``lazy`` is True the file is memory-mapped and only the cells in the
+    hierarchy of ``cellname`` (or of the top-level cell) are parsed,
+    skipping the elements on layers not in ``layers`` without decoding them.
+    This is much faster when only a small part of a large file is needed.  Compressed files can't be
+    memory-mapped, so for them ``lazy`` is ignored.
+
+    ``num_workers`` > 1 (or None to use all cores) decodes the cells in
+    parallel in a pool of processes; this implies ``lazy`` = True.  For
+    compressed files, which are always decoded in a single pass through
+    gdspy, ``num_workers`` is ignored """
+    if (lazy == True or num_workers != 1) and gds_compression(filename) is None:
+        return _import_gds_lazy(filename, cellname, flatten, layers, num_workers)
+    D = _import_gds(filename, cellname, flatten)
+    if layers is not None:
+        D.remove_layers(layers = layers, include_labels = True, invert_selection = True)
+    return D
+
+
+def _import_gds(filename, cellname = None, flatten = False):
     gdsii_lib = gdspy.GdsLibrary()
-    gdsii_lib.read_gds(filename)
+    with open_gds(filename) as infile:
+        gdsii_lib.read_gds(infile)
     top_level_cells = gdsii_lib.top_level()
     if cellname is not None:
         if cellname not in gdsii_lib.cells:
@@ -966,11 +1433,10 @@ def import_gds(filename, cellname = None, flatten = False):
                     dr.owner = D
                     converted_references.append(dr)
             D.references = converted_references
-            # Next convert each Polygon
+            # Next convert each Polygon, reusing the arrays read by gdspy
             temp_polygons = list(D.polygons)
             D.polygons = []
-            for p in temp_polygons:
-                D.add_polygon(p)
+            D._adopt_polygonsets(temp_polygons)
 
         topdevice = c2dmap[topcell]
         return topdevice
@@ -984,6 +1450,146 @@ def import_gds(filename, cellname = None, flatten = False):
         return D
 
 
+def _read_gds_cell_task(context, name):
+    return context['reader'].read_cell(name, layers = context['layers'])
+
+
+def _import_gds_lazy(filename, cellname = None, flatten = False, layers = None,
+                     num_workers = 1):
+    if layers is not None:
+        layers = set(_parse_layer(l) for l in layers)
+    with GdsReader(filename) as reader:
+        if cellname is None:
+            top_level_cells = reader.top_level()
+            if len(top_level_cells) > 1:
+                raise ValueError('[PHIDL] import_gds() There are multiple top-level cells, \
+                            you must specify `cellname` to select of one of them')
+            cellname = top_level_cells[0]
+        elif cellname not in reader.cell_names:
+            raise ValueError('[PHIDL] import_gds() The requested cell (named %s) \
+                        is not present in file %s' % (cellname,filename))
+        # Parse only the cells in the hierarchy of the top cell, which the
+        # reader knows from its index
+        names = [cellname] + sorted(reader.get_dependencies(cellname))
+        # Cells are decoded independently, possibly in worker processes
+        context = {'reader':reader, 'layers':layers}
+        cell_data = _parallel_map(_read_gds_cell_task, names, context,
+                                  num_workers = num_workers)
+        cell_data = {data.name:data for data in cell_data}
+
+    # Build the Device/DeviceReference graph
+    c2dmap = {name:Device(name = name) for name in cell_data}
+    for name, data in cell_data.items():
+        D = c2dmap[name]
+        for layer, polygons in data.polygons.items():
+            D._add_polygons(polygons, layer = layer)
+        for path in data.paths:
+            D.add_polygon(path.to_polygonset())
+        for l in data.labels:
+            D.add(Label(**l))
+        for r in data.references:
+            kwargs = dict(r)
+            kwargs['device'] = c2dmap[kwargs.pop('ref_cell')]
+            if 'columns' in kwargs:
+                dr = CellArray(**kwargs)
+            else:
+                dr = DeviceReference(**kwargs)
+            dr.owner = D
+            D.add(dr)
+    topdevice = c2dmap[cellname]
+
+    if flatten == True:
+        D = Device('import_gds')
+        polygons = topdevice.get_polygons(by_spec = True)
+        for layer_in_gds, polys in polygons.items():
+            D.add_polygon(polys, layer = layer_in_gds)
+        return D
+    return topdevice
+
+
+def import_oas(filename, cellname = None, flatten = False, port_layer = None):
+    """ Imports an OASIS file as a Device (requires gdstk).  References with
+    a rectangular repetition become CellArrays, other repetitions are
+    expanded into individual references.  If ``port_layer`` is specified,
+    labels on that layer (e.g. from Device.write_oas(port_layer = ...)) are
+    converted back into Ports """
+    oas_lib = read_oas(filename)
+    oas_cells = {c.name:c for c in oas_lib.cells}
+    top_level_cells = oas_lib.top_level()
+    if cellname is not None:
+        if cellname not in oas_cells:
+            raise ValueError('[PHIDL] import_oas() The requested cell (named %s) \
+                        is not present in file %s' % (cellname,filename))
+        topcell = oas_cells[cellname]
+    elif cellname is None and len(top_level_cells) == 1:
+        topcell = top_level_cells[0]
+    elif cellname is None and len(top_level_cells) > 1:
+        raise ValueError('[PHIDL] import_oas() There are multiple top-level cells, \
+                        you must specify `cellname` to select of one of them')
+    if port_layer is not None:
+        port_layer = _parse_layer(port_layer)
+
+    if flatten == False:
+        c2dmap = {name:Device(name = name) for name in oas_cells}
+        for name, cell in oas_cells.items():
+            D = c2dmap[name]
+            _add_oas_elements(D, cell.get_polygons(depth = 0),
+                              cell.get_labels(depth = 0), port_layer)
+            for r in cell.references:
+                ref_name = r.cell if isinstance(r.cell, str) else r.cell.name
+                ref_device = c2dmap[ref_name]
+                rotation = np.rad2deg(r.rotation)
+                magnification = None if r.magnification == 1 else r.magnification
+                x_reflection = bool(r.x_reflection)
+                repetition = r.repetition
+                if repetition is None or repetition.size <= 1:
+                    dr = DeviceReference(device = ref_device, origin = r.origin,
+                            rotation = rotation, magnification = magnification,
+                            x_reflection = x_reflection)
+                    dr.owner = D
+                    D.add(dr)
+                    continue
+                array = _array_spacing(repetition, rotation, x_reflection)
+                if array is not None:
+                    columns, rows, spacing = array
+                    dr = CellArray(device = ref_device, columns = columns,
+                            rows = rows, spacing = spacing, origin = r.origin,
+                            rotation = rotation, magnification = magnification,
+                            x_reflection = x_reflection)
+                    dr.owner = D
+                    D.add(dr)
+                else:
+                    origins = np.array(r.origin) + repetition.get_offsets()
+                    D.add_refs(ref_device, origins = origins, rotations = rotation,
+                               x_reflections = x_reflection,
+                               magnifications = magnification)
+        return c2dmap[topcell.name]
+
+    elif flatten == True:
+        D = Device('import_oas')
+        _add_oas_elements(D, topcell.get_polygons(), topcell.get_labels(), port_layer)
+        return D
+
+
+def _add_oas_elements(D, polygons, labels, port_layer = None):
+    """ Adds gdstk Polygons and Labels to the Device ``D``, converting the
+    labels on ``port_layer`` into Ports """
+    polygons_by_layer = OrderedDict()
+    for p in polygons:
+        polygons_by_layer.setdefault((p.layer, p.datatype), []).append(p.points)
+    for layer, points in polygons_by_layer.items():
+        D.add_polygon(points, layer = layer)
+    for l in labels:
+        if (l.layer, l.texttype) == port_layer:
+            the_port = _convert_geometry_to_port(Label(text = l.text, position = l.origin))
+            D.add_port(name = the_port.name, port = the_port)
+        else:
+            D.add_label(text = l.text, position = l.origin,
+                        magnification = None if l.magnification == 1 else l.magnification,
+                        rotation = np.rad2deg(l.rotation) if l.rotation else None,
+                        anchor = l.anchor, layer = (l.layer, l.texttype))
+
+
 def _translate_cell(c):
     D = Device(name = c.name)
     for e in c.elements:
@@ -1025,32 +1631,265 @@ def preview_layerset(ls, size = 100, spacing = 100):
         D.add_ref(T).movex((100+spacing) * xloc *scale).movey(-(100+spacing) * yloc*scale)
     return D
 
+DeviceCacheInfo = namedtuple('DeviceCacheInfo',
+                             ['hits', 'misses', 'disk_hits', 'maxsize', 'currsize'])
+
+
 class device_lru_cache:
-    def __init__(self, fn):
-        self.maxsize = 32
+    """ Decorator which caches the Devices returned by a function, keyed by
+    the function's arguments, and returns copies of them when the function is
+    called again with the same arguments.  Can be used as
+    ``@device_lru_cache`` or configured as e.g.
+    ``@device_lru_cache(maxsize = 128, copy = False)``, where ``maxsize`` is
+    the number of Devices kept in memory (None for no limit).
+
+    With ``copy = False`` the cached Device itself is returned on every call,
+    without copying it.  It is frozen (any method which would modify it
+    raises an error) and is meant to be placed with add_ref(), so all the
+    references to it share the same geometry.  Use geometry.deepcopy() to
+    get a copy which can be modified.  Hit and miss counts are available
+    through cache_info().
+
+    Besides the in-memory cache, Devices can be stored on disk so they are
+    shared between processes and runs: set ``device_lru_cache.cache_dir``
+    (or the environment variable PHIDL_CACHE_DIR) to a directory.  Entries
+    are keyed by the function's module, name and bytecode, its arguments
+    and the PHIDL version, and the oldest entries are removed once the
+    directory grows beyond ``device_lru_cache.cache_max_bytes``.  The
+    bytecode key covers the function's code, constants, referenced names and
+    default arguments, but changes to the functions it calls are not
+    detected: clear the cache directory after modifying them """
+    cache_dir = os.environ.get('PHIDL_CACHE_DIR', None)
+    cache_max_bytes = 2**30
+
+    def __new__(cls, fn = None, maxsize = 32, copy = True):
+        # Called with only the configuration, e.g. @device_lru_cache(128)
+        # or @device_lru_cache(maxsize = 128), return the actual decorator
+        if (fn is not None) and not callable(fn):
+            fn, maxsize = None, fn
+        if fn is None:
+            return lambda fn: cls(fn, maxsize = maxsize, copy = copy)
+        return super(device_lru_cache, cls).__new__(cls)
+
+    def __init__(self, fn, maxsize = 32, copy = True):
+        if (maxsize is not None) and (maxsize < 0):
+            raise ValueError('[PHIDL] device_lru_cache: maxsize must be None or >= 0, got %s' % maxsize)
+        self.maxsize = maxsize
+        self.copy = copy
         self.fn = fn
         self.memo = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
         update_wrapper(self, fn)
 
     def __call__(self, *args, **kwargs):
+        if self.maxsize == 0:
+            # Caching disabled
+            self.misses += 1
+            D = self.fn(*args, **kwargs)
+            if not isinstance(D, Device):
+                raise ValueError('[PHIDL] @device_lru_cache can only be used on functions which return a Device')
+            return D
         pickle_str = pickle.dumps(args, 1) + pickle.dumps(kwargs, 1)
         if pickle_str not in self.memo.keys():
-            new_cache_item = self.fn(*args, **kwargs)
-            if not isinstance(new_cache_item, Device):
-                raise ValueError('[PHIDL] @device_lru_cache can only be used on functions which return a Device')
-            if len(self.memo) > self.maxsize:
-                self.memo.popitem(last = False) # Remove oldest item from cache
+            self.misses += 1
+            new_cache_item = self._read_disk_cache(pickle_str)
+            if new_cache_item is None:
+                new_cache_item = self.fn(*args, **kwargs)
+                if not isinstance(new_cache_item, Device):
+                    raise ValueError('[PHIDL] @device_lru_cache can only be used on functions which return a Device')
+                self._write_disk_cache(pickle_str, new_cache_item)
+                if self.copy == False:
+                    # The returned Device may reference Devices of the
+                    # caller, which must not be frozen
+                    new_cache_item = _cache_owned_copy(new_cache_item)
+            else:
+                self.disk_hits += 1
+            if self.maxsize is not None:
+                while len(self.memo) >= self.maxsize:
+                    self.memo.popitem(last = False) # Remove oldest item from cache
+            if self.copy == False:
+                # Share the (frozen) Device itself with every caller
+                self.memo[pickle_str] = new_cache_item._freeze()
+                return new_cache_item
             # Add a deepcopy of new item to cache so that if we change the
             # returned device, our stored cache item is not changed
             self.memo[pickle_str] = python_copy.deepcopy(new_cache_item)
             return new_cache_item
         else: # if found in cache
-            # Pop cache item out and put it back on the top of the cache
-            cached_output = self.memo.pop(pickle_str)
-            self.memo[pickle_str] = cached_output
+            self.hits += 1
+            # Move the cache item to the top of the cache
+            self.memo.move_to_end(pickle_str)
+            cached_output = self.memo[pickle_str]
+            if self.copy == False:
+                return cached_output
             # Then return a copy of the cached Device
             return deepcopy(cached_output)
 
+    def cache_info(self):
+        """ Returns the number of hits, misses (of which disk_hits were found
+        in the disk cache), maxsize and current size of the cache """
+        return DeviceCacheInfo(self.hits, self.misses, self.disk_hits,
+                               self.maxsize, len(self.memo))
+
+    def cache_clear(self):
+        """ Empties the in-memory cache and resets its statistics """
+        self.memo.clear()
+        self.hits = self.misses = self.disk_hits = 0
+
+    def _disk_cache_filename(self, pickle_str):
+        fn = getattr(self.fn, '__wrapped__', self.fn)
+        key = hashlib.sha1()
+        key.update(str(fn.__module__).encode())
+        key.update(getattr(fn, '__qualname__', fn.__name__).encode())
+        code = getattr(fn, '__code__', None)
+        if code is not None:
+            _update_code_hash(key, code)
+        key.update(repr(getattr(fn, '__defaults__', None)).encode())
+        key.update(repr(getattr(fn, '__kwdefaults__', None)).encode())
+        key.update(_phidl_version.encode())
+        key.update(pickle_str)
+        return os.path.join(self.cache_dir, key.hexdigest() + '.pkl')
+
+    def _read_disk_cache(self, pickle_str):
+        if self.cache_dir is None:
+            return None
+        filename = self._disk_cache_filename(pickle_str)
+        try:
+            with open(filename, 'rb') as f:
+                D = pickle.load(f)
+            os.utime(filename) # Mark as recently used
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # Corrupted or incompatible entry, regenerate it
+            _remove_file(filename)
+            return None
+        if not isinstance(D, Device):
+            return None
+        _reset_loaded_device(D)
+        return D
+
+    def _write_disk_cache(self, pickle_str, D):
+        if self.cache_dir is None:
+            return
+        filename = self._disk_cache_filename(pickle_str)
+        try:
+            os.makedirs(self.cache_dir, exist_ok = True)
+            data = pickle.dumps(D, pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            return  # e.g. unpicklable items in Device.info
+        # Write to a temporary file and move it into place so that other
+        # processes never read a partially-written entry
+        fd, temp_filename = tempfile.mkstemp(dir = self.cache_dir, suffix = '.tmp')
+        try:
+            replaced_size = os.path.getsize(filename)
+        except OSError:
+            replaced_size = 0
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_filename, filename)
+        except Exception:
+            _remove_file(temp_filename)
+            return
+        _track_disk_cache(self.cache_dir, self.cache_max_bytes,
+                          len(data) - replaced_size)
+
+
+def _update_code_hash(key, code):
+    """ Feeds the bytecode, constants and referenced names of the code object
+    ``code`` (and of the code objects nested in it, e.g. inner functions) to
+    the hash ``key`` """
+    key.update(code.co_code)
+    key.update(repr(code.co_names).encode())
+    for const in code.co_consts:
+        if hasattr(const, 'co_code'):
+            _update_code_hash(key, const)
+        else:
+            key.update(repr(const).encode())
+
+
+def _remove_file(filename):
+    try:
+        os.remove(filename)
+    except OSError:
+        pass
+
+
+# Estimated total size of the entries of each disk cache directory, so that
+# the directory is only scanned on the first store of this process and when
+# the estimate goes over the limit (entries stored by other processes are
+# only accounted for at those scans)
+_disk_cache_sizes = {}
+
+
+def _track_disk_cache(cache_dir, max_bytes, added_bytes):
+    """ Adds ``added_bytes`` to the estimated size of the disk cache
+    directory, and evicts its oldest entries once it is over ``max_bytes`` """
+    key = os.path.abspath(cache_dir)
+    total_size = _disk_cache_sizes.get(key)
+    if total_size is not None:
+        total_size += added_bytes
+    if (total_size is None) or (total_size > max_bytes):
+        total_size = _evict_disk_cache(cache_dir, max_bytes)
+    _disk_cache_sizes[key] = total_size
+
+
+def _evict_disk_cache(cache_dir, max_bytes):
+    """ Removes the least recently used entries of a disk cache directory
+    until its size is below ``max_bytes``, and returns its size """
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if not entry.name.endswith('.pkl'): continue
+        try:
+            stat = entry.stat()
+        except OSError:
+            continue  # Removed by another process
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total_size = sum(e[1] for e in entries)
+    for mtime, size, path in sorted(entries):
+        if total_size <= max_bytes: break
+        _remove_file(path)
+        total_size -= size
+    return total_size
+
+
+def _reset_loaded_device(D):
+    """ Gives a Device hierarchy loaded from another process new uids and
+    names, and clears the caches of its references """
+    for E in [D] + list(D.get_dependencies(True)):
+        _renew_device(E)
+
+
+def _renew_device(E):
+    """ Gives the copied Device ``E`` and its Ports new uids and a new name,
+    and clears the caches of its references """
+    E.uid = Device._next_uid
+    Device._next_uid += 1
+    E.name = '%s%06d' % (E._internal_name[:20], E.uid)
+    for port in E.ports.values():
+        port.uid = Port._next_uid
+        Port._next_uid += 1
+    for ref in E.references:
+        ref.__dict__.pop('_ports_cache_key', None)
+        ref.__dict__.pop('_bb_cache', None)
+    E._bb_valid = False
+
+
+def _cache_owned_copy(D):
+    """ Returns a copy of the Device hierarchy ``D`` which can be frozen by a
+    device_lru_cache without freezing the Devices of the caller.  Devices
+    which are already frozen (e.g. returned by another cache with
+    copy = False) are shared rather than copied """
+    memo = {id(E): E for E in D.get_dependencies(True) if E._frozen}
+    D_copy = python_copy.deepcopy(D, memo)
+    for E in [D_copy] + list(D_copy.get_dependencies(True)):
+        if not E._frozen:
+            _renew_device(E)
+    return D_copy
+
 
 def _convert_port_to_geometry(port, layer = 0):
     ''' Converts a Port to a label and a triangle Device that are then added to the parent.
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+from __future__ import division, print_function, absolute_import
+import json
+import numpy as np
+
+import gdspy
+from phidl.gdsii import _cells_in_dependency_order
+
+try:
+    import gdstk
+    gdstk_imported = True
+except:
+    gdstk_imported = False
+
+
+#==============================================================================
+#
+# OASIS reader / writer (via gdstk)
+#
+#==============================================================================
+
+# gdspy stores Label anchors as integers, gdstk as strings
+_GDSPY_TO_GDSTK_ANCHOR = {0:'nw', 1:'n', 2:'ne', 4:'w', 5:'o', 6:'e',
+                          8:'sw', 9:'s', 10:'se'}
+
+
+def _check_gdstk():
+    if gdstk_imported == False:
+        raise ImportError('PHIDL tried to import gdstk but it failed. Install '
+                          'it (pip install gdstk) to read and write OASIS files')
+
+
+def _array_repetition(ref):
+    """ Returns the gdstk Repetition equivalent to a CellArray.  The spacing of
+    a CellArray is applied before the rotation and reflection of the array,
+    whereas the vectors of a Repetition are in the coordinates of the
+    parent cell """
+    v1 = np.array([ref.spacing[0], 0.0])
+    v2 = np.array([0.0, ref.spacing[1]])
+    if ref.x_reflection:
+        v2 = -v2
+    if ref.rotation:
+        angle = np.deg2rad(ref.rotation)
+        ca, sa = np.cos(angle), np.sin(angle)
+        v1 = np.array([v1[0]*ca - v1[1]*sa, v1[0]*sa + v1[1]*ca])
+        v2 = np.array([v2[0]*ca - v2[1]*sa, v2[0]*sa + v2[1]*ca])
+    return gdstk.Repetition(columns = ref.columns, rows = ref.rows,
+                            v1 = tuple(v1), v2 = tuple(v2))
+
+
+def _array_spacing(repetition, rotation = 0, x_reflection = False):
+    """ Inverse of _array_repetition(): returns (columns, rows, spacing) for a
+    CellArray equivalent to the gdstk ``repetition`` of a reference with the
+    given ``rotation`` (in degrees) and ``x_reflection``, or None if the
+    repetition can't be represented as a CellArray """
+    if repetition is None or repetition.columns is None or repetition.rows is None:
+        return None
+    if repetition.spacing is not None:
+        v1 = np.array([repetition.spacing[0], 0.0])
+        v2 = np.array([0.0, repetition.spacing[1]])
+    else:
+        v1 = np.array(repetition.v1, dtype = np.float64)
+        v2 = np.array(repetition.v2, dtype = np.float64)
+    angle = np.deg2rad(rotation or 0)
+    ca, sa = np.cos(angle), np.sin(angle)
+    u1 = np.array([v1[0]*ca + v1[1]*sa, -v1[0]*sa + v1[1]*ca])
+    u2 = np.array([v2[0]*ca + v2[1]*sa, -v2[0]*sa + v2[1]*ca])
+    if x_reflection:
+        u1[1], u2[1] = -u1[1], -u2[1]
+    scale = max(np.abs(u1).max(), np.abs(u2).max(), 1)
+    if abs(u1[1]) > 1e-9*scale or abs(u2[0]) > 1e-9*scale:
+        return None
+    return repetition.columns, repetition.rows, (u1[0], u2[1])
+
+
+def _table_references(table, ref_cell):
+    """ Returns the gdstk References equivalent to a ReferenceTable: one per
+    distinct (rotation, reflection, magnification), with an explicit
+    repetition holding the offsets of the other references of the group """
+    origins = np.asarray(table.origins, dtype = np.float64)
+    magnifications = np.asarray(table.magnifications, dtype = np.float64)
+    keys = np.column_stack([table.rotations, table.x_reflections,
+                            np.nan_to_num(magnifications, nan = 1)])
+    transforms, inverse = np.unique(keys, axis = 0, return_inverse = True)
+    inverse = inverse.reshape(-1)
+    references = []
+    for n, (rotation, x_reflection, magnification) in enumerate(transforms):
+        rows = np.nonzero(inverse == n)[0]
+        r = gdstk.Reference(ref_cell, tuple(origins[rows[0]]),
+                            rotation = np.deg2rad(rotation),
+                            magnification = magnification,
+                            x_reflection = bool(x_reflection))
+        if len(rows) > 1:
+            r.repetition = gdstk.Repetition(offsets = origins[rows[1:]] - origins[rows[0]])
+        references.append(r)
+    return references
+
+
+def _port_label(port, layer, texttype):
+    """ Label recording a Port, with the same text and placement as the
+    labels created by geometry.ports_to_geometry() """
+    text = json.dumps((str(port.name), float(np.round(port.width, decimals = 3)),
+                       float(port.orientation)))
+    angle = np.deg2rad(port.orientation)
+    position = np.array(port.midpoint) - np.array((np.cos(angle), np.sin(angle)))*port.width*0.05
+    return gdstk.Label(text, tuple(position),
+                       rotation = np.deg2rad((90 + port.orientation) % 360),
+                       magnification = 0.04*port.width, layer = layer,
+                       texttype = texttype)
+
+
+def write_oas(outfile, cells, names = None, libname = 'library', unit = 1e-6,
+              precision = 1e-9, compression_level = 6, port_layer = None):
+    """ Writes ``cells`` and all the cells they reference to an OASIS file,
+    using the names given by the dictionary ``names`` (cells not in ``names``
+    are written with their own name).  CellArrays are written as a single
+    reference with a repetition, and the references of a ReferenceTable as
+    one reference (with an explicit repetition) per transformation.  If ``port_layer`` (a (layer, texttype)
+    tuple) is given, the Ports of each Device are written as labels on that
+    layer so they can be recovered by geometry.import_oas() """
+    _check_gdstk()
+    if names is None: names = {}
+    lib = gdstk.Library(libname, unit = unit, precision = precision)
+    oas_cells = {}
+    for cell in _cells_in_dependency_order(cells):
+        c = lib.new_cell(names.get(cell, cell.name))
+        for polygonset in cell.polygons:
+            for points, layer, datatype in zip(polygonset.polygons,
+                    polygonset.layers, polygonset.datatypes):
+                c.add(gdstk.Polygon(points, layer, datatype))
+        for path in cell.paths:
+            polygonset = path.to_polygonset()
+            for points, layer, datatype in zip(polygonset.polygons,
+                    polygonset.layers, polygonset.datatypes):
+                c.add(gdstk.Polygon(points, layer, datatype))
+        for label in cell.labels:
+            c.add(gdstk.Label(label.text, tuple(label.position),
+                              anchor = _GDSPY_TO_GDSTK_ANCHOR[label.anchor],
+                              rotation = np.deg2rad(label.rotation or 0),
+                              magnification = label.magnification or 1,
+                              x_reflection = bool(label.x_reflection),
+                              layer = label.layer, texttype = label.texttype))
+        for ref in cell.references:
+            ref_cell = oas_cells.get(ref.ref_cell, ref.ref_cell)
+            if getattr(ref, 'origins', None) is not None:
+                c.add(*_table_references(ref, ref_cell))
+                continue
+            r = gdstk.Reference(ref_cell, tuple(ref.origin),
+                                rotation = np.deg2rad(ref.rotation or 0),
+                                magnification = ref.magnification or 1,
+                                x_reflection = bool(ref.x_reflection))
+            if isinstance(ref, gdspy.CellArray):
+                r.repetition = _array_repetition(ref)
+            c.add(r)
+        if port_layer is not None:
+            for port in getattr(cell, 'ports', {}).values():
+                c.add(_port_label(port, *port_layer))
+        oas_cells[cell] = c
+    lib.write_oas(outfile, compression_level = compression_level)
+
+
+def read_oas(filename):
+    """ Reads an OASIS file into a gdstk Library """
+    _check_gdstk()
+    return gdstk.read_oas(filename)
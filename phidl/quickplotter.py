@@ -9,6 +9,7 @@ import warnings
 
 import phidl
 from phidl.device_layout import Device, DeviceReference, CellArray, Layer, Polygon, _rotate_points
+from phidl.device_layout import ReferenceTable
 import gdspy
 
 
@@ -81,7 +82,7 @@ def quickplot(items, show_ports = True, show_subports = False,
                     bbox = _update_bbox(bbox, new_bbox)
             if isinstance(item, Device) and show_subports is True:
                 for sd in item.references:
-                    if not isinstance(sd, (gdspy.CellArray)):
+                    if not isinstance(sd, (gdspy.CellArray, ReferenceTable)):
                         for name, port in sd.ports.items():
                             new_bbox = _draw_port(ax, port, arrow_scale = 0.75, color = 'k')
                             bbox = _update_bbox(bbox, new_bbox)
@@ -680,7 +681,7 @@ def quickplot2(item_list, *args, **kwargs):
             # If element is a Device, draw ports and aliases
             if isinstance(element, phidl.device_layout.Device):
                 for ref in element.references:
-                    if not isinstance(ref, gdspy.CellArray):
+                    if not isinstance(ref, (gdspy.CellArray, ReferenceTable)):
                         for name, port in ref.ports.items():
                             viewer.add_port(port, is_subport = True)
                 for name, port in element.ports.items():
@@ -3,7 +3,7 @@
 from setuptools import setup
 
 install_requires=[
-   'gdspy>=1.5',
+   'gdspy>=1.6',
    'numpy',
    'matplotlib',
 ]
@@ -15,6 +15,7 @@ setup(name='phidl',
       author='Adam McCaughan',
       author_email='amccaugh@gmail.com',
       packages=['phidl'],
-      py_modules=['phidl.geometry', 'phidl.routing', 'phidl.utilities'],
+      py_modules=['phidl.geometry', 'phidl.routing', 'phidl.utilities',
+                  'phidl.gdsii', 'phidl.oasis'],
       package_dir = {'phidl': 'phidl'},
      )
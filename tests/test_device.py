@@ -49,6 +49,48 @@ def test_bbox():
     assert(e2.bbox.tolist() == [[30,0], [130,100]])
 
 
+def test_bbox_hierarchy():
+    A = Device()
+    A.add_polygon( [(0,0), (1,0), (1,1), (0,1)], layer = 2)
+    B = Device()
+    b = B.add_ref(A)
+    C = Device()
+    c = C.add_ref(B).movey(10)
+    assert(C.bbox.tolist() == [[0,10], [1,11]])
+    assert(A._bb_valid and B._bb_valid and C._bb_valid)
+    # Changes to a Device invalidate every Device which references it
+    A.add_polygon( [(0,0), (5,0), (5,5), (0,5)], layer = 2)
+    assert(not B._bb_valid and not C._bb_valid)
+    assert(C.bbox.tolist() == [[0,10], [5,15]])
+    b.movex(3)
+    assert(B._bb_valid == False)
+    assert(C._bb_valid == False)
+    assert(C.bbox.tolist() == [[3,10], [8,15]])
+    A.polygons[0].move([-10,0])
+    assert(C.bbox.tolist() == [[-7,10], [8,15]])
+
+
+def test_reference_bbox():
+    def flat_bbox(ref):
+        points = np.concatenate(ref.get_polygons())
+        return np.array([np.min(points, axis = 0), np.max(points, axis = 0)])
+    A = Device()
+    p = A.add_polygon( [(0,0), (4,0), (4,1), (0,1)], layer = 2)
+    D = Device()
+    a = D.add_ref(A).rotate(30)
+    assert(np.allclose(a.bbox, flat_bbox(a)))
+    a.center = (0,0)
+    a.xmin = 5
+    assert(np.allclose(a.bbox, flat_bbox(a)))
+    assert(np.allclose(a.xmin, 5))
+    # Changing the parent Device must update the (cached) reference bbox
+    p.rotate(90, center = (0,0))
+    assert(np.allclose(a.bbox, flat_bbox(a)))
+    a.mirror((0,1))
+    assert(np.allclose(a.bbox, flat_bbox(a)))
+    assert(np.allclose(D.bbox, a.bbox))
+
+
 def test_add_array():
     D = Device()
     E = Device()
@@ -71,6 +113,84 @@ def test_add_array():
     assert(h == 'fd7c2b4adb811342b836d9fca13992eff951630d')
     
     
+def test_add_refs():
+    import pickle
+    import phidl.geometry as pg
+    from phidl import ReferenceTable
+    E = Device()
+    E.add_polygon([[30, 20], [30,  0], [ 0,  0], [ 0, 20]], layer = 7)
+    E.add_port(name = 1, midpoint = (30,10), orientation = 0)
+    origins = [(0,0), (50,10), (100,20), (150,30)]
+    rotations = [0, 30, 60, 90]
+    def make_refs():
+        D = Device()
+        for n in range(4):
+            d = D.add_ref(E)
+            if n % 2 == 1: d.mirror((1,0))
+            d.rotate(rotations[n]).move(origins[n])
+        return D
+    D1 = Device()
+    refs = D1.add_refs(E, origins = origins, rotations = rotations, x_reflections = [False, True, False, True])
+    D2 = make_refs()
+    assert(isinstance(refs, ReferenceTable) and len(refs) == 4 and D1.references == [refs])
+    assert(D1.hash_geometry(precision = 1e-4) == D2.hash_geometry(precision = 1e-4))
+    assert(D1.hash_structure() == D2.hash_structure())
+    assert(np.allclose(D1.bbox, D2.bbox))
+    assert(np.allclose(D1.get_port_table().midpoints, D2.get_port_table().midpoints))
+    assert(np.allclose(refs[3].ports[1].midpoint, D2.references[3].ports[1].midpoint))
+    assert(D1.area() == D2.area())
+    # Transforming the whole table is the same as transforming each reference
+    for D in [D1, D2]:
+        D.rotate(15, center = (5,5)).mirror((1,2), (3,-1)).move((7,8))
+    assert(D1.hash_geometry(precision = 1e-4) == D2.hash_geometry(precision = 1e-4))
+    # Indexing the table gives a DeviceReference which writes to the arrays
+    assert(refs[2] is refs[2] and refs[-1] is refs[3])
+    P = Device().add_port(name = 'p', midpoint = (-10,-20), orientation = 90)
+    refs[2].connect(1, P)
+    assert(np.allclose(refs.origins[2], refs[2].origin))
+    assert(np.allclose(refs[2].ports[1].midpoint, (-10,-20)))
+    assert(np.allclose(D1.get_ports()[2].midpoint, (-10,-20)))
+    # Copies, pickles and flattening
+    for D in [pg.copy(D1), pg.deepcopy(D1), pickle.loads(pickle.dumps(D1))]:
+        assert(D.hash_geometry(precision = 1e-4) == D1.hash_geometry(precision = 1e-4))
+        assert(D.references[0] is not refs)
+    D3 = pg.deepcopy(D1)
+    D3.references[0].movex(5)
+    assert(not np.allclose(D3.bbox, D1.bbox))
+    assert(D1.hash_geometry() == pg.deepcopy(D1).flatten().hash_geometry())
+    D4 = Device()
+    D4.add_refs(E, origins = [(0,0), (40,0), (80,0)], rotations = 45, magnifications = 2)
+    assert(np.all(D4.references[0].rotations == 45) and D4.references[0][1].magnification == 2)
+    assert(np.isclose(D4.area(), 3*4*600))
+    with pytest.raises(ValueError):
+        D4.add_refs(E, origins = [(0,0), (40,0), (80,0)], rotations = [1,2])
+    assert(len(D4.add_refs(E, origins = [])) == 0 and len(D4.references) == 1)
+    D4.remove(D4.references[0])
+    assert(len(D4.references) == 0 and D4.get_bounding_box() is None)
+
+
+def test_add_refs_write(tmp_path):
+    import phidl.geometry as pg
+    from phidl.device_layout import DeviceReference
+    E = Device('E')
+    E.add_polygon([(0,0), (4,0), (4,1)], layer = 3)
+    D1 = Device('D')
+    D1.add_refs(E, origins = np.round(np.random.RandomState(0).rand(50,2)*100, 3),
+                rotations = np.arange(50) % 4 * 90, x_reflections = np.arange(50) % 3 == 0)
+    D1.add_refs(E, origins = [(0,0), (10,10)], rotations = 30, magnifications = [1,2])
+    D2 = Device('D')
+    for table in D1.references:
+        for r in table:
+            D2.add(DeviceReference(E, origin = np.array(r.origin), rotation = r.rotation,
+                magnification = r.magnification, x_reflection = r.x_reflection))
+    h = D2.hash_geometry(precision = 1e-4)
+    assert(D1.hash_geometry(precision = 1e-4) == h)
+    D1.write_gds(str(tmp_path / 'table.gds'))
+    assert(pg.import_gds(str(tmp_path / 'table.gds')).hash_geometry(precision = 1e-4) == h)
+    D1.write_oas(str(tmp_path / 'table.oas'))
+    assert(pg.import_oas(str(tmp_path / 'table.oas')).hash_geometry(precision = 1e-4) == h)
+
+
 # Test polygon manipulation
 def test_move():
     # Test polygon move
@@ -155,6 +275,45 @@ def test_port_reference_manipulate():
     assert(d.ports['test123'].orientation == 37+45)
 
 
+def test_port_reference_cache():
+    from phidl import Port
+    D = Device()
+    D.add_port(name = 'a', midpoint = (5, 0), width = 2, orientation = 0)
+    E = Device()
+    d = E.add_ref(D)
+    p = d.ports['a']
+    assert(d.ports['a'] is p)
+    d.rotate(90)
+    assert(np.allclose(d.ports['a'].midpoint, (0, 5)))
+    assert(d.ports['a'].orientation == 90)
+    D.ports['a'].midpoint = (7, 0)
+    D.ports['a'].width = 3
+    assert(np.allclose(d.ports['a'].midpoint, (0, 7)))
+    assert(d.ports['a'].width == 3)
+    D.add_port(name = 'b', midpoint = (0, 1), orientation = 90)
+    assert(np.allclose(d.ports['b'].midpoint, (-1, 0)))
+    # Modifying the reference's copy of a port is undone on the next access
+    d.ports['b'].midpoint = (100, 100)
+    assert(np.allclose(d.ports['b'].midpoint, (-1, 0)))
+    D.move((1,1))
+    assert(np.allclose(d.ports['b'].midpoint, (-2, 1)))
+    # In-place edits of a midpoint and of the ports dict are picked up
+    D.ports['b'].midpoint[0] = 5
+    assert(np.allclose(d.ports['b'].midpoint, (-2, 5)))
+    D.ports['b'].midpoint += (1, 0)
+    assert(np.allclose(d.ports['b'].midpoint, (-2, 6)))
+    del D.ports['b']
+    assert('b' not in d.ports)
+    D.ports = {'c' : Port(name = 'c', midpoint = (1, 0), parent = D)}
+    assert(list(d.ports) == ['c'] and np.allclose(d.ports['c'].midpoint, (0, 1)))
+    # Updating the ports of one reference does not invalidate the others
+    d2 = E.add_ref(D)
+    version = D._ports_version
+    d2.ports, d.move((1, 0)), d.ports
+    assert(D._ports_version == version)
+    assert(type(d.ports['c'].midpoint + 1) is np.ndarray)
+
+
 def test_port_remove():
     D = Device()
     D.add_port(name = 'test123', midpoint = (5.7, 9.2), orientation = 37)
@@ -204,3 +363,176 @@ def test_remove_layers():
     D.remove_layers(layers = [13,(14,0)])
     h = D.hash_geometry(precision = 1e-4)
     assert(h == 'bb81ec3b3a6be2372a7ffc32f57121a9f1a97b34')
+
+
+def test_get_port_table():
+    A = Device()
+    A.add_port(name = 'a', midpoint = (1,0), width = 2, orientation = 0)
+    B = Device()
+    B.add_port(name = 'b', midpoint = (0,0), width = 1, orientation = 90)
+    B.add_ref(A).rotate(90).move((5,5))
+    B.add_ref(A).reflect((1,0))
+    B.add_array(A, columns = 2, rows = 1, spacing = (10,0))
+    table = B.get_port_table()
+    assert(len(table) == 5)
+    assert(table.names == ['b', 'a', 'a', 'a', 'a'])
+    assert(np.allclose(table.midpoints, [[0,0], [5,6], [1,0], [1,0], [11,0]]))
+    assert(np.allclose(table.orientations, [90, 90, 0, 0, 0]))
+    ports = B.get_ports()
+    assert(ports[1].uid == A.ports['a'].uid)
+    assert(np.allclose(ports[1].midpoint, (5,6)) and ports[1].orientation == 90)
+    assert(len(B.get_ports(depth = 0)) == 1)
+
+
+def test_hash_geometry_hierarchical():
+    import hashlib
+    def make(offset):
+        E = Device()
+        E.add_polygon([(0,0), (3,0), (3,1), (0,1)], layer = 2)
+        E.add_polygon([(0,0), (1,2), (2,0)], layer = (3,1))
+        D = Device()
+        D.add_ref(E).rotate(30).move((offset,1))
+        D.add_array(E, columns = 2, rows = 3, spacing = (5,5))
+        D.add_polygon([(0,0), (1,0), (1,1)], layer = 2)
+        return D, E
+    D1, E1 = make(offset = 4)
+    D2, E2 = make(offset = 4)
+    h = D1.hash_geometry(hierarchical = True)
+    assert(h == D2.hash_geometry(hierarchical = True))
+    assert(D1.hash_geometry() != h)
+    D1.references[0].movex(1)
+    assert(D1.hash_geometry(hierarchical = True) != h)
+    assert(D1.hash_geometry(hierarchical = True) == make(offset = 5)[0].hash_geometry(hierarchical = True))
+    E2.add_polygon([(0,0), (1,0), (1,1)], layer = 4)
+    assert(D2.hash_geometry(hierarchical = True) != h)
+    # In-place edits which don't change any bounding box
+    h = D1.hash_geometry(hierarchical = True)
+    E1.polygons[0].layers[0] = 7
+    assert(D1.hash_geometry(hierarchical = True) != h)
+    # Streaming digest of several Devices
+    hasher = hashlib.sha1()
+    D1.hash_geometry(hasher = hasher)
+    h12 = D2.hash_geometry(hasher = hasher)
+    assert(h12 != D2.hash_geometry())
+
+
+def test_hash_structure():
+    def make():
+        E = Device('E')
+        E.add_polygon([(0,0), (3,0), (3,1), (0,1)], layer = 2)
+        E.add_port(name = 1, midpoint = (0,0.5), width = 1, orientation = 180)
+        D = Device('D')
+        D.add_ref(E).rotate(30).move((4,1))
+        D.add_array(E, columns = 2, rows = 3, spacing = (5,5))
+        D.add_label('hello', position = (1,1))
+        return D, E
+    D1, E1 = make()
+    D2, E2 = make()
+    h = D1.hash_structure()
+    assert(h == D2.hash_structure() and D1.structure_equals(D2))
+    assert(D1.hash_structure() == h)
+    E2.add_port(name = 2, midpoint = (3,0.5), width = 1, orientation = 0)
+    assert(not D1.structure_equals(D2))
+    E1.add_port(name = 2, midpoint = (3,0.5), width = 1, orientation = 0)
+    assert(D1.structure_equals(D2))
+    D2.add_label('world', position = (2,2))
+    assert(not D1.structure_equals(D2))
+    D2.remove(D2.labels[1])
+    assert(D1.structure_equals(D2))
+    # In-place edits of ports and labels must not be hidden by the cache
+    E2.ports[1].orientation = 90
+    assert(not D1.structure_equals(D2))
+    E2.ports[1].orientation = 180
+    assert(D1.structure_equals(D2))
+    E2.ports[1].width = 7
+    assert(not D1.structure_equals(D2))
+    E2.ports[1].width = 1
+    assert(D1.structure_equals(D2))
+    D2.labels[0].text = 'goodbye'
+    assert(not D1.structure_equals(D2))
+    D2.labels[0].text = 'hello'
+    assert(D1.structure_equals(D2))
+    D2.references[1].movex(1)
+    assert(not D1.structure_equals(D2))
+    assert(not D1.structure_equals(E1))
+    D1.remap_layers({2:5})
+    assert(D1.hash_structure() != h)
+    h = D1.hash_structure()
+    E1.polygons[0].layers[0] = 9
+    assert(D1.hash_structure() != h)
+
+
+def test_compact_polygons():
+    import copy
+    import phidl.geometry as pg
+    from phidl import PolygonTable
+    def make():
+        D = Device()
+        for n in range(20):
+            D.add_polygon([(n,0), (n+0.5,0), (n+0.5,1+n), (n,1)], layer = n % 2)
+        D.add_polygon([(0,0), (1,-2), (2,0)], layer = (3,1))
+        return D
+    D1 = make()
+    D2 = make().compact_polygons()
+    assert(len(D2.polygons) == 3 and all(isinstance(p, PolygonTable) for p in D2.polygons))
+    assert(D1.hash_geometry() == D2.hash_geometry())
+    assert(np.allclose(D1.bbox, D2.bbox))
+    table = D2.polygons[0]
+    assert(len(table) == 10 and len(table.points) == 40)
+    p = table[-1]
+    assert(p.layers == [0] and np.allclose(p.polygons[0], D1.polygons[18].polygons[0]))
+    for D in [D1, D2]:
+        D.rotate(30, center = (1,2)).move((5,-3)).mirror((1,1), (4,3))
+        D.polygons[-1].move((1,1))
+    assert(D1.hash_geometry() == D2.hash_geometry())
+    assert(np.allclose(D1.bbox, D2.bbox))
+    D3 = copy.deepcopy(D2)
+    D3.remap_layers({0:5})
+    D3.remove_layers([1])
+    assert(sorted(D3.get_polygons(by_spec = True)) == [(3,1), (5,0)])
+    assert(len(D3.polygons[0]) == 10)
+    assert(D2.hash_geometry() == D1.hash_geometry())
+    # Reading the lists of a table keeps its columns, modifying them doesn't
+    table = D3.polygons[0]
+    columns = table._columns
+    assert(len(table.polygons) == 10 and table.layers == [5]*10 and table._columns is columns)
+    table.polygons[0][0] = (-50, -50)
+    assert(np.allclose(table.points[0], (-50, -50)) and table._columns is columns)
+    table.layers[0] = 7
+    assert(table.gds_layers.tolist() == [7] + [5]*9)
+    assert(sorted(D3.get_polygons(by_spec = True)) == [(3,1), (5,0), (7,0)])
+    assert(len(D3.get_polygons(by_spec = (5,0))) == 9)
+    with pytest.raises(ValueError):
+        copy.deepcopy(D3)._freeze().polygons[0].translate(1, 1)
+    D1.write_gds('temp.gds')
+    h = pg.import_gds('temp.gds').hash_geometry()
+    D2.write_gds('temp.gds')
+    assert(pg.import_gds('temp.gds').hash_geometry() == h)
+
+
+def test_port_copy():
+    import pickle
+    from phidl import Port
+    P = Port(name = 'a', midpoint = (1,2), width = 3, orientation = 90)
+    assert(P.__dict__ == {} and P._info is None)
+    Q = P._copy()
+    assert(Q.midpoint is not P.midpoint and Q.uid != P.uid and Q.info == {})
+    Q.midpoint[0] = 5
+    Q.midpoint += (0,1)
+    assert(np.allclose(Q.midpoint, (5,3)) and np.allclose(P.midpoint, (1,2)))
+    # The ports of references follow in-place edits of the parent's ports
+    D = Device()
+    D.add_port(name = 1, midpoint = (1,2), width = 1, orientation = 0)
+    ref = Device().add_ref(D).move((10,0))
+    assert(np.allclose(ref.ports[1].midpoint, (11,2)))
+    D.ports[1].midpoint[0] = 3
+    assert(np.allclose(ref.ports[1].midpoint, (13,2)))
+    D.ports[1].midpoint += (1,1)
+    assert(np.allclose(ref.ports[1].midpoint, (14,3)))
+    P.info['length'] = [4]
+    R = pickle.loads(pickle.dumps(P._copy(new_uid = False)))
+    assert(R.uid == P.uid and R.info == P.info and R.info is not P.info)
+    assert(np.allclose(R.midpoint, (1,2)) and R.width == 3 and R.orientation == 90)
+    # Custom attributes still work, and are pickled
+    P.my_attribute = 'x'
+    assert(pickle.loads(pickle.dumps(P)).my_attribute == 'x')
@@ -70,6 +70,46 @@ def test_offset():
     h = D.hash_geometry(precision = 1e-4)
     assert(h == 'dea81b4adf9f163577cb4c750342f5f50d4fbb6d')
 
+def test_offset_parallel():
+    A = pg.cross(length = 10, width = 3, layer = 0)
+    B = pg.ellipse(radii = (10,5), angle_resolution = 2.5, layer = 1)
+    D = pg.offset([A,B], distance = 0.5, precision = 1e-6, layer = 2)
+    D1 = pg.offset([A,B], distance = 0.5, precision = 1e-6, layer = 2,
+                   num_divisions = [3,4], num_workers = 1, merge_seams = True)
+    D2 = pg.offset([A,B], distance = 0.5, precision = 1e-6, layer = 2,
+                   num_divisions = [3,4], num_workers = 3, merge_seams = True)
+    assert(len(D1.polygons[0].polygons) == 1)
+    assert(D1.hash_geometry(precision = 1e-4) == D2.hash_geometry(precision = 1e-4))
+    assert(np.allclose(D1.area(), D.area(), rtol = 1e-5))
+    # By default the tiles are left split along their borders
+    D3 = pg.offset([A,B], distance = 0.5, precision = 1e-6, layer = 2,
+                   num_divisions = [3,4], num_workers = 2)
+    assert(len(D3.polygons) > 1)
+    assert(np.allclose(D3.area(), D.area(), rtol = 1e-5))
+
+def test_polygons_to_bboxes():
+    polygons = [np.array([[0,0],[1,0],[1,2]]),
+                np.array([[-3,1],[5,1],[5,7],[-3,7],[0,4]]),
+                np.array([[2.5,2.5],[3,2],[3,3]])]
+    points, offsets = pg._polygons_to_ragged(polygons)
+    assert(points.shape == (11,2))
+    assert(offsets.tolist() == [0,3,8,11])
+    for p1, p2 in zip(polygons, pg._ragged_to_polygons(points, offsets)):
+        assert(np.all(p1 == p2))
+    bboxes = pg._polygons_to_bboxes(polygons)
+    assert(bboxes.tolist() == [[0,0,1,2], [-3,1,5,7], [2.5,2,3,3]])
+
+def test_bboxes_to_tiles():
+    np.random.seed(3)
+    xy = np.random.rand(500,2)*100
+    bboxes = np.hstack([xy, xy + np.random.rand(500,2)*20])
+    xedges, yedges, tiles = pg._tile_rectangles(0, 0, 120, 120, [7,5])
+    tile_candidates = pg._bboxes_to_tiles(bboxes, xedges, yedges, margin = 1.5)
+    assert(len(tile_candidates) == len(tiles))
+    for (left, bottom, right, top), candidates in zip(tiles, tile_candidates):
+        in_rect = pg._find_bboxes_in_rect(bboxes, left-1.5, bottom-1.5, right+1.5, top+1.5)
+        assert(np.all(np.sort(candidates) == np.nonzero(in_rect)[0]))
+
 def test_invert():
     A = pg.cross(length = 10, width = 3, layer = 0)
     B = pg.ellipse(radii = (10,5), angle_resolution = 2.5, layer = 1)
@@ -84,6 +124,70 @@ def test_boolean():
     h = D.hash_geometry(precision = 1e-4)
     assert(h == 'fcf1d0809488be01480027a5914dfb399faf088c')
 
+def test_boolean_parallel():
+    A = pg.cross(length = 10, width = 3, layer = 0)
+    B = pg.ellipse(radii = (10,5), angle_resolution = 2.5, layer = 1)
+    D1 = pg.boolean(A = A, B = B, operation = 'or',  precision = 1e-6,
+                    num_divisions = [3,3], num_workers = 1, layer = 2)
+    D2 = pg.boolean(A = A, B = B, operation = 'or',  precision = 1e-6,
+                    num_divisions = [3,3], num_workers = 2, layer = 2)
+    # Seams between tiles should be stitched back into a single polygon
+    assert(len(D1.polygons[0].polygons) == 1)
+    assert(D1.hash_geometry(precision = 1e-4) == D2.hash_geometry(precision = 1e-4))
+    D = pg.boolean(A = A, B = B, operation = 'or',  precision = 1e-6, layer = 2)
+    assert(np.allclose(D1.area(), D.area()))
+
+def test_boolean_hierarchical():
+    C = pg.circle(radius = 5, layer = 1)
+    D = Device()
+    for n in range(10):
+        D.add_ref(C).move((20*n, 0))
+    D.add_array(C, columns = 3, rows = 2, spacing = (15,15)).movey(40)
+    D.add_polygon([(0,-1),(25,-1),(25,1),(0,1)], layer = 2)
+    B = pg.rectangle(size = (20,20)).move((100,-10))
+    for operation in ['A-B', 'B-A', 'and', 'or', 'xor']:
+        F = pg.boolean(A = D, B = B, operation = operation, hierarchical = False)
+        H = pg.boolean(A = D, B = B, operation = operation, hierarchical = True)
+        assert(np.allclose(F.area(), H.area()))
+    # Circles which don't touch anything else should be kept as references
+    H = pg.boolean(A = D, B = B, operation = 'A-B', hierarchical = True)
+    assert(len(H.references) == 7)
+    assert(len(H.get_dependencies()) == 1)
+    H = pg.offset(D, distance = 1, hierarchical = True)
+    F = pg.offset(D, distance = 1, hierarchical = False)
+    assert(len(H.references) == 9)
+    assert(np.allclose(F.area(), H.area()))
+    H = pg.union(D, by_layer = True, hierarchical = True)
+    F = pg.union(D, by_layer = True, hierarchical = False)
+    assert(np.allclose(F.area(), H.area()))
+
+def test_boolean_hierarchical_paths():
+    import gdspy
+    D = Device()
+    D.add(gdspy.FlexPath([(0,0), (10,0)], 1, layer = 1))
+    D.add_ref(pg.rectangle(size = (1,0.5), layer = 1)).move((20,20))
+    F = pg.union(D, hierarchical = False)
+    H = pg.union(D, hierarchical = True)
+    assert(np.allclose(F.area(), 10.5) and np.allclose(H.area(), 10.5))
+    H = pg.boolean(A = D, B = pg.rectangle(size = (1,1)), operation = 'or',
+                   hierarchical = True)
+    assert(np.allclose(H.area(), 10.5 + 0.5))
+
+def test_union_xor_diff_parallel():
+    D = Device()
+    E = Device()
+    for layer in range(4):
+        D << pg.circle(radius = 5 + layer, layer = layer)
+        D << pg.rectangle(size = (3,20), layer = layer)
+        E << pg.circle(radius = 6 + layer, layer = layer)
+    U1 = pg.union(D, by_layer = True, num_workers = 1)
+    U2 = pg.union(D, by_layer = True, num_workers = 2)
+    assert(U1.hash_geometry(precision = 1e-4) == U2.hash_geometry(precision = 1e-4))
+    assert(len(U1.polygons) == 4)
+    X1 = pg.xor_diff(D, E, num_workers = 1)
+    X2 = pg.xor_diff(D, E, num_workers = 2)
+    assert(X1.hash_geometry(precision = 1e-4) == X2.hash_geometry(precision = 1e-4))
+
 def test_outline():
     A = pg.cross(length = 10, width = 3, layer = 0)
     B = pg.ellipse(radii = (10,5), angle_resolution = 2.5, layer = 1)
@@ -177,6 +281,312 @@ def test_write_and_import_gds():
     h2 = Dimport.hash_geometry(precision = precision)
     assert(h1 == h2)
 
+
+def test_import_gds_polygons():
+    from phidl.device_layout import Polygon
+    D = Device()
+    D.add_ref(pg.rectangle(size=[1.5,2.7], layer = [3,2]))
+    D.add_polygon([[3,4,5], [6.7, 8.9, 10.15]], layer = [7,8])
+    D.write_gds('temp.gds')
+    Dimport = pg.import_gds('temp.gds')
+    for E in [Dimport, Dimport.references[0].parent]:
+        assert(len(E.polygons) == 1)
+        p = E.polygons[0]
+        assert(isinstance(p, Polygon) and p.parent is E)
+    assert(Dimport.polygons[0].layers == [7] and Dimport.polygons[0].datatypes == [8])
+    assert(np.allclose(Dimport.polygons[0].polygons[0], [[3,6.7], [4,8.9], [5,10.15]]))
+
+
+def test_import_gds_lazy():
+    D = Device()
+    D.add_ref(pg.rectangle(size=[1.5,2.7], layer = [3,2])).rotate(30).mirror()
+    D.add_array(pg.rectangle(size=[1,2], layer = [4,66]), rows = 3,
+                      columns = 2, spacing = [14,7.5]).rotate(90)
+    R = pg.ring(layer = 5)
+    R.add_label('ring', position = (1,1), layer = 5)
+    D.add_ref(R).move((50,50))
+    D.write_gds('temp.gds')
+    h = pg.import_gds('temp.gds').hash_geometry()
+    assert(pg.import_gds('temp.gds', lazy = True).hash_geometry() == h)
+    for layers in [[(4,66)], [5], [(3,2), 5]]:
+        h = pg.import_gds('temp.gds', layers = layers).hash_geometry()
+        Dlazy = pg.import_gds('temp.gds', layers = layers, lazy = True)
+        assert(Dlazy.hash_geometry() == h)
+    Dparallel = pg.import_gds('temp.gds', num_workers = 2)
+    assert(Dparallel.hash_geometry() == pg.import_gds('temp.gds').hash_geometry())
+    assert(len(Dparallel.references) == 3)
+    Dlazy = pg.import_gds('temp.gds', cellname = 'ring', lazy = True)
+    assert(Dlazy._internal_name == 'ring')
+    assert(Dlazy.labels[0].text == 'ring')
+    h = pg.import_gds('temp.gds', cellname = 'ring').hash_geometry()
+    assert(Dlazy.hash_geometry() == h)
+
+
+def test_gds_reader():
+    from phidl.gdsii import GdsReader
+    D = Device()
+    D.add_polygon([(0,0), (1,0), (1,1)], layer = 1)
+    D.add_polygon([(0,0), (2,0), (2,2), (0,2)], layer = 1)
+    D.add_polygon([(5,5), (6,5), (6,6)], layer = (2,3))
+    D.write_gds('temp.gds', cellname = 'top')
+    with GdsReader('temp.gds') as reader:
+        assert(reader.cell_names == ['top'])
+        data = reader.read_cell('top')
+        assert(set(data.polygons.keys()) == {(1,0), (2,3)})
+        p1, p2 = data.polygons[(1,0)]
+        assert(np.allclose(p2, [(0,0), (2,0), (2,2), (0,2)]))
+        assert(p1.base is not None and p1.base is p2.base)
+        data = reader.read_cell('top', layers = {(2,3)})
+        assert(list(data.polygons.keys()) == [(2,3)])
+
+
+def test_gds_reader_hierarchy(tmp_path, monkeypatch):
+    from phidl.gdsii import GdsReader, write_gds
+    A = Device('A')
+    A.add_polygon([(0,0), (1,0), (1,1)], layer = 1)
+    T = Device('T')
+    T.add_ref(A)
+    T.add_array(A, columns = 2, rows = 2, spacing = (2,2))
+    B = Device('B')
+    B.add_polygon([(0,0), (5,0), (5,5)], layer = 2)
+    filename = str(tmp_path / 'hierarchy.gds')
+    write_gds(filename, [T, B], names = {T:'T', A:'A', B:'B'})
+    with GdsReader(filename) as reader:
+        assert(reader.get_references('T') == ['A', 'A'])
+        assert(reader.get_references('B') == [])
+        assert(sorted(reader.top_level()) == ['B', 'T'])
+        assert(reader.get_dependencies('T') == {'A'})
+    # Only the cells in the hierarchy of the requested cell are decoded
+    decoded = []
+    read_cell = GdsReader.read_cell
+    def counting_read_cell(self, name, layers = None):
+        decoded.append(name)
+        return read_cell(self, name, layers = layers)
+    monkeypatch.setattr(GdsReader, 'read_cell', counting_read_cell)
+    D = pg.import_gds(filename, cellname = 'T', lazy = True)
+    assert(sorted(decoded) == ['A', 'T'] and len(D.references) == 2)
+    with pytest.raises(ValueError):
+        pg.import_gds(filename, lazy = True)
+
+
+def test_write_and_import_compressed_gds(tmp_path):
+    D = Device()
+    D.add_ref(pg.rectangle(size=[1.5,2.7], layer = [3,2]))
+    D.add_polygon([[3,4,5], [6.7, 8.9, 10.15]], layer = [7,8])
+    D.add_array(pg.rectangle(size=[1,2], layer = [4,66]), rows = 3,
+                      columns = 2, spacing = [14,7.5])
+    h1 = D.hash_geometry(precision = 1e-4)
+    filename = str(tmp_path / 'temp.gds.gz')
+    D.write_gds(filename, precision = 1e-10, unit = 1e-6)
+    with open(filename, 'rb') as f:
+        assert(f.read(2) == b'\x1f\x8b')
+    Dimport = pg.import_gds(filename, flatten = False)
+    assert(h1 == Dimport.hash_geometry(precision = 1e-4))
+    # Compressed files can't be memory-mapped, lazy imports fall back
+    from phidl.gdsii import GdsReader
+    with pytest.raises(ValueError):
+        GdsReader(filename)
+    Dimport = pg.import_gds(filename, lazy = True)
+    assert(h1 == Dimport.hash_geometry(precision = 1e-4))
+    Dimport = pg.import_gds(filename, num_workers = 2)
+    assert(h1 == Dimport.hash_geometry(precision = 1e-4))
+
+
+def test_write_and_import_oas(tmp_path):
+    pytest.importorskip('gdstk')
+    D = Device()
+    R = pg.rectangle(size=[1.5,2.7], layer = [3,2])
+    R.add_port(name = 'p', midpoint = (1,2), width = 3, orientation = 90)
+    D.add_ref(R).rotate(30)
+    D.add_array(pg.rectangle(size=[1,2], layer = [4,66]), rows = 3,
+                      columns = 2, spacing = [14,7.5]).rotate(90).mirror()
+    D.add_label('hello', position = (3,3), layer = (5,1))
+    filename = str(tmp_path / 'temp.oas')
+    D.write_oas(filename, port_layer = 200)
+    Dimport = pg.import_oas(filename, port_layer = 200)
+    assert([type(r) for r in Dimport.references] == [type(r) for r in D.references])
+    assert(Dimport.references[1].spacing[0] == 14)
+    assert(Dimport.labels[0].text == 'hello')
+    assert(np.allclose(Dimport.references[0].parent.ports['p'].midpoint, (1,2)))
+    assert(pg.xor_diff(D, Dimport).area() < 1e-6)
+
+
+def test_write_gds_streaming():
+    import io, datetime
+    import gdspy
+    from phidl.gdsii import write_gds, _cells_in_dependency_order
+    D = Device()
+    D.add_ref(pg.snspd()).rotate(33).mirror()
+    D.add_array(pg.rectangle(layer = [4,66]), rows = 2, columns = 3,
+                spacing = [10,5]).rotate(20)
+    D.add_label('test', position = (1,2))
+    original_names = [c.name for c in [D] + list(D.get_dependencies(True))]
+    D.write_gds('temp.gds')
+    assert(original_names == [c.name for c in [D] + list(D.get_dependencies(True))])
+
+    # Output is identical to gdspy's writer
+    timestamp = datetime.datetime(2020, 1, 2, 3, 4, 5)
+    stream = io.BytesIO()
+    write_gds(stream, [D], timestamp = timestamp)
+    gdspy_stream = io.BytesIO()
+    lib = gdspy.GdsLibrary(name = 'library')
+    lib.write_gds(gdspy_stream, cells = _cells_in_dependency_order([D]),
+                  timestamp = timestamp)
+    assert(stream.getvalue() == gdspy_stream.getvalue())
+
+def test_write_gds_deduplicate():
+    D = Device()
+    for n in range(4):
+        D.add_ref(pg.compass(size = (4,2), layer = 1)).movex(10*n)
+        D.add_ref(pg.rectangle(size = (1,1), layer = 2)).movey(10*n)
+    D.add_ref(pg.rectangle(size = (2,1), layer = 2))
+    D.write_gds('temp.gds', deduplicate = True)
+    Dimport = pg.import_gds('temp.gds', flatten = False)
+    assert(len(Dimport.get_dependencies(True)) == 4)
+    assert(Dimport.hash_geometry() == D.hash_geometry())
+    assert(len(D.get_dependencies(True)) == 13)
+
+
+def test_device_lru_cache_disk(tmp_path, monkeypatch):
+    calls = []
+    @pg.device_lru_cache
+    def cached_rectangle(size = (1,2)):
+        calls.append(size)
+        D = pg.rectangle(size = size)
+        D.add_port(name = 'p', midpoint = (1,1), width = 1, orientation = 0)
+        return D
+    old_cache_dir = pg.device_lru_cache.cache_dir
+    pg.device_lru_cache.cache_dir = str(tmp_path)
+    try:
+        D1 = cached_rectangle(size = (3,4))
+        cached_rectangle.memo.clear()  # Simulate a new process
+        D2 = cached_rectangle(size = (3,4))
+        assert(len(calls) == 1)
+        assert(D2.hash_geometry() == D1.hash_geometry())
+        assert(D2.uid != D1.uid and D2.ports['p'].uid != D1.ports['p'].uid)
+        assert(len(list(tmp_path.glob('*.pkl'))) == 1)
+        cached_rectangle(size = (5,6))
+        assert(len(list(tmp_path.glob('*.pkl'))) == 2)
+        # Eviction keeps the directory below the size limit
+        cached_rectangle.cache_max_bytes = 1
+        cached_rectangle(size = (7,8))
+        assert(len(list(tmp_path.glob('*.pkl'))) == 0)
+        # The directory is not scanned again while it is below the limit
+        cached_rectangle.cache_max_bytes = 2**20
+        scans = []
+        evict = pg._evict_disk_cache
+        monkeypatch.setattr(pg, '_evict_disk_cache', lambda *args: scans.append(1) or evict(*args))
+        cached_rectangle(size = (9,10))
+        cached_rectangle(size = (11,12))
+        assert(len(scans) == 0 and len(list(tmp_path.glob('*.pkl'))) == 2)
+        cached_rectangle.cache_max_bytes = 1
+        cached_rectangle(size = (13,14))
+        assert(len(scans) == 1 and len(list(tmp_path.glob('*.pkl'))) == 0)
+        # Changes to constants and default arguments are new cache entries
+        areas = []
+        for source in ['def f(w = 2):\n    return pg.rectangle(size = (1,w))',
+                       'def f(w = 5):\n    return pg.rectangle(size = (1,w))',
+                       'def f(w = 2):\n    return pg.rectangle(size = (1,w+1))']:
+            namespace = {'pg' : pg} # No __name__, so f.__module__ is None
+            exec(source, namespace)
+            areas.append(pg.device_lru_cache(namespace['f'])().area())
+        assert(areas == [2, 5, 3])
+    finally:
+        pg.device_lru_cache.cache_dir = old_cache_dir
+
+
+def test_device_lru_cache_shared():
+    @pg.device_lru_cache(maxsize = 2, copy = False)
+    def cached_rectangle(size = (1,2)):
+        R = pg.rectangle(size = size)
+        R.add_port(name = 'p', midpoint = (0,1), width = 1, orientation = 180)
+        return R
+    R1 = cached_rectangle(size = (3,4))
+    R2 = cached_rectangle(size = (3,4))
+    assert(R1 is R2)
+    polygon = pg.rectangle(size = (1,1)).polygons[0]
+    for modify in [lambda: R1.add_polygon([(0,0), (1,0), (1,1)]),
+                   lambda: R1.move([1,1]),
+                   lambda: R1.add(polygon),
+                   lambda: R1.polygons.append(polygon),
+                   lambda: R1.references.extend([]),
+                   lambda: R1.ports['p'].__setattr__('width', 5),
+                   lambda: R1.ports['p'].midpoint.__setitem__(0, 5),
+                   lambda: R1.ports['p'].rotate(90),
+                   lambda: R1.ports.pop('p')]:
+        with pytest.raises(ValueError):
+            modify()
+    assert(len(R1.polygons) == 1 and R1.ports['p'].width == 1)
+    D = Device()
+    D.add_ref(R1).move([5,5])
+    D.add_ref(R2).rotate(90)
+    assert(D.references[0].ref_cell is D.references[1].ref_cell)
+    R3 = pg.deepcopy(R1)
+    R3.move([1,1])
+    R3.add(polygon)
+    R3.ports['p'].width = 5
+    R3.ports['p'].midpoint[0] = 2
+    assert(R1.ports['p'].width == 1 and len(R1.polygons) == 1)
+    assert(np.allclose(R1.ports['p'].midpoint, (0,1)))
+    assert(np.allclose(D.references[0].ports['p'].midpoint, (5,6)))
+    cached_rectangle(size = (5,6))
+    cached_rectangle(size = (7,8))
+    info = cached_rectangle.cache_info()
+    assert((info.hits, info.misses, info.maxsize, info.currsize) == (1, 3, 2, 2))
+    cached_rectangle.cache_clear()
+    assert(cached_rectangle.cache_info().currsize == 0)
+    # The gdspy mutators, labels, references and array views are frozen too
+    @pg.device_lru_cache(copy = False)
+    def cached_array(n = 3):
+        C = Device()
+        C.add_label('a', position = (1,1))
+        C.add_polygon([(0,0), (1,0), (1,1)])
+        C.add_ref(R1)
+        C.add_refs(pg.rectangle(), origins = [(x,0) for x in range(n)])
+        C.compact_polygons()
+        return C
+    C = cached_array(n = 3)
+    for modify in [lambda: R1.polygons[0].translate(1,1),
+                   lambda: R1.polygons[0].scale(2),
+                   lambda: R1.polygons[0].polygons[0].__setitem__(0, 5),
+                   lambda: C.polygons[0].translate(1,1),
+                   lambda: C.polygons[0].fracture(),
+                   lambda: C.polygons[0].polygons.append(np.zeros((3,2))),
+                   lambda: C.polygons[0].points.__setitem__(0, 5),
+                   lambda: C.labels[0].move([1,1]),
+                   lambda: C.labels[0].translate(1,1),
+                   lambda: C.references[0].translate(1,1),
+                   lambda: C.references[1][0].move([1,1]),
+                   lambda: C.references[1].origins.__setitem__(0, 5)]:
+        with pytest.raises(ValueError):
+            modify()
+    assert(C.references[0].ref_cell is R1)
+    # Only the Devices owned by the cache are frozen, not those of the caller
+    S = pg.rectangle()
+    @pg.device_lru_cache(128)
+    def cached_wrapper():
+        W = Device()
+        W.add_ref(S)
+        return W
+    cached_wrapper()
+    cached_wrapper()
+    assert(cached_wrapper.cache_info().maxsize == 128)
+    assert(cached_wrapper.cache_info().hits == 1)
+    W = pg.device_lru_cache(copy = False)(cached_wrapper.fn)()
+    assert(W._frozen and not S._frozen)
+    assert(W.references[0].ref_cell is not S)
+    S.move([1,1])
+    S.add_port(name = 'q', midpoint = (0,0), width = 1, orientation = 0)
+    # maxsize = 0 disables the cache
+    @pg.device_lru_cache(maxsize = 0, copy = False)
+    def uncached_rectangle():
+        return pg.rectangle()
+    assert(uncached_rectangle() is not uncached_rectangle())
+    assert(uncached_rectangle.cache_info().currsize == 0)
+    with pytest.raises(ValueError):
+        pg.device_lru_cache(maxsize = -1)(uncached_rectangle.fn)
+
+
 def test_packer():
     np.random.seed(5)
     D_list = [pg.ellipse(radii = np.random.rand(2)*n+2).move(np.random.rand(2)*100+2) for n in range(50)]